@@ -4,11 +4,10 @@ import json
 import logging
 import datetime
 from collections import OrderedDict
-from requests.utils import quote
-import xml.dom.minidom
 import requests
 from warcio.recordloader import ArcWarcRecordLoader
 from warcio.bufferedreaders import DecompressingBufferedReader
+from lib.cdx import CdxIndex, timestamp_to_string
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +18,9 @@ CDX_SERVER = os.environ.get('CDX_SERVER','http://localhost:9090/fc')
 
 WAYBACK_TS_FORMAT = '%Y%m%d%H%M%S'
 
+# Shared, so connections to the CDX server are re-used:
+cdx_index = CdxIndex(CDX_SERVER)
+
 
 def get_rendered_original_list(url, render_type='screenshot'):
     # Query URL
@@ -94,28 +96,19 @@ def list_from_cdx(qurl):
 
     :return: a list of matches by timestamp
     """
-    query = "%s?q=type:urlquery+url:%s" % (CDX_SERVER, quote(qurl))
-    logger.debug("Querying: %s" % query)
-    r = requests.get(query)
-    logger.debug("Availability response: %d" % r.status_code)
+    logger.debug("Querying: %s" % qurl)
     result_set = OrderedDict()
     # Is it known, with a matching timestamp?
-    if r.status_code == 200:
-        try:
-            dom = xml.dom.minidom.parseString(r.text)
-            for result in dom.getElementsByTagName('result'):
-                warc_file = result.getElementsByTagName('file')[0].firstChild.nodeValue
-                compressed_offset = result.getElementsByTagName('compressedoffset')[0].firstChild.nodeValue
-                capture_date = result.getElementsByTagName('capturedate')[0].firstChild.nodeValue
-                # Support compressed record length if present:
-                compressed_end_offset_elem = result.getElementsByTagName('compressedendoffset')
-                if len(compressed_end_offset_elem) > 0:
-                    compressed_end_offset = compressed_end_offset_elem[0].firstChild.nodeValue
-                else:
-                    compressed_end_offset = None
-                result_set[capture_date] = warc_file, compressed_offset, compressed_end_offset
-        except Exception as e:
-            logger.error("Lookup failed for %s!" % qurl)
-            logger.exception(e)
+    try:
+        for capture in cdx_index.query(qurl):
+            # Support compressed record length if present:
+            compressed_end_offset = capture.length
+            if compressed_end_offset is not None:
+                compressed_end_offset = str(compressed_end_offset)
+            result_set[timestamp_to_string(capture.timestamp)] = \
+                capture.filename, str(capture.offset), compressed_end_offset
+    except Exception as e:
+        logger.error("Lookup failed for %s!" % qurl)
+        logger.exception(e)
 
     return result_set
@@ -0,0 +1,12 @@
+-- migrate:up
+
+-- WARCs and logs can be larger than 2GB, so the size needs more than an INT:
+ALTER TABLE crawl_files ALTER COLUMN size TYPE BIGINT;
+-- Support listing files of a given type and stream in a date range:
+CREATE INDEX crawl_files_type_stream_created_at_idx ON crawl_files (type, stream, created_at);
+
+
+-- migrate:down
+
+DROP INDEX crawl_files_type_stream_created_at_idx;
+ALTER TABLE crawl_files ALTER COLUMN size TYPE INT;
@@ -1,61 +1,241 @@
+import json
+import codecs
 import logging
-import xml.dom.minidom
-from xml.parsers.expat import ExpatError
-import urllib.request
-from urllib.parse import quote_plus
+from collections import namedtuple, defaultdict
+from urllib.parse import quote_plus, urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import xml.etree.ElementTree as etree
+import requests
+from requests.adapters import HTTPAdapter
+from lib.sqlite_store import SqliteStore
 
 logger = logging.getLogger(__name__)
 
 
+# A single capture. N.B. the timestamp is parsed once, into an integer like 20130401120000, and the length and offset
+# are integers or None:
+CdxCapture = namedtuple('CdxCapture', ['urlkey', 'timestamp', 'url', 'mimetype', 'status_code', 'digest',
+                                       'redirect_url', 'length', 'offset', 'filename'])
+
+# How the wayback XML query API names the fields:
+XML_FIELDS = {
+    'urlkey': 'urlkey',
+    'capturedate': 'timestamp',
+    'url': 'url',
+    'mimetype': 'mimetype',
+    'httpresponsecode': 'status_code',
+    'digest': 'digest',
+    'redirecturl': 'redirect_url',
+    'compressedendoffset': 'length',
+    'compressedoffset': 'offset',
+    'file': 'filename',
+}
+
+
+def timestamp_to_string(timestamp):
+    '''
+    Turns an integer timestamp back into the usual 14-digit Wayback form.
+    '''
+    return "%014d" % timestamp
+
+
+def _to_int(value):
+    if value is None or value == '-' or value == '':
+        return None
+    return int(value)
+
+
+def _capture(urlkey, timestamp, url, mimetype, status_code, digest, redirect_url, length, offset, filename):
+    return CdxCapture(urlkey, int(timestamp), url, mimetype, status_code, digest, redirect_url,
+                      _to_int(length), _to_int(offset), filename)
+
+
+def _capture_from_fields(fields):
+    # Standard 11-field CDX (N b a m s k r M S V g), or the older 9-field form (N b a m s k r V g):
+    if len(fields) == 11:
+        return _capture(*(fields[:7] + fields[8:]))
+    elif len(fields) == 9:
+        return _capture(*(fields[:7] + [None] + fields[7:]))
+    raise ValueError("Unexpected CDX line with %i fields: %s" % (len(fields), fields))
+
+
 class CdxIndex():
     '''
     This class is used to query our CDX server.
     It knows what we've got, and when, but not what is open access or not.
+
+    Connections are kept alive and re-used between queries, and results are streamed and yielded one at a time, so
+    memory use does not depend on how many captures there are. Either the wayback XML query API or OutbackCDX's own
+    plain-text/JSON API can be used.
     '''
 
-    def __init__(self, cdx_server='http://bigcdx:8080/data-heritrix'):
+    def __init__(self, cdx_server='http://bigcdx:8080/data-heritrix', output='xml', batch=25000, timeout=None,
+                 max_connections=10, session=None):
+        '''
+        :param output: the default output format, 'xml', 'json' or 'plain'
+        :param batch: how many XML results to request per page
+        :param max_connections: how many connections to keep open, for use by multiple threads
+        '''
         self.cdx_server = cdx_server
+        self.output = output
+        self.batch = batch
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    def query(self, url, match_type='exact', limit=None, closest=None, output=None, from_ts=None, to_ts=None):
+        '''
+        Yields each capture of the given URL in turn.
+
+        :param match_type: 'exact' or 'prefix'
+        :param limit: the maximum number of captures to return
+        :param closest: a timestamp to sort the results by nearness to (not supported by the XML API)
+        :param output: override the default output format
+        :param from_ts: only return captures from this timestamp onwards
+        :param to_ts: only return captures up to and including this timestamp. N.B. the XML API does not support
+        either of these, so they are ignored by it, and callers must still check the timestamps.
+        :return: generator of CdxCapture
+        '''
+        output = output or self.output
+        if output == 'xml':
+            return self._query_xml(url, match_type, limit, closest)
+        elif output in ['json', 'plain']:
+            return self._query_native(url, match_type, limit, closest, output, from_ts, to_ts)
+        raise ValueError("Unknown CDX output format: %s" % output)
 
-    def _capture_dates_generator(self, url):
+    def _query_xml(self, url, match_type, limit, closest):
+        if closest is not None:
+            raise ValueError("Sorting by closest timestamp is not supported by the XML query API!")
+        query_type = 'prefixquery' if match_type == 'prefix' else 'urlquery'
+        # Paging, as we have a LOT of copies of some URLs:
+        offset = 0
+        while limit is None or offset < limit:
+            batch = self.batch if limit is None else min(self.batch, limit - offset)
+            q = "type:%s url:%s limit:%i offset:%i" % (query_type, quote_plus(url), batch, offset)
+            new_records = 0
+            for capture in self._stream_xml({'q': q}):
+                yield capture
+                new_records += 1
+            # Done?
+            if new_records < batch:
+                break
+            offset += batch
+
+    def _stream_xml(self, params):
+        logger.info("Getting %s %s" % (self.cdx_server, params))
+        with self.session.get(self.cdx_server, params=params, stream=True, timeout=self.timeout) as r:
+            # N.B. no results comes back as a 404 with an error message:
+            if r.status_code == 404:
+                return
+            r.raise_for_status()
+            r.raw.decode_content = True
+            parent = None
+            for event, elem in etree.iterparse(r.raw, events=('start', 'end')):
+                if event == 'start':
+                    if parent is None or elem.tag == 'results':
+                        parent = elem
+                elif elem.tag == 'result':
+                    values = dict.fromkeys(XML_FIELDS.values())
+                    for child in elem:
+                        if child.tag in XML_FIELDS:
+                            values[XML_FIELDS[child.tag]] = child.text
+                    yield _capture(**values)
+                    # Drop the parsed results, so memory use stays flat:
+                    parent.clear()
+
+    def _query_native(self, url, match_type, limit, closest, output, from_ts=None, to_ts=None):
+        params = {'url': url}
+        if match_type and match_type != 'exact':
+            params['matchType'] = match_type
+        if from_ts is not None:
+            params['from'] = from_ts if isinstance(from_ts, str) else timestamp_to_string(from_ts)
+        if to_ts is not None:
+            params['to'] = to_ts if isinstance(to_ts, str) else timestamp_to_string(to_ts)
+        if limit is not None:
+            params['limit'] = limit
+        if closest is not None:
+            params['closest'] = closest if isinstance(closest, str) else timestamp_to_string(closest)
+            params['sort'] = 'closest'
+        if output == 'json':
+            params['output'] = 'json'
+        logger.info("Getting %s %s" % (self.cdx_server, params))
+        with self.session.get(self.cdx_server, params=params, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 404:
+                return
+            r.raise_for_status()
+            if output == 'json':
+                for fields in self._iter_json_rows(r.iter_content(chunk_size=64 * 1024)):
+                    yield _capture_from_fields(fields)
+            else:
+                for line in r.iter_lines():
+                    if line:
+                        yield _capture_from_fields(line.decode('utf-8').split(' '))
+
+    @staticmethod
+    def _iter_json_rows(chunks):
+        '''
+        Incrementally decodes the rows of a JSON array of arrays, without holding the whole response in memory.
+        '''
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')()
+        chunks = iter(chunks)
+        buf = ''
+        pos = 0
+        started = False
+        while True:
+            # Skip over whitespace and separators:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf):
+                if not started:
+                    if buf[pos] != '[':
+                        raise ValueError("Expected a JSON array, got: %s" % buf[pos:pos + 100])
+                    started = True
+                    pos += 1
+                    continue
+                if buf[pos] == ']':
+                    return
+                try:
+                    row, end = decoder.raw_decode(buf, pos)
+                    # Skip any header row:
+                    if row[:2] != ['urlkey', 'timestamp']:
+                        yield row
+                    pos = end
+                    continue
+                except ValueError:
+                    # Probably an incomplete row, so read some more:
+                    pass
+            chunk = next(chunks, None)
+            if chunk is None:
+                if buf[pos:].strip():
+                    raise ValueError("Truncated JSON response: %s" % buf[pos:pos + 100])
+                return
+            buf = buf[pos:] + text_decoder.decode(chunk)
+            pos = 0
+
+    def _capture_dates_generator(self, url, limit=None):
         '''
         A generator that pages through the CDX results.
 
         :param url:
         :return: yeilds each capturedate in turn
         '''
-        # Paging, as we have a LOT of copies of some URLs:
-        batch = 25000
-        offset = 0
-        next_batch = True
-        while next_batch:
-            try:
-                # Get a batch:
-                q = "type:urlquery url:" + quote_plus(url) + (" limit:%i offset:%i" % (batch, offset))
-                cdx_query_url = "%s?q=%s" % (self.cdx_server, quote_plus(q))
-                logger.info("Getting %s" % cdx_query_url)
-                f = urllib.request.urlopen(cdx_query_url)
-                content = f.read()
-                f.close()
-                # Grab the capture dates:
-                dom = xml.dom.minidom.parseString(content)
-                new_records = 0
-                for de in dom.getElementsByTagName('capturedate'):
-                    yield de.firstChild.nodeValue
-                    new_records += 1
-                # Done?
-                if new_records == 0:
-                    next_batch = False
-                else:
-                    # Next batch:
-                    offset += batch
-            except ExpatError as e:
-                logger.warning("ExpatError on lookup: %s" % str(e))
-                logger.warning("ExpatError: URL was %s" % url)
-                next_batch = False
-            except Exception as e:
-                logger.warning("Exception on lookup: %s" % str(e))
-                logger.warning("Exception: URL was %s" % url)
-                next_batch = False
+        try:
+            for capture in self.query(url, limit=limit):
+                yield timestamp_to_string(capture.timestamp)
+        except etree.ParseError as e:
+            logger.warning("ParseError on lookup: %s" % str(e))
+            logger.warning("ParseError: URL was %s" % url)
+        except Exception as e:
+            logger.warning("Exception on lookup: %s" % str(e))
+            logger.warning("Exception: URL was %s" % url)
 
     def get_first_capture_date(self, url):
         '''
@@ -63,7 +243,7 @@ class CdxIndex():
         :param url:
         :return: None if there is none!
         '''
-        return next(self._capture_dates_generator(url), None)
+        return next(self._capture_dates_generator(url, limit=1), None)
 
     def get_capture_dates(self, url):
         '''
@@ -77,3 +257,218 @@ class CdxIndex():
             capture_dates.append(capture_date)
 
         return capture_dates
+
+
+class CaptureVerifier(object):
+    '''
+    Checks that captures are in the CDX index, running the lookups on a bounded pool of threads.
+
+    Each lookup asks for the single closest capture (or, for the XML API, stops as soon as the timestamp has been
+    passed), rather than listing every capture of the URL.
+    '''
+
+    def __init__(self, cdx, max_workers=10, output='json'):
+        self.cdx = cdx
+        self.max_workers = max_workers
+        self.output = output
+
+    def has_capture(self, url, timestamp):
+        timestamp = int(timestamp)
+        if self.output == 'xml':
+            # Results come back in timestamp order:
+            for capture in self.cdx.query(url, output='xml'):
+                if capture.timestamp >= timestamp:
+                    return capture.timestamp == timestamp
+            return False
+        for capture in self.cdx.query(url, closest=timestamp, limit=1, output=self.output):
+            return capture.timestamp == timestamp
+        return False
+
+    def verify(self, captures, max_checks=None, stop_on_miss=True):
+        '''
+        Looks up each (url, timestamp) pair, with at most max_workers lookups in flight at once.
+
+        The captures iterable is consumed lazily, and no more are taken once max_checks have been started, or a
+        capture has been found to be missing (if stop_on_miss is set).
+
+        :return: generator of (url, timestamp, found) tuples, in the order the lookups complete
+        '''
+        captures = iter(captures)
+        checks = 0
+        missing = False
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+            while True:
+                # Keep the pool busy, until we've started enough checks:
+                while len(pending) < self.max_workers and not (missing and stop_on_miss) and \
+                        (max_checks is None or checks < max_checks):
+                    capture = next(captures, None)
+                    if capture is None:
+                        break
+                    url, timestamp = capture
+                    pending[pool.submit(self.has_capture, url, timestamp)] = capture
+                    checks += 1
+                if not pending:
+                    break
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, timestamp = pending.pop(future)
+                    found = future.result()
+                    if not found:
+                        missing = True
+                    yield url, timestamp, found
+
+
+def canonical_url(url):
+    '''
+    A simple canonical form of a URL, for use as a key: lower-case scheme and host, no default port or fragment.
+    '''
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class FirstCaptureStore(SqliteStore):
+    '''
+    Remembers the first capture date of each URL.
+
+    Once a URL has been captured, its first capture date never changes, so only URLs that have been found are stored,
+    and any others are looked up again next time.
+    '''
+    table = 'first_captures'
+    key_columns = [('url', 'TEXT')]
+    value_columns = [('timestamp', 'TEXT')]
+
+    def get(self, url):
+        row = self._lookup((canonical_url(url),))
+        return row[0] if row else None
+
+    def update(self, first_captures):
+        '''
+        Records (url, timestamp) pairs.
+        '''
+        self._store_many([(canonical_url(url), timestamp) for url, timestamp in first_captures])
+
+
+def get_first_capture_dates(cdx, urls, store=None, max_workers=10):
+    '''
+    Looks up the first capture date of each URL, using the store where possible and only querying the CDX server for
+    the rest, with at most max_workers lookups in flight at once. New results are added to the store.
+
+    :return: dict of url -> 14-digit timestamp string, or None if there is no capture yet
+    '''
+    dates = {}
+    missing = []
+    for url in urls:
+        if url in dates:
+            continue
+        dates[url] = store.get(url) if store is not None else None
+        if dates[url] is None:
+            missing.append(url)
+    logger.info("Looking up first capture dates of %i of %i URLs..." % (len(missing), len(dates)))
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for url, timestamp in zip(missing, pool.map(cdx.get_first_capture_date, missing)):
+                dates[url] = timestamp
+        if store is not None:
+            store.update((url, dates[url]) for url in missing if dates[url] is not None)
+    return dates
+
+
+def _capture_key(url, timestamp):
+    # The index ignores the scheme, so captures are matched on the rest of the URL:
+    return canonical_url(url).split('://', 1)[-1], int(timestamp)
+
+
+class KnownCaptureStore(SqliteStore):
+    '''
+    Remembers which captures (URL and timestamp) have been found in the index.
+
+    Captures do not disappear from the index, so only those that have been found are stored, and any others are looked
+    up again next time.
+    '''
+    table = 'known_captures'
+    key_columns = [('url', 'TEXT'), ('timestamp', 'INTEGER')]
+
+    def __contains__(self, capture):
+        return self._contains(_capture_key(*capture))
+
+    def update(self, captures):
+        '''
+        Records (url, timestamp) pairs.
+        '''
+        self._store_many([_capture_key(url, timestamp) for url, timestamp in captures], replace=False)
+
+
+def _common_prefix(urls):
+    # The longest common prefix, cut back to the last '/' so it does not end part-way through a path segment:
+    prefix = urls[0]
+    for url in urls[1:]:
+        while not url.startswith(prefix):
+            prefix = prefix[:-1]
+    return prefix[:prefix.rfind('/') + 1]
+
+
+def find_captures(cdx, captures, store=None, max_results=100000, max_workers=4):
+    '''
+    Checks which of the (url, timestamp) captures are in the CDX index.
+
+    Rather than querying for each URL, the captures are grouped by host, and each group is checked with one prefix
+    query covering the group's URLs and time range. If that query returns more than max_results captures, the ones
+    still unresolved are looked up one at a time, as are groups of one. Captures already in the store are not looked
+    up, and new ones that are found are added to it.
+
+    The XML API cannot limit a prefix query to a time range, so if the index uses it, every capture is looked up one
+    at a time.
+
+    :return: set of the (url, timestamp) pairs that were found
+    '''
+    found = set()
+    known = set()
+    groups = defaultdict(dict)
+    for url, timestamp in captures:
+        if store is not None and (url, timestamp) in store:
+            known.add((url, timestamp))
+            continue
+        key = _capture_key(url, timestamp)
+        groups[key[0].split('/', 1)[0]].setdefault(key, []).append((url, timestamp))
+
+    singles = []
+    for host, wanted in groups.items():
+        if len(wanted) == 1 or cdx.output == 'xml':
+            for matched in wanted.values():
+                singles.extend(matched)
+            continue
+        prefix = _common_prefix(sorted(url for url, timestamp in wanted))
+        first_url = next(iter(wanted.values()))[0][0]
+        query_url = "%s://%s" % (urlsplit(first_url).scheme, prefix)
+        timestamps = [timestamp for url, timestamp in wanted]
+        logger.info("Checking %i captures under %s..." % (len(wanted), query_url))
+        results = 0
+        for capture in cdx.query(query_url, match_type='prefix', limit=max_results, from_ts=min(timestamps),
+                                 to_ts=max(timestamps)):
+            results += 1
+            matched = wanted.pop(_capture_key(capture.url, capture.timestamp), None)
+            if matched:
+                found.update(matched)
+                if not wanted:
+                    break
+        # Too many results to be sure about the rest, so look them up individually:
+        if wanted and results >= max_results:
+            logger.warning("Over %i captures under %s, so checking the other %i one at a time." % (
+                max_results, query_url, len(wanted)))
+            for matched in wanted.values():
+                singles.extend(matched)
+
+    if singles:
+        verifier = CaptureVerifier(cdx, max_workers=max_workers, output=cdx.output)
+        for url, timestamp, ok in verifier.verify(singles, stop_on_miss=False):
+            if ok:
+                found.add((url, timestamp))
+
+    if store is not None:
+        store.update(found)
+    return found | known
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import tempfile
+from urllib.parse import urlparse, parse_qs
+from lib.testing import FakeHandler, fake_server
+from lib.cdx import CdxIndex, CdxCapture, CaptureVerifier, FirstCaptureStore, get_first_capture_dates, \
+    KnownCaptureStore, find_captures
+
+# Some captures of one URL, in the standard 11-field CDX form:
+CAPTURES = [
+    ["uk,co,example)/", "2013040112%04i" % i, "http://example.co.uk/", "text/html", "200",
+     "SHA1DIGEST%i" % i, "-", "-", str(1000 + i), str(20000 * i), "BL-%i.warc.gz" % i]
+    for i in range(7)
+]
+
+
+class FakeCdxHandler(FakeHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.server.client_ports.add(self.client_address[1])
+        params = parse_qs(urlparse(self.path).query)
+        if 'q' in params:
+            # Wayback XML query API, with paging:
+            q = params['q'][0]
+            limit = int(re.search(r'limit:(\d+)', q).group(1))
+            offset = int(re.search(r'offset:(\d+)', q).group(1))
+            results = ""
+            for c in CAPTURES[offset:offset + limit]:
+                results += "<result><compressedoffset>%s</compressedoffset><mimetype>%s</mimetype><file>%s</file>" \
+                           "<redirecturl>%s</redirecturl><urlkey>%s</urlkey><digest>%s</digest>" \
+                           "<httpresponsecode>%s</httpresponsecode><robotflags>-</robotflags><url>%s</url>" \
+                           "<capturedate>%s</capturedate><compressedendoffset>%s</compressedendoffset></result>" % (
+                    c[9], c[3], c[10], c[6], c[0], c[5], c[4], c[2], c[1], c[8])
+            body = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><wayback><request><url>%s</url></request>" \
+                   "<results>%s</results></wayback>" % (q, results)
+            content_type = 'text/xml'
+        else:
+            # OutbackCDX API:
+            rows = CAPTURES
+            if 'closest' in params:
+                closest = int(params['closest'][0])
+                rows = sorted(rows, key=lambda c: abs(int(c[1]) - closest))
+            if 'limit' in params:
+                rows = rows[:int(params['limit'][0])]
+            if params.get('output', [''])[0] == 'json':
+                # One row per line, with numbers as numbers:
+                body = "[" + ",\n".join(json.dumps(r[:8] + [int(r[8]), int(r[9]), r[10]]) for r in rows) + "]\n"
+                content_type = 'application/json'
+            else:
+                body = "".join("%s\n" % " ".join(r) for r in rows)
+                content_type = 'text/plain'
+        self.send_body(body, content_type)
+
+
+def fake_cdx_server():
+    return fake_server(FakeCdxHandler, client_ports=set(), requests=0)
+
+
+def test_cdx_outputs_agree():
+    with fake_cdx_server() as server:
+        cdx_server = server.base_url + "/fc"
+        expected = [CdxCapture(c[0], int(c[1]), c[2], c[3], c[4], c[5], c[6], int(c[8]), int(c[9]), c[10])
+                    for c in CAPTURES]
+        # Page through the XML three results at a time, over one kept-alive connection:
+        cdx = CdxIndex(cdx_server, batch=3)
+        assert list(cdx.query("http://example.co.uk/")) == expected
+        assert server.requests == 3
+        assert len(server.client_ports) == 1
+        assert list(cdx.query("http://example.co.uk/", output='json')) == expected
+        assert list(cdx.query("http://example.co.uk/", output='plain')) == expected
+
+        # Closest, limited to one row:
+        closest = list(cdx.query("http://example.co.uk/", output='json', closest=20130401120004, limit=1))
+        assert [c.timestamp for c in closest] == [20130401120004]
+
+        # And the older string-based API:
+        assert cdx.get_first_capture_date("http://example.co.uk/") == "20130401120000"
+        assert cdx.get_capture_dates("http://example.co.uk/") == [c[1] for c in CAPTURES]
+
+
+def test_json_rows_split_across_chunks():
+    body = '[["urlkey","timestamp"],\n["a", 1, [2, "]"]], ["b",\n 3]]'.encode('utf-8')
+    chunks = [body[i:i + 5] for i in range(0, len(body), 5)]
+    assert list(CdxIndex._iter_json_rows(chunks)) == [["a", 1, [2, "]"]], ["b", 3]]
+
+
+def test_capture_verifier():
+    with fake_cdx_server() as server:
+        cdx_server = server.base_url + "/fc"
+        for output in ['json', 'xml']:
+            verifier = CaptureVerifier(CdxIndex(cdx_server, batch=3), max_workers=3, output=output)
+            checks = [("http://example.co.uk/", c[1]) for c in CAPTURES]
+            results = list(verifier.verify(iter(checks), max_checks=5))
+            assert len(results) == 5
+            assert all(found for url, timestamp, found in results)
+
+            # Stops taking new checks once one is missing:
+            checks = [("http://example.co.uk/", "20010101000000")] + checks
+            results = list(CaptureVerifier(CdxIndex(cdx_server), max_workers=1, output=output).verify(checks))
+            assert results == [("http://example.co.uk/", "20010101000000", False)]
+
+
+def test_first_capture_dates_are_cached():
+    with fake_cdx_server() as server:
+        cdx_server = server.base_url + "/fc"
+        cdx = CdxIndex(cdx_server)
+        urls = ['http://example.co.uk/', 'http://example.co.uk/a', 'http://example.co.uk/b']
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FirstCaptureStore(os.path.join(tmp, 'first-captures.sqlite'))
+            dates = get_first_capture_dates(cdx, urls, store, max_workers=3)
+            assert dates == dict((url, '20130401120000') for url in urls)
+            assert server.requests == 3
+            store.close()
+
+            # Only new URLs are looked up next time:
+            store = FirstCaptureStore(os.path.join(tmp, 'first-captures.sqlite'))
+            dates = get_first_capture_dates(cdx, ['HTTP://Example.co.uk:80', 'http://example.co.uk/c'] + urls, store)
+            assert dates['HTTP://Example.co.uk:80'] == '20130401120000'
+            assert server.requests == 4
+            assert len(store) == 4
+            store.close()
+
+
+def test_find_captures():
+    with fake_cdx_server() as server:
+        cdx_server = server.base_url + "/fc"
+        cdx = CdxIndex(cdx_server, output='json')
+        captures = [("http://example.co.uk/", c[1]) for c in CAPTURES] + [
+            ("https://EXAMPLE.co.uk/", CAPTURES[3][1]),
+            ("http://example.co.uk/", "20010101000000"),
+            ("http://example.org/report.pdf", "20200101000000")]
+        with tempfile.TemporaryDirectory() as tmp:
+            store = KnownCaptureStore(os.path.join(tmp, 'known-captures.sqlite'))
+            # One prefix query for the host with lots of captures, and one lookup for the other:
+            found = find_captures(cdx, captures, store)
+            assert found == set(captures[:8])
+            assert server.requests == 2
+            assert len(store) == 7
+
+            # Only the ones that were not found are looked up next time:
+            found = find_captures(cdx, captures, store)
+            assert found == set(captures[:8])
+            assert server.requests == 4
+
+            # If the prefix query returns too much, the rest are checked individually (1 query + 3 lookups):
+            found = find_captures(cdx, captures[-2:] + [("http://example.org/", "20200101000000")], max_results=3)
+            assert found == set()
+            assert server.requests == 8
+            store.close()
+
+        # The XML API would return every capture under the prefix, whenever it was, so it is not used for that:
+        found = find_captures(CdxIndex(cdx_server), captures[:2])
+        assert found == set(captures[:2])
+        assert server.requests == 10
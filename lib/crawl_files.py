@@ -0,0 +1,143 @@
+import io
+import csv
+import logging
+import datetime
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# The columns that are loaded from the HDFS listing (the status, digest and stats columns are managed separately):
+LOADED_COLUMNS = ['filename', 'job_name', 'job_launch', 'full_path', 'extension', 'type', 'size', 'created_at',
+                  'storage_uri', 'stream', 'terms']
+
+# The columns that record indexing status:
+STATUS_COLUMNS = ['cdx_index_status', 'solr_index_status']
+
+
+class _CsvStream(object):
+    """
+    Presents an iterable of rows as a file of CSV, which COPY reads from a chunk at a time.
+    """
+
+    def __init__(self, rows, columns):
+        self.rows = iter(rows)
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.pending = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow([row.get(c, None) for c in self.columns])
+            self.count += 1
+            # Move whatever has been written into the pending text:
+            if self.buffer.tell() > 64 * 1024:
+                self.pending += self.buffer.getvalue()
+                self.buffer.seek(0)
+                self.buffer.truncate()
+        self.pending += self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if size < 0:
+            size = len(self.pending)
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+
+class CrawlFilesDB(object):
+    """
+    Keeps track of crawl files in the crawl_files table (see db/migrations).
+
+    Files are loaded in bulk, by COPYing them into a temporary staging table and then inserting or updating them all
+    with a single statement, rather than one document at a time.
+    """
+
+    def __init__(self, dsn=None, connection=None):
+        """
+        :param dsn: a libpq connection string, e.g. "host=ingest dbname=ingest_task_state user=ingest"
+        """
+        self.connection = connection or psycopg2.connect(dsn)
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, rows, seen_at=None):
+        """
+        Inserts or updates the given files.
+
+        Each row is a dict using the LOADED_COLUMNS names, where empty values are treated as NULL. Existing status
+        columns are left alone, and last_seen_at is set to seen_at for every file.
+
+        :return: dict with the number of files 'inserted' and 'updated'
+        """
+        seen_at = seen_at or datetime.datetime.utcnow()
+        stream = _CsvStream(rows, LOADED_COLUMNS)
+        columns = ", ".join(LOADED_COLUMNS)
+        with self.connection:
+            with self.connection.cursor() as cur:
+                cur.execute(
+                    "CREATE TEMPORARY TABLE crawl_files_staging ("
+                    "filename TEXT, job_name TEXT, job_launch TEXT, full_path TEXT, extension TEXT, type TEXT, "
+                    "size BIGINT, created_at TIMESTAMP, storage_uri TEXT, stream TEXT, terms TEXT"
+                    ") ON COMMIT DROP")
+                # N.B. the primary key columns cannot be NULL, so empty values are kept as empty strings:
+                cur.copy_expert("COPY crawl_files_staging (%s) FROM STDIN WITH "
+                                "(FORMAT csv, FORCE_NOT_NULL (filename, job_name, job_launch))" % columns, stream)
+                logger.info("Copied %i rows into the staging table." % stream.count)
+                # The same file may be listed more than once (e.g. if it has been copied), so only keep the first:
+                cur.execute(
+                    "WITH upserted AS ("
+                    " INSERT INTO crawl_files (%s, last_seen_at)"
+                    " SELECT DISTINCT ON (filename, job_name, job_launch)"
+                    "  filename, job_name, job_launch, full_path, extension, type, size, created_at,"
+                    "  ARRAY[storage_uri], stream, terms, %%s"
+                    " FROM crawl_files_staging"
+                    " ORDER BY filename, job_name, job_launch, full_path"
+                    " ON CONFLICT (filename, job_name, job_launch) DO UPDATE SET"
+                    "  full_path = EXCLUDED.full_path, extension = EXCLUDED.extension, type = EXCLUDED.type,"
+                    "  size = EXCLUDED.size, created_at = EXCLUDED.created_at, storage_uri = EXCLUDED.storage_uri,"
+                    "  stream = EXCLUDED.stream, terms = EXCLUDED.terms, last_seen_at = EXCLUDED.last_seen_at"
+                    " RETURNING (xmax = 0) AS inserted"
+                    ") SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted"
+                    % columns, (seen_at,))
+                inserted, updated = cur.fetchone()
+        logger.info("Inserted %i and updated %i crawl files." % (inserted, updated))
+        return {'inserted': inserted, 'updated': updated}
+
+    def set_status(self, status_column, full_paths, value):
+        """
+        Sets the status of all the given files at once.
+
+        :return: the number of files updated
+        """
+        if status_column not in STATUS_COLUMNS:
+            raise ValueError("Unknown status column: %s" % status_column)
+        with self.connection:
+            with self.connection.cursor() as cur:
+                cur.execute("UPDATE crawl_files SET %s = %%s WHERE full_path = ANY(%%s)" % status_column,
+                            (value, list(full_paths)))
+                return cur.rowcount
+
+    def files_needing_status(self, status_column, status_value, start_date, end_date, stream='frequent',
+                             kind='warcs', limit=1000):
+        """
+        Lists the files of a given kind, created between two dates (inclusive), that do not have the given status,
+        e.g. WARCs that have not yet been CDX indexed.
+
+        :return: list of full paths, oldest first
+        """
+        if status_column not in STATUS_COLUMNS:
+            raise ValueError("Unknown status column: %s" % status_column)
+        with self.connection:
+            with self.connection.cursor() as cur:
+                cur.execute(
+                    "SELECT full_path FROM crawl_files"
+                    " WHERE type = %%s AND stream = %%s AND created_at >= %%s AND created_at < %%s"
+                    " AND %s IS DISTINCT FROM %%s"
+                    " ORDER BY created_at, full_path LIMIT %%s" % status_column,
+                    (kind, stream, start_date, end_date + datetime.timedelta(days=1), status_value, limit))
+                return [r[0] for r in cur.fetchall()]
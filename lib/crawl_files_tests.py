@@ -0,0 +1,71 @@
+import os
+import csv
+import glob
+import datetime
+import pytest
+from lib.crawl_files import CrawlFilesDB, LOADED_COLUMNS, _CsvStream
+
+# Point this at a throwaway database to run the database tests, e.g. "dbname=crawl_files_test":
+TEST_DSN = os.environ.get('CRAWL_FILES_TEST_DSN')
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../db/migrations')
+
+
+def _files(n, day=1, size=100):
+    return [{
+        'filename': 'BL-%i.warc.gz' % i, 'job_name': 'frequent', 'job_launch': '20190801000000',
+        'full_path': '/heritrix/output/frequent/20190801000000/warcs/BL-%i.warc.gz' % i, 'extension': '.warc.gz',
+        'type': 'warcs', 'size': size, 'created_at': datetime.datetime(2019, 8, day, 12, 0, i % 60).isoformat(),
+        'storage_uri': 'hdfs://hdfs:54310/heritrix/output/frequent/20190801000000/warcs/BL-%i.warc.gz' % i,
+        'stream': 'frequent', 'terms': 'npld'
+    } for i in range(n)]
+
+
+def test_csv_stream():
+    rows = _files(1000)
+    stream = _CsvStream(rows, LOADED_COLUMNS)
+    text = ''
+    chunk = stream.read(100)
+    while chunk:
+        assert len(chunk) <= 100
+        text += chunk
+        chunk = stream.read(100)
+    assert stream.count == 1000
+    assert list(csv.reader(text.splitlines())) == [[str(r[c]) for c in LOADED_COLUMNS] for r in rows]
+
+
+@pytest.fixture
+def db():
+    if not TEST_DSN:
+        pytest.skip("Set CRAWL_FILES_TEST_DSN to run against a throwaway PostgreSQL database.")
+    db = CrawlFilesDB(TEST_DSN)
+    with db.connection, db.connection.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS crawl_files")
+        # Apply the 'up' part of each migration:
+        for migration in sorted(glob.glob(os.path.join(MIGRATIONS, '*.sql'))):
+            with open(migration) as f:
+                cur.execute(f.read().split('-- migrate:down')[0])
+    yield db
+    with db.connection, db.connection.cursor() as cur:
+        cur.execute("DROP TABLE crawl_files")
+    db.close()
+
+
+def test_load_and_query(db):
+    assert db.load(_files(50)) == {'inserted': 50, 'updated': 0}
+    # Loading again updates, and adds the new ones (including files bigger than 2GB):
+    assert db.load(_files(60, size=3 * 1024 * 1024 * 1024)) == {'inserted': 10, 'updated': 50}
+    # Files without a job can be loaded too, and files listed twice are only loaded once:
+    unknown = [dict(f, job_name='', job_launch='', full_path='/unknown/%s' % f['filename']) for f in _files(2)]
+    assert db.load(unknown + unknown) == {'inserted': 2, 'updated': 0}
+
+    day = datetime.date(2019, 8, 1)
+    todo = db.files_needing_status('cdx_index_status', 'data-heritrix', day, day, limit=1000)
+    assert len(todo) == 62
+    assert db.set_status('cdx_index_status', todo[:40], 'data-heritrix') == 40
+    assert db.files_needing_status('cdx_index_status', 'data-heritrix', day, day) == todo[40:]
+    assert db.files_needing_status('cdx_index_status', 'data-heritrix', day, day, stream='domain') == []
+
+    # The status is kept when the files are loaded again:
+    db.load(_files(60))
+    assert len(db.files_needing_status('cdx_index_status', 'data-heritrix', day, day)) == 22
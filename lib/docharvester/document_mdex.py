@@ -16,23 +16,88 @@ import logging
 import requests
 from urllib.parse import urlparse
 from lxml import html
-from lib.surt import url_to_surt
+from lib.surt import url_to_surt, SurtPrefixIndex
 
 logger = logging.getLogger('luigi-interface')
 
 
+class RetryLater(Exception):
+    '''
+    Raised instead of waiting to retry a request, when DocumentMDEx is asked to defer retries to the caller.
+    '''
+    pass
+
+
+class WatchedTargetIndex(object):
+    '''
+    Indexes the seeds of the Watched Targets by host SURT, so the Targets that match a URL can be found in one pass
+    over the URL's SURT, rather than by converting and checking every seed of every Target.
+
+    Build it once per set of targets and share it between DocumentMDEx instances.
+    '''
+
+    def __init__(self, targets):
+        self.targets = targets
+        self._index = SurtPrefixIndex()
+        for i, t in enumerate(targets):
+            if t['watched']:
+                for seed in t['seeds']:
+                    prefix = url_to_surt(seed, host_only=True)
+                    if prefix in self._index:
+                        self._index.longest_match(prefix)[1].add(i)
+                    else:
+                        self._index.add(prefix, {i})
+
+    def matching_targets(self, url):
+        '''
+        The Watched Targets with a seed whose host SURT is a prefix of the URL's SURT, in their original order.
+        '''
+        indexes = set()
+        for prefix, target_indexes in self._index.matches(url_to_surt(url)):
+            indexes.update(target_indexes)
+        return [self.targets[i] for i in sorted(indexes)]
+
+
+_shared_index = None
+
+
+def watched_target_index(targets):
+    '''
+    Returns a WatchedTargetIndex for the given list of targets, re-using the last one built if it was for the same
+    list.
+    '''
+    global _shared_index
+    index = _shared_index
+    if index is None or index.targets is not targets:
+        index = WatchedTargetIndex(targets)
+        _shared_index = index
+    return index
+
+
 class DocumentMDEx(object):
     '''
     Given a Landing Page extract additional metadata.
     '''
 
-    def __init__(self, targets, document, source, null_if_no_target_found=True):
+    def __init__(self, targets, document, source, null_if_no_target_found=True, target_index=None, session=None,
+                 fetch_cache=None, head_tries=5, defer_retries=False):
         '''
         The connection to W3ACT and the Document to be enhanced.
+
+        A shared WatchedTargetIndex for the targets can be passed in, otherwise one is built when needed. Likewise, a
+        shared requests.Session can be used for fetching landing pages, or a FetchCache shared between documents.
+
+        If defer_retries is set, requests that would be retried after a pause raise RetryLater instead, so the caller
+        can try the document again later rather than waiting.
         '''
         if not targets:
             raise Exception("The Targets passed to DocumentMDEx cannot by empty!")
         self.targets = targets
+        self.target_index = target_index
+        self.session = session or requests
+        self.fetch_cache = fetch_cache
+        self.head_tries = head_tries
+        self.defer_retries = defer_retries
         self.doc = document
         self.source = source
         self.null_if_no_target_found = null_if_no_target_found
@@ -53,16 +118,9 @@ class DocumentMDEx(object):
         Given a URL and an array of publisher strings, determine which Watched Target to associate them with.
         '''
         # Find the list of Targets where a seed matches the given URL
-        tsurt = url_to_surt(url)
-        matches = []
-        for t in self.targets:
-            if t['watched']:
-                a_match = False
-                for seed in t['seeds']:
-                    if tsurt.startswith(url_to_surt(seed, host_only=True)):
-                        a_match = True
-                if a_match:
-                    matches.append(t)
+        if self.target_index is None:
+            self.target_index = WatchedTargetIndex(self.targets)
+        matches = self.target_index.matching_targets(url)
 
         # No matches:
         if len(matches) == 0:
@@ -122,6 +180,8 @@ class DocumentMDEx(object):
                 self.mdex_ifs_reports()
             else:
                 self.mdex_default()
+        except RetryLater:
+            raise
         except Exception as e:
             logger.error("Ignoring error during extraction for document %s and landing page %s" % (self.doc['document_url'], self.doc['landing_page_url']))
             logger.exception(e)
@@ -148,6 +208,22 @@ class DocumentMDEx(object):
         # Or return the modified version:
         return self.doc
     
+    def _get(self, url):
+        if self.fetch_cache is not None:
+            return self.fetch_cache.get(url)
+        return self.session.get(url)
+
+    def _html(self, url, base_url=None, response=None):
+        # If the page has already been fetched, it is parsed rather than fetched again:
+        if self.fetch_cache is not None:
+            return self.fetch_cache.html(url, base_url)
+        if response is None:
+            response = self.session.get(url)
+        h = html.fromstring(response.content)
+        if base_url:
+            h.make_links_absolute(base_url)
+        return h
+
     def _get0(self, result):
         if len(result) > 0:
             return result[0].strip()
@@ -158,9 +234,7 @@ class DocumentMDEx(object):
         ''' Default extractor uses landing page for title etc.'''
         # Grab the landing page URL as HTML
         logger.info("Getting %s" % self.lp_wb_url())
-        r = requests.get(self.lp_wb_url(), stream=True)
-        h = html.fromstring(r.content)
-        h.make_links_absolute(self.doc["landing_page_url"])
+        h = self._html(self.lp_wb_url(), self.doc["landing_page_url"])
         logger.info("Looking for links...")
         # Attempt to find the nearest prior header:
         for a in h.xpath("//a[@href]"):
@@ -192,10 +266,10 @@ class DocumentMDEx(object):
         # Start by grabbing the Link-rel-up header to refine the landing page url:
         # e.g. https://www.gov.uk/government/uploads/system/uploads/attachment_data/file/497662/accidents-involving-illegal-alcohol-levels-2014.pdf
         # Link: <https://www.gov.uk/government/statistics/reported-road-casualties-in-great-britain-estimates-involving-illegal-alcohol-levels-2014>; rel="up"
-        tries = 5
+        tries = self.head_tries
         success = False
         while tries > 0:
-            r = requests.head(url=self.doc_wb_url(), allow_redirects=True)
+            r = self.session.head(url=self.doc_wb_url(), allow_redirects=True)
             if 'up' in r.links:
                 lpu = r.links['up']
                 self.doc["landing_page_url"] = lpu['url']
@@ -204,7 +278,10 @@ class DocumentMDEx(object):
             else:
                 logger.info("Could not find 'up' relationship!")
                 tries -= 1
-                time.sleep(10)
+                if self.defer_retries:
+                    raise RetryLater("Could not find rel['up'] relationship for %s" % self.doc_wb_url())
+                if tries > 0:
+                    time.sleep(10)
         # Fail if we could not contact the API:
         if not success:
             self.doc['api_call_failed'] = "Could not find rel['up'] relationship."
@@ -217,7 +294,7 @@ class DocumentMDEx(object):
                 api_json_url = lp_url._replace( path="/api/content%s" % lp_url.path)
                 api_json_url = api_json_url.geturl()
                 logger.debug("Downloading and parsing from API: %s" % api_json_url)
-                r = requests.get(api_json_url)
+                r = self._get(api_json_url)
                 if r.status_code != 200:
                     logger.warning("Got status code %s for URL %s" % (r.status_code, api_json_url))
                     logger.warning("Response: %s" % r.content)
@@ -235,12 +312,12 @@ class DocumentMDEx(object):
             # Grab the landing page URL as HTML:
             # TODO This could all be pulled out of the Content API, if it's stable enough.
             logger.debug("Downloading and parsing: %s" % self.doc['landing_page_url'])
-            r = requests.get(self.lp_wb_url())
+            r = self._get(self.lp_wb_url())
             if r.status_code != 200:
                 logger.warning("Got status code %s for URL %s" % (r.status_code, self.lp_wb_url()))
                 logger.warning("Response: %s" % r.content)
                 raise Exception("Could not download the landing page!")
-            h = html.fromstring(r.content)
+            h = self._html(self.lp_wb_url(), response=r)
             # Attempt to extract resourse-level metadata (overriding publication-level metadata):
             # Look through landing page for links, find metadata section corresponding to the document:
             matches = 0
@@ -278,8 +355,7 @@ class DocumentMDEx(object):
                 self.mdex_default()
                 return
         # Grab the landing page URL as HTML
-        r = requests.get(self.lp_wb_url())
-        h = html.fromstring(r.content)
+        h = self._html(self.lp_wb_url())
         # Extract the metadata:
         self.doc['title'] = self._get0(h.xpath("//*[contains(@itemtype, 'http://schema.org/CreativeWork')]//*[contains(@itemprop,'name')]/text()")).strip()
         self.doc['publication_date'] = self._get0(h.xpath("//*[contains(@itemtype, 'http://schema.org/CreativeWork')]//*[contains(@itemprop,'datePublished')]/@content"))
@@ -0,0 +1,79 @@
+import json
+import random
+from collections import Counter
+from lib.surt import url_to_surt
+from lib.docharvester.document_mdex import DocumentMDEx, WatchedTargetIndex, watched_target_index
+
+HOSTS = ['www.gov.uk', 'gov.uk', 'assets.publishing.service.gov.uk', 'www.ifs.org.uk', 'ifs.org.uk',
+         'example.com', 'example.com:8080', 'foo.example.com', 'foobar.com', 'bar.org']
+
+
+def _scan(targets, url):
+    # How the targets used to be matched, checking every seed of every target:
+    tsurt = url_to_surt(url)
+    matches = []
+    for t in targets:
+        if t['watched']:
+            if any(tsurt.startswith(url_to_surt(seed, host_only=True)) for seed in t['seeds']):
+                matches.append(t)
+    return matches
+
+
+def test_index_matches_scan():
+    r = random.Random(1)
+    targets = []
+    for tid in range(200):
+        seeds = ['%s://%s/%s' % (r.choice(['http', 'https']), r.choice(HOSTS), r.choice(['', 'a/', 'a/b/c']))
+                 for i in range(r.randint(0, 3))]
+        targets.append({'id': tid, 'title': 'Target %i' % tid, 'watched': r.random() < 0.5, 'seeds': seeds})
+
+    index = watched_target_index(targets)
+    assert watched_target_index(targets) is index
+    assert watched_target_index(list(targets)) is not index
+    for host in HOSTS + ['other.net', 'uk']:
+        for path in ['/', '/a/doc.pdf', '/x/y/z.pdf']:
+            url = 'https://%s%s' % (host, path)
+            assert index.matching_targets(url) == _scan(targets, url)
+    assert WatchedTargetIndex([]).matching_targets('http://www.gov.uk/') == []
+
+
+class FakeResponse(object):
+    def __init__(self, url, content=b'', links=None):
+        self.url = url
+        self.status_code = 200
+        self.reason = 'OK'
+        self.headers = {}
+        self.content = content
+        self.links = links or {}
+
+
+class CountingGovUk(object):
+    '''
+    Stands in for the requests session, counting the GETs of each URL.
+    '''
+
+    def __init__(self):
+        self.gets = Counter()
+
+    def head(self, url, allow_redirects=True):
+        return FakeResponse(url, links={'up': {'url': 'https://www.gov.uk/government/publications/report'}})
+
+    def get(self, url, timeout=None):
+        self.gets[url] += 1
+        if '/api/content/' in url:
+            return FakeResponse(url, json.dumps({'title': 'Report', 'first_published_at': '2019-10-16T09:30:00Z',
+                                                 'links': {'organisations': [{'title': 'Department for Transport'}]}
+                                                 }).encode())
+        return FakeResponse(url, b'<html><body><div class="attachment-details"><h2 class="title">'
+                                 b'<a href="/report.pdf">Report</a></h2></div></body></html>')
+
+
+def test_landing_page_fetched_once():
+    targets = [{'id': 1, 'title': 'Department for Transport', 'watched': True, 'seeds': ['https://www.gov.uk/']}]
+    session = CountingGovUk()
+    doc = {'document_url': 'https://www.gov.uk/uploads/report.pdf', 'filename': 'report.pdf',
+           'landing_page_url': 'https://www.gov.uk/uploads', 'source': None}
+    result = DocumentMDEx(targets, doc, None, session=session).mdex()
+    assert (result['title'], result['target_id']) == ('Report', 1)
+    # Without a FetchCache, the landing page is parsed from the response that was checked, not fetched again:
+    assert session.gets['https://www.gov.uk/government/publications/report'] == 1
@@ -0,0 +1,157 @@
+'''
+A short-lived cache of landing page fetches, shared by the metadata extractors.
+
+Many documents link back to the same landing page, so this avoids fetching and parsing the same page again for each
+one, and makes sure only one request for a given URL is in flight at a time.
+'''
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from lxml import html
+import requests
+from lib.cdx import canonical_url
+
+logger = logging.getLogger('luigi-interface')
+
+
+class CachedResponse(object):
+    '''
+    The parts of a requests.Response that the extractors use, which can be kept after the connection is released.
+    '''
+
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+
+class FetchCache(object):
+    '''
+    Caches GET responses, keyed by canonical URL, for up to ttl seconds and within max_entries/max_bytes, and the
+    parsed HTML of those responses for a shorter tree_ttl. Only successful (2xx) responses are cached, so that a
+    transient error is not passed on to every document that shares the page.
+
+    Parsed trees are shared, so callers must not modify them.
+    '''
+
+    def __init__(self, session=None, ttl=600, max_entries=1000, max_bytes=256 * 1024 * 1024, tree_ttl=60,
+                 max_trees=100, timeout=None):
+        self.session = session or requests.Session()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.tree_ttl = tree_ttl
+        self.max_trees = max_trees
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()
+        self._trees = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+        # Metrics:
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def _cached(self, cache, key):
+        # Must hold the lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            self._drop(cache, key)
+            return None
+        cache.move_to_end(key)
+        return value
+
+    def _drop(self, cache, key):
+        # Must hold the lock:
+        expires, value = cache.pop(key)
+        if cache is self._responses:
+            self._bytes -= len(value.content)
+
+    def _store_response(self, key, response):
+        # Must hold the lock:
+        if key in self._responses:
+            self._drop(self._responses, key)
+        self._responses[key] = (time.time() + self.ttl, response)
+        self._bytes += len(response.content)
+        while len(self._responses) > self.max_entries or (self._bytes > self.max_bytes and len(self._responses) > 1):
+            self._drop(self._responses, next(iter(self._responses)))
+
+    def _fetch(self, url):
+        with self._lock:
+            self.fetches += 1
+        r = self.session.get(url, timeout=self.timeout)
+        return CachedResponse(r.url, r.status_code, r.reason, r.headers, r.content)
+
+    def get(self, url):
+        '''
+        GETs the URL, unless a recent enough copy is cached or a request for it is already in flight.
+        '''
+        key = canonical_url(url)
+        with self._lock:
+            response = self._cached(self._responses, key)
+            if response is not None:
+                self.hits += 1
+                return response
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                self.misses += 1
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.hits += 1
+        if not leader:
+            return future.result()
+
+        try:
+            response = self._fetch(url)
+        except Exception as e:
+            # Errors are passed on to anything waiting, but not cached:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if 200 <= response.status_code < 300:
+                self._store_response(key, response)
+            del self._in_flight[key]
+        future.set_result(response)
+        return response
+
+    def html(self, url, base_url=None):
+        '''
+        The parsed HTML of the URL, with links made absolute against base_url if given.
+        '''
+        key = (canonical_url(url), base_url)
+        with self._lock:
+            tree = self._cached(self._trees, key)
+        if tree is not None:
+            return tree
+        response = self.get(url)
+        tree = html.fromstring(response.content)
+        if base_url:
+            tree.make_links_absolute(base_url)
+        if not 200 <= response.status_code < 300:
+            return tree
+        with self._lock:
+            self._trees[key] = (time.time() + self.tree_ttl, tree)
+            while len(self._trees) > self.max_trees:
+                self._drop(self._trees, next(iter(self._trees)))
+        return tree
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'fetches': self.fetches, 'entries': len(self._responses),
+                'bytes': self._bytes}
@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import threading
+from collections import Counter
+from lib.testing import FakeHandler, fake_server
+from lib.docharvester.fetch_cache import FetchCache
+from lib.docharvester.document_mdex import DocumentMDEx
+
+# Responses recorded from a publisher's site:
+with open(os.path.join(os.path.dirname(__file__), '..', '..', 'test', 'landing-page-responses.json')) as f:
+    RESPONSES = json.load(f)
+
+
+class FixtureHandler(FakeHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests[self.path] += 1
+        # Slow enough for concurrent requests to overlap:
+        time.sleep(0.1)
+        recorded = RESPONSES.get(self.path, RESPONSES['/publications/withdrawn'])
+        self.send_body(recorded['body'], status=recorded['status'], headers=recorded['headers'])
+
+
+def test_fetch_cache():
+    with fake_server(FixtureHandler, requests=Counter()) as server:
+        base = server.base_url
+        landing_page = base + "/publications/annual-report-2019"
+        cache = FetchCache(ttl=0.5, max_entries=2)
+
+        # Concurrent requests for the same page only fetch it once:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(landing_page))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert server.requests['/publications/annual-report-2019'] == 1
+        assert len(set(id(r) for r in results)) == 1
+
+        # The same URL written differently is the same entry:
+        assert cache.get(landing_page.replace('http://', 'HTTP://')) is results[0]
+
+        # Errors are not cached, in case they are only temporary:
+        assert cache.get(base + "/publications/withdrawn").status_code == 404
+        assert cache.get(base + "/publications/withdrawn").status_code == 404
+        assert server.requests['/publications/withdrawn'] == 2
+
+        # The documents on the page all share the one fetch and parse:
+        titles = []
+        for name in ['annual-report-2019', 'annual-report-2019-summary', 'annual-report-2019-easy-read']:
+            doc = {'document_url': "%s/files/%s.pdf" % (base, name), 'landing_page_url': landing_page}
+            titles.append(DocumentMDEx([{}], doc, None, fetch_cache=cache).mdex_default() or doc['title'])
+        assert titles == ['Annual report and accounts', 'Summary for trustees', 'Easy read version']
+        assert server.requests['/publications/annual-report-2019'] == 1
+        assert cache.html(landing_page, landing_page) is cache.html(landing_page, landing_page)
+
+        # Only two entries are kept:
+        cache.get(base + "/api/content/publications/annual-report-2019")
+        assert cache.stats()['entries'] == 2
+        assert json.loads(cache.get(base + "/api/content/publications/annual-report-2019").content)['title'] == \
+            'Annual report 2019'
+
+        # And they expire:
+        time.sleep(0.6)
+        cache.get(base + "/api/content/publications/annual-report-2019")
+        assert server.requests['/api/content/publications/annual-report-2019'] == 2
@@ -0,0 +1,314 @@
+'''
+Processes the documents found in the crawl logs in bulk, rather than as one task per document.
+
+Each document is checked, has its metadata extracted and is then posted to W3ACT, on a pool of worker threads that
+share one HTTP session, with a limit on how many requests go to each host at once.
+'''
+
+import json
+import time
+import heapq
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from lib.sqlite_store import SqliteStore
+from lib.docharvester.document_mdex import DocumentMDEx, WatchedTargetIndex, RetryLater
+from lib.docharvester.fetch_cache import FetchCache
+
+logger = logging.getLogger('luigi-interface')
+
+# The stages each document goes through, for timing:
+STAGES = ['available', 'extract', 'post']
+
+# The possible outcomes for each document:
+OUTCOMES = ['ACCEPTED', 'REJECTED', 'UNAVAILABLE', 'FAILED', 'RETRIES_EXHAUSTED']
+
+
+def read_documents(lines):
+    '''
+    Yields the documents from the lines of the crawl log analysis output, i.e. 'DOCUMENT...<tab>{json}' lines.
+    '''
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        prefix, docjson = line.strip().split("\t", 1)
+        if prefix.startswith("DOCUMENT"):
+            yield json.loads(docjson)
+
+
+def document_key(document_url):
+    return hashlib.md5(document_url.encode('utf-8')).digest()[:8]
+
+
+class PostedDocuments(SqliteStore):
+    '''
+    Remembers which documents have been dealt with, as 8 bytes of the hash of each URL (plus the outcome).
+
+    Documents are added one at a time as they are finished, and committed in batches, so if the run is cut short the
+    last few may be processed again next time.
+    '''
+    table = 'posted'
+    key_columns = [('key', 'BLOB')]
+    value_columns = [('status', 'TEXT')]
+
+    def __init__(self, path, commit_every=100):
+        super(PostedDocuments, self).__init__(path, commit_every=commit_every)
+
+    def __contains__(self, document_url):
+        return self._contains((document_key(document_url),))
+
+    def add(self, document_url, status):
+        self._store((document_key(document_url), status))
+
+
+class HostLimiter(object):
+    '''
+    Limits how many requests are made to each host at once, and how soon after the last one a new one can start.
+    '''
+
+    def __init__(self, max_per_host=2, min_interval=0.0):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = defaultdict(lambda: threading.BoundedSemaphore(self.max_per_host))
+        self._last_start = {}
+
+    def acquire(self, host):
+        with self._lock:
+            semaphore = self._semaphores[host]
+        semaphore.acquire()
+        if self.min_interval > 0:
+            with self._lock:
+                start = max(time.time(), self._last_start.get(host, 0) + self.min_interval)
+                self._last_start[host] = start
+            time.sleep(max(0.0, start - time.time()))
+
+    def release(self, host):
+        self._semaphores[host].release()
+
+
+class RetryQueue(object):
+    '''
+    Documents waiting to be tried again, in the order they are due, with the wait doubling after each attempt.
+    '''
+
+    def __init__(self, retry_wait=10.0):
+        self.retry_wait = retry_wait
+        self._heap = []
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, doc, attempt):
+        '''
+        Schedules another go at the document, which has been tried 'attempt' times so far.
+        '''
+        due = time.time() + self.retry_wait * 2 ** (attempt - 1)
+        # The counter keeps the order stable and means the documents themselves are never compared:
+        heapq.heappush(self._heap, (due, self._counter, doc, attempt))
+        self._counter += 1
+
+    def wait_time(self):
+        '''
+        Seconds until the next document is due, or None if the queue is empty.
+        '''
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.time())
+
+    def pop_due(self):
+        '''
+        Yields (doc, attempt) for the documents that are now due.
+        '''
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            due, counter, doc, attempt = heapq.heappop(self._heap)
+            yield doc, attempt
+
+
+class DocumentHarvester(object):
+    '''
+    Runs documents through metadata extraction and posts them to W3ACT, skipping any that have already been dealt with.
+    '''
+
+    def __init__(self, targets, post_document, posted, is_available=None, max_workers=8, max_per_host=2,
+                 host_interval=0.0, session=None, max_tries=4, retry_wait=10.0, check_available=None,
+                 check_batch_size=1000):
+        '''
+        :param targets: the crawl feed, used to associate documents with Watched Targets
+        :param post_document: function that posts a document to W3ACT, returning the response
+        :param posted: a PostedDocuments set
+        :param is_available: optional function that checks a document can be accessed yet. If not, it is left to be
+        tried again next time.
+        :param check_available: optional alternative to is_available, that checks a list of up to check_batch_size
+        documents at once, returning the set of the URLs of those that are available.
+        :param max_tries: how many times to try extraction steps that may need retrying (e.g. finding the gov.uk
+        landing page), waiting retry_wait seconds, then twice that, and so on, in between. The workers get on with
+        other documents in the meantime.
+        '''
+        self.targets = targets
+        self.target_index = WatchedTargetIndex(targets)
+        self.post_document = post_document
+        self.posted = posted
+        self.is_available = is_available
+        self.check_available = check_available
+        self.check_batch_size = check_batch_size
+        self.max_workers = max_workers
+        self.max_tries = max_tries
+        self.retries = RetryQueue(retry_wait)
+        self.limiter = HostLimiter(max_per_host, host_interval)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_per_host)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        # Landing pages are often shared by many documents:
+        self.fetch_cache = FetchCache(session)
+        # Metrics:
+        self._lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.timings = dict((stage, 0.0) for stage in STAGES)
+
+    def _timed(self, stage, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.timings[stage] += time.time() - start
+
+    def _process(self, doc, attempt):
+        host = urlparse(doc['document_url']).hostname
+        if attempt == 1 and self.is_available and not self._timed('available', self.is_available, doc):
+            return doc, 'UNAVAILABLE'
+
+        # Extract the metadata, politely, and without waiting around if something needs retrying:
+        last_try = attempt >= self.max_tries
+        mdex = DocumentMDEx(self.targets, dict(doc), doc['source'], target_index=self.target_index,
+                            session=self.session, fetch_cache=self.fetch_cache, head_tries=1,
+                            defer_retries=not last_try)
+        self.limiter.acquire(host)
+        try:
+            result = self._timed('extract', mdex.mdex)
+        except RetryLater as e:
+            logger.info("Will try %s again later: %s" % (doc['document_url'], e))
+            return doc, 'RETRY'
+        finally:
+            self.limiter.release(host)
+
+        # Documents that ran out of retries carry on with whatever metadata could be found, but are counted separately:
+        exhausted = last_try and 'api_call_failed' in result
+
+        # Documents may be rejected at this point:
+        if 'match_failed' in result:
+            logger.error("The document %s has been REJECTED!" % doc['document_url'])
+            result = dict(doc)
+            result['status'] = 'REJECTED'
+            return result, 'RETRIES_EXHAUSTED' if exhausted else 'REJECTED'
+
+        # Inform W3ACT it's available:
+        result['status'] = 'ACCEPTED'
+        r = self._timed('post', self.post_document, result)
+        if r.status_code != 200:
+            raise Exception("Failed with %s %s\n%s" % (r.status_code, r.reason, r.text))
+        logger.info("Document POSTed to W3ACT: %s" % result['document_url'])
+        return result, 'RETRIES_EXHAUSTED' if exhausted else 'ACCEPTED'
+
+    def process(self, docs):
+        '''
+        Processes the documents, with at most max_workers in flight at once.
+
+        Documents that need retrying are put aside until they are due, and are then processed alongside the rest.
+
+        :return: generator of (doc, status) tuples, in the order they are completed. Documents that fail are logged
+        and counted as 'FAILED', and are not recorded as posted.
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+            in_flight = set()
+
+            def _completed(timeout=None):
+                done, not_done = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    doc, attempt = pending.pop(future)
+                    try:
+                        result, status = future.result()
+                    except Exception as e:
+                        logger.error("Failed to process %s: %s" % (doc['document_url'], e))
+                        result, status = doc, 'FAILED'
+                    if status == 'RETRY':
+                        self.counts['retried'] += 1
+                        self.retries.add(doc, attempt)
+                        continue
+                    in_flight.discard(doc['document_url'])
+                    if status in ['ACCEPTED', 'REJECTED', 'RETRIES_EXHAUSTED']:
+                        self.posted.add(doc['document_url'], status)
+                    self.counts[status] += 1
+                    yield result, status
+
+            def _submit_due():
+                # Documents due a retry go in ahead of any new ones:
+                for doc, attempt in self.retries.pop_due():
+                    pending[pool.submit(self._process, doc, attempt + 1)] = (doc, attempt + 1)
+
+            def _submit(batch):
+                if self.check_available:
+                    try:
+                        available = self._timed('available', self.check_available, batch)
+                    except Exception as e:
+                        # As with is_available, documents that could not be checked are tried again next time:
+                        logger.error("Could not check the availability of %i documents: %s" % (len(batch), e))
+                        logger.exception(e)
+                        available = set()
+                for doc in batch:
+                    if self.check_available and doc['document_url'] not in available:
+                        in_flight.discard(doc['document_url'])
+                        self.counts['UNAVAILABLE'] += 1
+                        yield doc, 'UNAVAILABLE'
+                        continue
+                    _submit_due()
+                    while len(pending) >= self.max_workers:
+                        for item in _completed():
+                            yield item
+                        _submit_due()
+                    pending[pool.submit(self._process, doc, 1)] = (doc, 1)
+
+            # Documents are passed on in batches, if their availability is being checked in batches:
+            batch_size = self.check_batch_size if self.check_available else 1
+            batch = []
+            for doc in docs:
+                self.counts['seen'] += 1
+                if doc['document_url'] in in_flight or doc['document_url'] in self.posted:
+                    self.counts['skipped'] += 1
+                    continue
+                in_flight.add(doc['document_url'])
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    for item in _submit(batch):
+                        yield item
+                    batch = []
+            for item in _submit(batch):
+                yield item
+
+            # Finish off, including any retries:
+            while pending or self.retries:
+                _submit_due()
+                if pending:
+                    for item in _completed(self.retries.wait_time()):
+                        yield item
+                else:
+                    time.sleep(self.retries.wait_time())
+
+    def stats(self):
+        stats = dict(self.counts)
+        for stage in STAGES:
+            stats['%s_seconds' % stage] = self.timings[stage]
+        stats['landing_page_fetches'] = self.fetch_cache.stats()['fetches']
+        return stats
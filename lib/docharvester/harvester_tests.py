@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from collections import defaultdict
+from lib.testing import FakeHandler, fake_server
+from lib.docharvester.harvester import DocumentHarvester, PostedDocuments, read_documents
+
+
+class FakeSiteHandler(FakeHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        host = self.headers['Host'].split(':')[0]
+        with self.server.lock:
+            self.server.in_flight[host] += 1
+            self.server.max_in_flight[host] = max(self.server.max_in_flight[host], self.server.in_flight[host])
+        time.sleep(0.02)
+        n = self.path.rsplit('/', 1)[1]
+        with self.server.lock:
+            self.server.in_flight[host] -= 1
+        self.send_body("<html><body><h2>Report %s</h2><p><a href=\"/docs/%s.pdf\">Download</a></p></body></html>" % (
+            n, n), 'text/html')
+
+
+class FakeResponse(object):
+    status_code = 200
+
+
+def test_harvest_documents():
+    with fake_server(FakeSiteHandler, lock=threading.Lock(), in_flight=defaultdict(int),
+                     max_in_flight=defaultdict(int)) as server:
+        port = server.server_port
+        targets = [
+            {'id': 1, 'title': 'Local Reports', 'watched': True, 'seeds': ['http://localhost:%i/' % port]},
+            {'id': 2, 'title': 'Loopback Reports', 'watched': True, 'seeds': ['http://127.0.0.1:%i/' % port]},
+            {'id': 3, 'title': 'Not watched', 'watched': False, 'seeds': ['http://example.org/']}
+        ]
+        lines = []
+        for host in ['localhost', '127.0.0.1']:
+            for n in range(10):
+                doc = {'document_url': 'http://%s:%i/docs/%i.pdf' % (host, port, n),
+                       'landing_page_url': 'http://%s:%i/pages/%i' % (host, port, n),
+                       'source': None, 'wayback_timestamp': '20191016120000'}
+                lines.append(("DOCUMENT\t%s\n" % json.dumps(doc)).encode('utf-8'))
+        lines.append(b"OTHER\t{}\n")
+        # The same document again:
+        lines.append(lines[0])
+
+        posted_docs = []
+
+        def post_document(doc):
+            posted_docs.append(doc)
+            return FakeResponse()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            posted = PostedDocuments(os.path.join(tmp, 'posted.sqlite'))
+            harvester = DocumentHarvester(targets, post_document, posted,
+                                          is_available=lambda doc: not doc['document_url'].endswith('/9.pdf'),
+                                          max_workers=6, max_per_host=2)
+            results = list(harvester.process(read_documents(lines)))
+            stats = harvester.stats()
+            assert (stats['seen'], stats['skipped'], stats['ACCEPTED'], stats['UNAVAILABLE']) == (21, 1, 18, 2)
+            assert stats['extract_seconds'] > 0
+            assert server.max_in_flight['localhost'] <= 2 and server.max_in_flight['127.0.0.1'] <= 2
+            assert sorted((d['title'], d['target_id']) for d in posted_docs)[:2] == [('Report 0', 1), ('Report 0', 2)]
+            assert all(status != 'ACCEPTED' or doc['status'] == 'ACCEPTED' for doc, status in results)
+            posted.close()
+
+            # Next time, only the documents that were not available before are processed:
+            posted = PostedDocuments(os.path.join(tmp, 'posted.sqlite'))
+            harvester = DocumentHarvester(targets, post_document, posted, max_workers=6)
+            list(harvester.process(read_documents(lines)))
+            assert (harvester.stats()['skipped'], harvester.stats()['ACCEPTED']) == (19, 2)
+            assert len(posted) == 20
+            posted.close()
+
+            # Availability can also be checked in batches:
+            batches = []
+
+            def check_available(docs):
+                batches.append(len(docs))
+                return set(doc['document_url'] for doc in docs if not doc['document_url'].endswith('/9.pdf'))
+
+            posted = PostedDocuments(os.path.join(tmp, 'batches.sqlite'))
+            harvester = DocumentHarvester(targets, post_document, posted, check_available=check_available,
+                                          check_batch_size=8, max_workers=6)
+            list(harvester.process(read_documents(lines)))
+            assert batches == [8, 8, 4]
+            assert (harvester.stats()['ACCEPTED'], harvester.stats()['UNAVAILABLE']) == (18, 2)
+            posted.close()
+
+            # If a batch cannot be checked, its documents are left until next time:
+            def check_available_fails(docs):
+                raise Exception("CDX server unavailable")
+
+            posted = PostedDocuments(os.path.join(tmp, 'failed-check.sqlite'))
+            harvester = DocumentHarvester(targets, post_document, posted, check_available=check_available_fails,
+                                          max_workers=6)
+            list(harvester.process(read_documents(lines)))
+            assert (harvester.stats().get('ACCEPTED', 0), harvester.stats()['UNAVAILABLE']) == (0, 20)
+            assert len(posted) == 0
+            posted.close()
+
+
+class FakeGovUk(object):
+    '''
+    Stands in for the requests session, with a gov.uk that is slow to link documents to their landing pages.
+    '''
+
+    def __init__(self, up_after):
+        self.up_after = up_after
+        self.heads = defaultdict(int)
+
+    def head(self, url, allow_redirects=True):
+        self.heads[url] += 1
+        r = FakeResponse()
+        r.links = {}
+        name = url.rsplit('/', 1)[1][:-4]
+        if self.heads[url] >= self.up_after.get(name, 1000):
+            r.links['up'] = {'url': 'https://www.gov.uk/government/publications/%s' % name, 'rel': 'up'}
+        return r
+
+    def get(self, url, timeout=None):
+        r = FakeResponse()
+        r.url, r.reason, r.headers = url, 'OK', {}
+        name = url.rsplit('/', 1)[1]
+        if '/api/content/' in url:
+            r.content = json.dumps({'title': 'Report %s' % name, 'first_published_at': '2019-10-16T09:30:00.000+01:00',
+                                    'links': {'organisations': [{'title': 'Department for Transport'}]}}).encode()
+        else:
+            r.content = ('<html><body><div class="attachment-details"><h2 class="title"><a href="/%s.pdf">Report %s</a>'
+                         '</h2><p><a href="/uploads/%s.pdf">Download</a></p></div></body></html>' % (
+                             name, name, name)).encode()
+        return r
+
+
+def test_deferred_retries():
+    targets = [
+        {'id': 1, 'title': 'Department for Transport', 'watched': True,
+         'seeds': ['https://www.gov.uk/government/organisations/department-for-transport']},
+        {'id': 2, 'title': 'Example Reports', 'watched': True, 'seeds': ['https://example.org/']}
+    ]
+    docs = []
+    for name in ['slow', 'never']:
+        docs.append({'document_url': 'https://www.gov.uk/uploads/%s.pdf' % name, 'filename': '%s.pdf' % name,
+                     'landing_page_url': 'https://www.gov.uk/government/publications/%s' % name, 'source': None})
+    docs.append({'document_url': 'https://example.org/uploads/quick.pdf',
+                 'landing_page_url': 'https://example.org/publications/quick', 'source': None})
+    session = FakeGovUk(up_after={'slow': 3})
+    posted_docs = []
+
+    def post_document(doc):
+        posted_docs.append(doc)
+        return FakeResponse()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        posted = PostedDocuments(os.path.join(tmp, 'posted.sqlite'))
+        harvester = DocumentHarvester(targets, post_document, posted, max_workers=2, session=session, max_tries=3,
+                                      retry_wait=0.05)
+        start = time.time()
+        results = [(doc['document_url'].rsplit('/', 1)[1], status) for doc, status in harvester.process(docs)]
+        # Nothing waits for the retries, so the other document gets done first:
+        assert results[0] == ('quick.pdf', 'ACCEPTED')
+        # ...but the two retried documents finish at about the same time, in either order:
+        assert dict(results) == {'quick.pdf': 'ACCEPTED', 'slow.pdf': 'ACCEPTED', 'never.pdf': 'RETRIES_EXHAUSTED'}
+        assert time.time() - start < 1
+        assert session.heads['https://www.gov.uk/uploads/slow.pdf'] == 3
+        assert session.heads['https://www.gov.uk/uploads/never.pdf'] == 3
+        assert harvester.stats()['retried'] == 4
+        posted_by_url = dict((d['document_url'], d) for d in posted_docs)
+        slow = posted_by_url['https://www.gov.uk/uploads/slow.pdf']
+        assert (slow['title'], slow['target_id']) == ('Report slow', 1)
+        assert len(posted) == 3
+        posted.close()
@@ -0,0 +1,143 @@
+import queue
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Read in 4MB chunks, keeping up to this many chunks queued ahead of the digest:
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_READ_AHEAD = 2
+
+
+def _read_ahead(reader, chunks, chunk_size, stop):
+    # Runs in a separate thread, so the next chunk is being read while the last one is hashed:
+    try:
+        while not stop.is_set():
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            chunks.put(chunk)
+        chunks.put(None)
+    except Exception as e:
+        chunks.put(e)
+
+
+def hash_stream(reader, algorithm='sha512', chunk_size=DEFAULT_CHUNK_SIZE, read_ahead=DEFAULT_READ_AHEAD):
+    '''
+    Hashes everything that can be read from a binary file-like object, a chunk at a time.
+
+    At most read_ahead + 1 chunks are held in memory at once, however large the stream is.
+
+    :param reader: anything with a read(size) method that returns bytes
+    :return: the hex digest
+    '''
+    digest = hashlib.new(algorithm)
+    if read_ahead < 1:
+        chunk = reader.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            chunk = reader.read(chunk_size)
+        return digest.hexdigest()
+
+    chunks = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+    reader_thread = threading.Thread(target=_read_ahead, args=(reader, chunks, chunk_size, stop), daemon=True)
+    reader_thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            # N.B. hashlib releases the GIL while hashing large buffers, so this overlaps with the read:
+            digest.update(chunk)
+    finally:
+        # Make sure the reader thread is not left blocked on a full queue:
+        stop.set()
+        while reader_thread.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return digest.hexdigest()
+
+
+def hash_file(path, algorithm='sha512', chunk_size=DEFAULT_CHUNK_SIZE, read_ahead=DEFAULT_READ_AHEAD):
+    '''
+    Hashes a local file, a chunk at a time.
+
+    :return: the hex digest
+    '''
+    with open(path, 'rb') as reader:
+        return hash_stream(reader, algorithm, chunk_size, read_ahead)
+
+
+def hash_all(openers, algorithm='sha512', max_workers=4, chunk_size=DEFAULT_CHUNK_SIZE,
+             read_ahead=DEFAULT_READ_AHEAD):
+    '''
+    Hashes several streams at once, using a pool of threads.
+
+    :param openers: list of callables, each returning a context manager that yields a binary reader
+                    e.g. lambda: open(path, 'rb') or lambda: hdfs_client.read(path)
+    :return: list of hex digests, in the same order as the openers
+    '''
+    def _hash(opener):
+        with opener() as reader:
+            return hash_stream(reader, algorithm, chunk_size, read_ahead)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(openers)))) as pool:
+        return list(pool.map(_hash, openers))
+
+
+def hash_files(paths, algorithm='sha512', max_workers=4, chunk_size=DEFAULT_CHUNK_SIZE,
+               read_ahead=DEFAULT_READ_AHEAD):
+    '''
+    Hashes several local files at once, using a pool of threads.
+
+    :return: dict mapping each path to its hex digest
+    '''
+    openers = [lambda path=path: open(path, 'rb') for path in paths]
+    digests = hash_all(openers, algorithm, max_workers, chunk_size, read_ahead)
+    return dict(zip(paths, digests))
+
+
+class HashingReader(object):
+    '''
+    Wraps a binary reader, updating a digest with every byte read through it.
+
+    Used to hash a file as it is streamed somewhere else (e.g. up to HDFS), so it only has to be read once.
+    '''
+
+    def __init__(self, reader, algorithm='sha512', size=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        :param size: the expected size, if known, so HTTP clients can send a Content-Length
+        '''
+        self.reader = reader
+        self.digest = hashlib.new(algorithm)
+        self.size = size
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self.reader.read(size)
+        if chunk:
+            self.digest.update(chunk)
+            self.bytes_read += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        chunk = self.read(self.chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.read(self.chunk_size)
+
+    def __len__(self):
+        if self.size is None:
+            raise TypeError("Size of %s is not known" % self.reader)
+        return self.size
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
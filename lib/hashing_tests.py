@@ -0,0 +1,37 @@
+import io
+import os
+import hashlib
+import tempfile
+from lib.hashing import hash_stream, hash_file, hash_files, HashingReader
+
+
+def test_hash_matches_hashlib():
+    data = os.urandom(100 * 1024 + 7)
+    expected = hashlib.sha512(data).hexdigest()
+    # Check chunk boundaries, with and without read-ahead:
+    for chunk_size in [1024, 100 * 1024 + 7, 1024 * 1024]:
+        for read_ahead in [0, 1, 3]:
+            assert hash_stream(io.BytesIO(data), chunk_size=chunk_size, read_ahead=read_ahead) == expected
+    assert hash_stream(io.BytesIO(b'')) == hashlib.sha512(b'').hexdigest()
+
+
+def test_hash_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        expected = {}
+        for i in range(5):
+            path = os.path.join(tmp, "file-%i.warc.gz" % i)
+            data = os.urandom(1024 * i + 1)
+            with open(path, 'wb') as f:
+                f.write(data)
+            expected[path] = hashlib.sha512(data).hexdigest()
+        assert hash_files(list(expected.keys()), chunk_size=1000, max_workers=3) == expected
+        path = list(expected.keys())[-1]
+        assert hash_file(path, chunk_size=333) == expected[path]
+
+
+def test_hashing_reader():
+    data = os.urandom(10000)
+    reader = HashingReader(io.BytesIO(data), size=len(data), chunk_size=999)
+    assert b''.join(reader) == data
+    assert reader.bytes_read == len(reader) == len(data)
+    assert reader.hexdigest() == hashlib.sha512(data).hexdigest()
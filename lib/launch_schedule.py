@@ -0,0 +1,138 @@
+import json
+import datetime
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# The crawl frequencies that can be launched, and the parts of the start date that have to match the current hour:
+FREQUENCIES = ['DAILY', 'WEEKLY', 'MONTHLY', 'QUARTERLY', 'SIXMONTHLY', 'ANNUAL']
+
+# Frequencies that are known about, but not launched from here:
+SKIPPED_FREQUENCIES = ['DOMAINCRAWL']
+
+
+def slot_key(frequency, when):
+    """
+    The key of the slot that a schedule with the given frequency and start date falls into, or, for the current time,
+    the slot that is due now.
+    """
+    if frequency == 'DAILY':
+        return "DAILY/%02i" % when.hour
+    elif frequency == 'WEEKLY':
+        return "WEEKLY/%i/%02i" % (when.isoweekday(), when.hour)
+    elif frequency == 'MONTHLY':
+        return "MONTHLY/%02i/%02i" % (when.day, when.hour)
+    elif frequency == 'QUARTERLY':
+        return "QUARTERLY/%i/%02i/%02i" % (when.month % 3, when.day, when.hour)
+    elif frequency == 'SIXMONTHLY':
+        return "SIXMONTHLY/%i/%02i/%02i" % (when.month % 6, when.day, when.hour)
+    elif frequency == 'ANNUAL':
+        return "ANNUAL/%02i/%02i/%02i" % (when.month, when.day, when.hour)
+    raise ValueError("Don't understand crawl frequency %s" % frequency)
+
+
+def launch_sheets(target):
+    """
+    The Heritrix sheets to apply to the seeds of a target.
+    """
+    sheets = []
+    # Robots.txt
+    if target['ignoreRobotsTxt']:
+        sheets.append('ignoreRobots')
+    # Scope
+    if target['scope'] == 'subdomains':
+        sheets.append('subdomainsScope')
+    elif target['scope'] == 'plus1Scope':
+        sheets.append('plus1Scope')
+    # Limits
+    if target['depth'] == 'CAPPED_LARGE':
+        sheets.append('higherLimit')
+    elif target['depth'] == 'DEEP':
+        sheets.append('noLimit')
+    return sheets
+
+
+class LaunchSchedule(object):
+    """
+    The schedules from a crawl feed, compiled into slots so the targets that are due in a given hour can be looked up
+    directly, rather than checking every schedule of every target each hour.
+
+    Each slot holds [target index, schedule index, start, end] entries, with the dates normalised to DATE_FORMAT so
+    they can be compared as strings.
+    """
+
+    def __init__(self, targets, slots, errors=(), unknown=()):
+        """
+        :param targets: the launch details of each scheduled target, keyed by its (string) index in the feed
+        :param slots: slot key -> list of entries
+        :param errors: ids of targets that could not be scheduled
+        :param unknown: (target id, frequency) for schedules with frequencies that are not understood
+        """
+        self.targets = targets
+        self.slots = slots
+        self.errors = list(errors)
+        self.unknown = list(unknown)
+
+    @classmethod
+    def compile(cls, crawl_feed):
+        targets = {}
+        slots = defaultdict(list)
+        errors = []
+        unknown = []
+        for t_i, t in enumerate(crawl_feed):
+            # Look out for problems:
+            if len(t['seeds']) == 0:
+                logger.error("This target has no seeds! tid: %d" % t['id'])
+                errors.append(t['id'])
+                continue
+            for s_i, schedule in enumerate(t['schedules']):
+                # Schedules without a start date are never launched:
+                if not schedule['startDate']:
+                    continue
+                start = datetime.datetime.strptime(schedule['startDate'], DATE_FORMAT)
+                end = None
+                if schedule['endDate']:
+                    end = datetime.datetime.strptime(schedule['endDate'], DATE_FORMAT).strftime(DATE_FORMAT)
+                frequency = schedule['frequency']
+                if frequency in FREQUENCIES:
+                    slots[slot_key(frequency, start)].append([t_i, s_i, start.strftime(DATE_FORMAT), end])
+                    targets[str(t_i)] = {
+                        'id': t['id'],
+                        'title': t['title'],
+                        'seeds': t['seeds'],
+                        'sheets': launch_sheets(t)
+                    }
+                elif frequency not in SKIPPED_FREQUENCIES:
+                    logger.error("Don't understand crawl frequency %s (tid: %d)" % (frequency, t['id']))
+                    unknown.append([t['id'], frequency])
+        return cls(targets, dict(slots), errors, unknown)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['targets'], data['slots'], data['errors'], data['unknown'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'targets': self.targets, 'slots': self.slots, 'errors': self.errors,
+                       'unknown': self.unknown}, f)
+
+    def due(self, now):
+        """
+        Yields (target, frequency, start, end) for every schedule due to launch in the hour of 'now', in feed order.
+        """
+        now_str = now.strftime(DATE_FORMAT)
+        entries = []
+        for frequency in FREQUENCIES:
+            for entry in self.slots.get(slot_key(frequency, now), []):
+                t_i, s_i, start, end = entry
+                # Skip if outside of the start/end range:
+                if now_str < start or (end and now_str > end):
+                    continue
+                entries.append((t_i, s_i, frequency, start, end))
+        for t_i, s_i, frequency, start, end in sorted(entries):
+            yield self.targets[str(t_i)], frequency, start, end
@@ -0,0 +1,90 @@
+import os
+import random
+import datetime
+import tempfile
+from lib.launch_schedule import LaunchSchedule, FREQUENCIES
+
+
+def _legacy_due(all_targets, now):
+    # The rules as LaunchCrawls used to apply them, checking every schedule of every target:
+    due = []
+    for t in all_targets:
+        if len(t['seeds']) == 0:
+            continue
+        for schedule in t['schedules']:
+            if schedule['startDate']:
+                startDate = datetime.datetime.strptime(schedule['startDate'], "%Y-%m-%d %H:%M:%S")
+                if now < startDate:
+                    continue
+            else:
+                continue
+            if schedule['endDate']:
+                endDate = datetime.datetime.strptime(schedule['endDate'], "%Y-%m-%d %H:%M:%S")
+                if now > endDate:
+                    continue
+            frequency = schedule['frequency']
+            if frequency == "DAILY":
+                match = True
+            elif frequency == "WEEKLY":
+                match = now.isoweekday() == startDate.isoweekday()
+            elif frequency == "MONTHLY":
+                match = now.day == startDate.day
+            elif frequency == "QUARTERLY":
+                match = now.day == startDate.day and now.month % 3 == startDate.month % 3
+            elif frequency == "SIXMONTHLY":
+                match = now.day == startDate.day and now.month % 6 == startDate.month % 6
+            elif frequency == "ANNUAL":
+                match = now.day == startDate.day and now.month == startDate.month
+            else:
+                match = False
+            if match and now.hour == startDate.hour:
+                due.append((t['id'], frequency))
+    return due
+
+
+def _random_feed(n=100, seed=42):
+    r = random.Random(seed)
+
+    def _date(year_from, year_to):
+        d = datetime.datetime(year_from, 1, 1) + datetime.timedelta(
+            seconds=r.randrange(int((datetime.datetime(year_to, 1, 1) - datetime.datetime(year_from, 1, 1)).total_seconds())))
+        return d.strftime("%Y-%m-%d %H:%M:%S")
+
+    feed = []
+    for tid in range(1, n + 1):
+        schedules = []
+        for i in range(r.choice([0, 1, 1, 1, 2, 3])):
+            schedules.append({
+                'frequency': r.choice(FREQUENCIES + ['DOMAINCRAWL']),
+                'startDate': r.choice([None, _date(2020, 2027), _date(2026, 2027)]),
+                'endDate': r.choice([None, None, _date(2025, 2028)])
+            })
+        feed.append({
+            'id': tid,
+            'title': 'Target %i' % tid,
+            'seeds': [] if tid % 50 == 0 else ['http://example-%i.org/' % tid],
+            'schedules': schedules,
+            'ignoreRobotsTxt': tid % 7 == 0,
+            'scope': r.choice(['root', 'subdomains', 'plus1Scope']),
+            'depth': r.choice(['CAPPED', 'CAPPED_LARGE', 'DEEP'])
+        })
+    return feed
+
+
+def test_schedule_matches_rules_for_a_year():
+    feed = _random_feed()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'schedule.json')
+        LaunchSchedule.compile(feed).save(path)
+        schedule = LaunchSchedule.load(path)
+    assert schedule.errors == [50, 100]
+
+    now = datetime.datetime(2026, 1, 1)
+    launches = 0
+    while now.year == 2026:
+        due = [(t['id'], frequency) for t, frequency, start, end in schedule.due(now)]
+        assert due == _legacy_due(feed, now), now
+        launches += len(due)
+        now += datetime.timedelta(hours=1)
+    # Make sure the comparison was not trivial:
+    assert launches > 500
@@ -0,0 +1,117 @@
+from lxml import etree
+
+# Output XML namespaces:
+OAINS = 'http://www.openarchives.org/OAI/2.0/'
+OAIDCNS = 'http://www.openarchives.org/OAI/2.0/oai_dc/'
+DCNS = 'http://purl.org/dc/elements/1.1/'
+XLINKNS = 'http://www.w3.org/1999/xlink'
+OAIDC_B = "{%s}" % OAIDCNS
+DC_B = "{%s}" % DCNS
+XLINK_B = "{%s}" % XLINKNS
+
+# N.B. in the order the incremental writer declares them, so both ways of writing the XML give the same bytes:
+NSMAP = {None: OAINS, 'dc': DCNS, 'oai_dc': OAIDCNS, 'xlink': XLINKNS}
+
+# Indentation, matching lxml's pretty_print:
+INDENT = '  '
+
+
+def dc_fields(rec):
+    """
+    The Dublin Core fields of a title-level record, in order, as (tag, text) pairs.
+
+    Missing values are written as empty elements.
+    """
+    fields = [
+        (DC_B + 'source', rec['url']),
+        (DC_B + 'publisher', rec['publisher']),
+        (DC_B + 'title', rec['title']),
+        (DC_B + 'date', rec['date']),
+        (DC_B + 'rights', rec['rights']),
+        (XLINK_B + 'href', rec['wayback_url'])
+    ]
+    if 'subject' in rec:
+        fields.append((DC_B + 'subject', rec['subject']))
+    return [(tag, text if text is not None else '') for tag, text in fields]
+
+
+def title_export_tree(records):
+    """
+    Builds the whole OAI-PMH document in memory.
+    """
+    oaiPmh = etree.Element('OAI-PMH', nsmap=NSMAP)
+    listRecords = etree.SubElement(oaiPmh, 'ListRecords')
+    for rec in records:
+        record = etree.SubElement(listRecords, 'record')
+
+        # header
+        header = etree.SubElement(record, 'header')
+        identifier = etree.SubElement(header, 'identifier')
+        identifier.text = rec['id']
+
+        # metadata
+        metadata = etree.SubElement(record, 'metadata')
+        dc = etree.SubElement(metadata, OAIDC_B + 'dc')
+        for tag, text in dc_fields(rec):
+            etree.SubElement(dc, tag).text = text
+    return oaiPmh
+
+
+def write_title_export(records, f):
+    """
+    Writes the OAI-PMH document to a binary file, building it all in memory first.
+    """
+    f.write(etree.tostring(title_export_tree(records), xml_declaration=True, encoding='UTF-8', pretty_print=True))
+
+
+def stream_title_export(records, f):
+    """
+    Writes the OAI-PMH document to a binary file one record at a time, as the records are generated, so memory use
+    does not grow with the number of records. The output is identical to write_title_export().
+    """
+    records = iter(records)
+    first = next(records, None)
+    with etree.xmlfile(f, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('OAI-PMH', nsmap=NSMAP):
+            xf.write('\n' + INDENT)
+            if first is None:
+                # No records, so an empty element:
+                xf.write(etree.Element('ListRecords'))
+            else:
+                with xf.element('ListRecords'):
+                    rec = first
+                    while rec is not None:
+                        _write_record(xf, rec)
+                        rec = next(records, None)
+                    xf.write('\n' + INDENT)
+            xf.write('\n')
+    f.write(b'\n')
+
+
+def _write_record(xf, rec):
+    def _indent(depth):
+        xf.write('\n' + INDENT * depth)
+
+    _indent(2)
+    with xf.element('record'):
+        # header
+        _indent(3)
+        with xf.element('header'):
+            _indent(4)
+            with xf.element('identifier'):
+                xf.write(rec['id'])
+            _indent(3)
+
+        # metadata
+        _indent(3)
+        with xf.element('metadata'):
+            _indent(4)
+            with xf.element(OAIDC_B + 'dc'):
+                for tag, text in dc_fields(rec):
+                    _indent(5)
+                    with xf.element(tag):
+                        xf.write(text)
+                _indent(4)
+            _indent(3)
+        _indent(2)
@@ -0,0 +1,48 @@
+import io
+from lxml import etree
+from lib.oai_pmh import write_title_export, stream_title_export, DCNS
+
+RECORDS = [
+    {
+        'id': "20130401120000/b'7wSTfAKZ3d8jq9wF+T8yJw=='",
+        'date': '2013-04-01T12:00:00',
+        'url': 'http://www.example.co.uk/?a=1&b=2',
+        'title': 'Example <Ltd> & Sons – été',
+        'rights': '***Free access',
+        'publisher': 'example.co.uk',
+        'wayback_url': 'https://www.webarchive.org.uk/wayback/archive/20130401120000/http://www.example.co.uk/?a=1&b=2',
+        'subject': 'Arts & Humanities'
+    },
+    {
+        'id': "20150101000000/b'AAAAAAAAAAAAAAAAAAAAAA=='",
+        'date': '2015-01-01T00:00:00',
+        'url': 'http://localhost/',
+        'title': 'No subject',
+        'rights': '***Available only in our Reading Rooms',
+        'publisher': '',
+        'wayback_url': 'https://bl.ldls.org.uk/welcome.html?20150101000000/http://localhost/'
+    },
+    {
+        'id': "20160101000000/b'BBBBBBBBBBBBBBBBBBBBBB=='",
+        'date': '2016-01-01T00:00:00',
+        'url': 'http://unknown-subject.org.uk/',
+        'title': 'Unknown subject',
+        'rights': '***Free access',
+        'publisher': 'unknown-subject.org.uk',
+        'wayback_url': 'https://www.webarchive.org.uk/wayback/archive/20160101000000/http://unknown-subject.org.uk/',
+        'subject': None
+    }
+]
+
+
+def _write(writer, records):
+    f = io.BytesIO()
+    writer(records, f)
+    return f.getvalue()
+
+
+def test_streamed_export_is_identical():
+    for records in [RECORDS, RECORDS[:1], []]:
+        in_memory = _write(write_title_export, records)
+        assert _write(stream_title_export, iter(records)) == in_memory
+        assert len(etree.fromstring(in_memory).findall('.//{%s}source' % DCNS)) == len(records)
@@ -0,0 +1,97 @@
+import os
+import json
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class SolrCursorQuery(object):
+    """
+    Pages through all the results of a Solr query using cursorMark, so large result sets can be streamed rather than
+    requested in one huge response.
+
+    N.B. cursors need the sort to end with the unique key, so 'id asc' is added to the sort if it is not there already.
+    """
+
+    def __init__(self, solr_url, q, sort, fl='id', fq=None, rows=1000, handler='select', session=None):
+        self.url = "%s/%s" % (solr_url.rstrip('/'), handler)
+        if 'id' not in [clause.split()[0] for clause in sort.split(',') if clause.strip()]:
+            sort = "%s, id asc" % sort
+        self.params = {'q': q, 'sort': sort, 'fl': fl, 'rows': rows, 'wt': 'json'}
+        if fq:
+            self.params['fq'] = fq
+        self.session = session or requests.Session()
+
+    def pages(self, cursor_mark='*'):
+        """
+        Yields (docs, next_cursor_mark) for each page of results, starting from the given cursor mark.
+        """
+        while True:
+            params = dict(self.params, cursorMark=cursor_mark)
+            r = self.session.post(self.url, data=params)
+            r.raise_for_status()
+            result = r.json()
+            docs = result['response']['docs']
+            next_cursor_mark = result['nextCursorMark']
+            if docs:
+                yield docs, next_cursor_mark
+            # The cursor stops moving once all the results have been returned:
+            if next_cursor_mark == cursor_mark or not docs:
+                return
+            cursor_mark = next_cursor_mark
+
+    def docs(self, cursor_mark='*'):
+        for docs, next_cursor_mark in self.pages(cursor_mark):
+            for doc in docs:
+                yield doc
+
+
+def write_query_results(query, output_path, line_for_doc, limit=None):
+    """
+    Writes a line out for each result as each page arrives, keeping a resume point so that, if this fails part-way
+    through, running it again carries on from the last complete page.
+
+    Results are written to output_path + '.partial', alongside a '.cursor' file that records the cursor mark and
+    how much had been written at the end of each page. When all the results are in, the partial file is moved to
+    output_path.
+
+    :param line_for_doc: function turning a document into a line of output (without the newline)
+    :param limit: the maximum number of lines to write
+    :return: the number of lines written
+    """
+    partial_path = "%s.partial" % output_path
+    cursor_path = "%s.cursor" % partial_path
+    cursor_mark = '*'
+    count = 0
+    offset = 0
+    if os.path.exists(partial_path) and os.path.exists(cursor_path):
+        with open(cursor_path) as f:
+            resume = json.load(f)
+        cursor_mark, count, offset = resume['cursor_mark'], resume['count'], resume['offset']
+        logger.info("Resuming %s after %i results." % (output_path, count))
+
+    with open(partial_path, 'ab+') as out:
+        # Drop anything written after the last complete page:
+        out.truncate(offset)
+        out.seek(offset)
+        for docs, next_cursor_mark in query.pages(cursor_mark):
+            if limit is not None:
+                docs = docs[:limit - count]
+            for doc in docs:
+                out.write(("%s\n" % line_for_doc(doc)).encode('utf-8'))
+            count += len(docs)
+            out.flush()
+            os.fsync(out.fileno())
+            # Record where we got to:
+            with open("%s.tmp" % cursor_path, 'w') as f:
+                json.dump({'cursor_mark': next_cursor_mark, 'count': count, 'offset': out.tell()}, f)
+            os.replace("%s.tmp" % cursor_path, cursor_path)
+            logger.info("Written %i results to %s" % (count, partial_path))
+            if limit is not None and count >= limit:
+                break
+
+    os.replace(partial_path, output_path)
+    if os.path.exists(cursor_path):
+        os.remove(cursor_path)
+    return count
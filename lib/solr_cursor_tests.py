@@ -0,0 +1,61 @@
+import os
+import tempfile
+from urllib.parse import parse_qs
+import pytest
+import requests
+from lib.testing import FakeHandler, fake_server
+from lib.solr_cursor import SolrCursorQuery, write_query_results
+
+DOCS = [{'id': 'hdfs://%03i' % i, 'file_path_s': '/data/%03i.warc.gz' % i} for i in range(95)]
+
+
+class FakeSolrHandler(FakeHandler):
+
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.server.requests.append(params)
+        if len(self.server.requests) == self.server.fail_at:
+            self.send_error(503)
+            return
+        assert params['sort'][0].endswith('id asc')
+        # The cursor mark is just the id of the last document returned:
+        cursor_mark = params['cursorMark'][0]
+        rows = int(params['rows'][0])
+        remaining = [d for d in DOCS if cursor_mark == '*' or d['id'] > cursor_mark]
+        page = remaining[:rows]
+        self.respond({
+            'response': {'numFound': len(DOCS), 'docs': page},
+            'nextCursorMark': page[-1]['id'] if page else cursor_mark
+        })
+
+
+def test_cursor_query_resumes():
+    with fake_server(FakeSolrHandler, requests=[], fail_at=None) as server:
+        solr_url = server.base_url + "/solr/tracking"
+        query = SolrCursorQuery(solr_url, '*:*', sort='timestamp_dt asc', fl='id,file_path_s', rows=10)
+        assert list(query.docs()) == DOCS
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'warcs.txt')
+            # Fail on the fourth page:
+            server.requests = []
+            server.fail_at = 4
+            with pytest.raises(requests.HTTPError):
+                write_query_results(query, output, lambda doc: doc['file_path_s'])
+            assert not os.path.exists(output)
+            with open("%s.partial" % output) as f:
+                assert len(f.readlines()) == 30
+
+            # Then carry on from where it got to:
+            server.requests = []
+            server.fail_at = None
+            assert write_query_results(query, output, lambda doc: doc['file_path_s']) == 95
+            assert server.requests[0]['cursorMark'] == ['hdfs://029']
+            with open(output) as f:
+                assert f.read().splitlines() == [d['file_path_s'] for d in DOCS]
+            assert os.listdir(tmp) == ['warcs.txt']
+
+            # Limited:
+            assert write_query_results(query, output, lambda doc: doc['id'], limit=25) == 25
+            with open(output) as f:
+                assert f.read().splitlines() == [d['id'] for d in DOCS[:25]]
@@ -0,0 +1,92 @@
+import json
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class BlueGreenReindexer(object):
+    """
+    Rebuilds a SolrCloud index without taking it offline.
+
+    Clients query an alias (e.g. 'collections'), which points at one of two collections ('collections_blue' and
+    'collections_green', which have to be created first). The one not in use is cleared and filled, a large batch at a
+    time, and the alias is only switched over to it once everything has been committed. The switch is atomic, so the
+    old index stays in service until then, and a failed reindex leaves it alone.
+    """
+
+    def __init__(self, solr_url, suffixes=('blue', 'green'), batch_size=10000, timeout=60, session=None):
+        """
+        :param solr_url: the URL of the alias, e.g. http://localhost:8983/solr/collections
+        """
+        self.solr_base, self.alias = solr_url.rstrip('/').rsplit('/', 1)
+        self.collections = ["%s_%s" % (self.alias, suffix) for suffix in suffixes]
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def _admin(self, **params):
+        params['wt'] = 'json'
+        r = self.session.get("%s/admin/collections" % self.solr_base, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _update(self, collection, body, **params):
+        params['wt'] = 'json'
+        r = self.session.post("%s/%s/update" % (self.solr_base, collection), params=params, data=json.dumps(body),
+                              headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+        r.raise_for_status()
+
+    def current(self):
+        """
+        The collection the alias currently points to, if any.
+        """
+        return self._admin(action='LISTALIASES').get('aliases', {}).get(self.alias)
+
+    def count(self, collection):
+        r = self.session.get("%s/%s/select" % (self.solr_base, collection),
+                             params={'q': '*:*', 'rows': 0, 'wt': 'json'}, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()['response']['numFound']
+
+    def reindex(self, docs):
+        """
+        Loads the documents into the collection that is not in use, then points the alias at it.
+
+        :return: dict describing what was done
+        """
+        previous = self.current()
+        collection = [c for c in self.collections if c != previous][0]
+        logger.info("Reindexing %s into %s (currently %s)..." % (self.alias, collection, previous))
+
+        # Clear out whatever was left from last time:
+        self._update(collection, {'delete': {'query': '*:*'}})
+
+        # Send the documents in large batches:
+        sent = 0
+        batches = 0
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                self._update(collection, batch)
+                sent += len(batch)
+                batches += 1
+                batch = []
+                logger.info("Sent %i documents to %s..." % (sent, collection))
+        if batch:
+            self._update(collection, batch)
+            sent += len(batch)
+            batches += 1
+        self._update(collection, {'commit': {}})
+
+        # Check it all went in before switching over:
+        found = self.count(collection)
+        if found != sent:
+            raise Exception("Only %i of %i documents were found in %s! Leaving %s pointing at %s." % (
+                found, sent, collection, self.alias, previous))
+        self._admin(action='CREATEALIAS', name=self.alias, collections=collection)
+        logger.info("Switched %s from %s to %s." % (self.alias, previous, collection))
+
+        return {'alias': self.alias, 'collection': collection, 'previous': previous, 'documents': sent,
+                'batches': batches}
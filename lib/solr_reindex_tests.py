@@ -0,0 +1,86 @@
+import json
+from urllib.parse import urlparse, parse_qs
+import pytest
+from lib.testing import FakeServer, FakeHandler, fake_server
+from lib.solr_reindex import BlueGreenReindexer
+
+
+class FakeSolrCloud(FakeServer):
+
+    def __init__(self, *args, **kwargs):
+        super(FakeSolrCloud, self).__init__(*args, **kwargs)
+        # Committed and uncommitted documents per collection:
+        self.committed = {'collections_blue': {}, 'collections_green': {}}
+        self.pending = {'collections_blue': {}, 'collections_green': {}}
+        self.aliases = {}
+        self.updates = 0
+        self.drop_docs = False
+
+    def search(self, name):
+        # Queries via the alias go to whichever collection it points at:
+        return self.committed.get(self.aliases.get(name, name), {})
+
+
+class FakeSolrCloudHandler(FakeHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        if url.path == '/solr/admin/collections':
+            if params['action'] == 'CREATEALIAS':
+                self.server.aliases[params['name']] = params['collections']
+            self.respond({'aliases': dict(self.server.aliases)})
+        elif url.path.endswith('/select'):
+            name = url.path.split('/')[2]
+            self.respond({'response': {'numFound': len(self.server.search(name)), 'docs': []}})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        name = url.path.split('/')[2]
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.server.updates += 1
+        pending = self.server.pending[name]
+        if isinstance(body, list):
+            if not self.server.drop_docs:
+                for doc in body:
+                    pending[doc['id']] = doc
+        elif 'delete' in body:
+            pending.clear()
+        elif 'commit' in body:
+            self.server.committed[name] = dict(pending)
+        self.respond({'responseHeader': {'status': 0}})
+
+
+def _docs(server, n, version):
+    live = len(server.search('collections'))
+    for i in range(n):
+        # Check the live index is still all there while the new one is being built:
+        if i == n // 2:
+            assert len(server.search('collections')) == live
+        yield {'id': 'cid:1-tid:%i' % i, 'type': 'target', 'title': 'Target %i v%i' % (i, version)}
+
+
+def test_blue_green_reindex():
+    with fake_server(FakeSolrCloudHandler, FakeSolrCloud) as server:
+        solr_url = server.base_url + "/solr/collections"
+        reindexer = BlueGreenReindexer(solr_url, batch_size=100)
+        result = reindexer.reindex(_docs(server, 250, 1))
+        assert result == {'alias': 'collections', 'collection': 'collections_blue', 'previous': None,
+                          'documents': 250, 'batches': 3}
+        assert len(server.search('collections')) == 250
+        # delete + 3 batches + commit:
+        assert server.updates == 5
+
+        # Next time, the other collection is used:
+        result = reindexer.reindex(_docs(server, 250, 2))
+        assert (result['collection'], result['previous']) == ('collections_green', 'collections_blue')
+        assert server.search('collections')['cid:1-tid:7']['title'] == 'Target 7 v2'
+
+        # If the documents don't all arrive, the alias is left alone:
+        server.drop_docs = True
+        with pytest.raises(Exception):
+            reindexer.reindex(_docs(server, 250, 3))
+        assert server.aliases['collections'] == 'collections_green'
+        assert server.search('collections')['cid:1-tid:7']['title'] == 'Target 7 v2'
@@ -0,0 +1,147 @@
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from lib.sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(doc, exclude=()):
+    """
+    A short hash of the fields of a document, ignoring any that are expected to change every time (like refresh
+    dates).
+    """
+    fields = sorted((k, v) for k, v in doc.items() if k not in exclude)
+    return hashlib.blake2b(json.dumps(fields).encode('utf-8'), digest_size=8).digest()
+
+
+class FingerprintStore(SqliteStore):
+    """
+    Remembers the fingerprint of each document as it was last sent to Solr.
+
+    Only 8 bytes are stored per document, and lookups go to disk, so the store does not have to fit in memory.
+    """
+    table = 'fingerprints'
+    key_columns = [('id', 'TEXT')]
+    value_columns = [('fp', 'BLOB')]
+
+    def changed(self, doc_id, fp):
+        row = self._lookup((doc_id,))
+        return row is None or row[0] != fp
+
+    def update(self, fingerprints):
+        """
+        Records the fingerprints of documents that have been sent, as (id, fingerprint) pairs.
+        """
+        self._store_many(fingerprints)
+
+
+def _json_array(docs):
+    # Streams the update body, rather than building it all up in memory first:
+    yield b'['
+    for i, doc in enumerate(docs):
+        if i > 0:
+            yield b','
+        yield json.dumps(doc).encode('utf-8')
+    yield b']'
+
+
+class ParallelSolrUpdater(object):
+    """
+    Sends atomic updates to Solr, a batch at a time, with a bounded number of batches in flight at once.
+
+    If a FingerprintStore is given, the fingerprints of the documents are recorded once Solr has accepted them, and
+    unless skip_unchanged is False, documents that have not changed since they were last sent are skipped.
+    """
+
+    def __init__(self, solr_url, store=None, exclude=(), max_workers=4, batch_size=5000, commit_within=30000,
+                 session=None, skip_unchanged=True):
+        """
+        :param exclude: fields to leave out of the fingerprints
+        :param skip_unchanged: whether to skip documents the store says are unchanged, or send them all anyway
+        :param commit_within: how soon Solr should commit the updates, in milliseconds
+        """
+        self.update_url = "%s/update" % solr_url.rstrip('/')
+        self.store = store
+        self.exclude = exclude
+        self.skip_unchanged = skip_unchanged
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.commit_within = commit_within
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        # Metrics:
+        self.seen = 0
+        self.sent = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    def _post(self, docs):
+        # Only 'set' the fields, so any other fields (e.g. indexing status) are left alone:
+        updates = [dict((k, v if k == 'id' else {'set': v}) for k, v in doc.items()) for doc in docs]
+        r = self.session.post(self.update_url, params={'commitWithin': self.commit_within, 'wt': 'json'},
+                              data=_json_array(updates), headers={'Content-Type': 'application/json'})
+        r.raise_for_status()
+
+    def update(self, docs):
+        """
+        Sends all the documents that have changed, and waits for them all to be accepted.
+        """
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+
+            def _wait(return_when):
+                done, not_done = wait(pending, return_when=return_when)
+                for future in done:
+                    future.result()
+                    batch_fps = pending.pop(future)
+                    if self.store is not None:
+                        self.store.update(batch_fps)
+                    self.sent += len(batch_fps)
+                    self.batches += 1
+                    logger.info("Sent %i of %i records..." % (self.sent, self.seen))
+
+            batch = []
+            batch_fps = []
+            for doc in docs:
+                self.seen += 1
+                fp = fingerprint(doc, self.exclude)
+                if self.skip_unchanged and self.store is not None and not self.store.changed(doc['id'], fp):
+                    continue
+                batch.append(doc)
+                batch_fps.append((doc['id'], fp))
+                if len(batch) >= self.batch_size:
+                    # Don't queue up more batches than there are workers to send them:
+                    while len(pending) >= self.max_workers:
+                        _wait(FIRST_COMPLETED)
+                    pending[pool.submit(self._post, batch)] = batch_fps
+                    batch = []
+                    batch_fps = []
+            if batch:
+                pending[pool.submit(self._post, batch)] = batch_fps
+            while pending:
+                _wait(FIRST_COMPLETED)
+        self.elapsed += time.time() - start
+
+    def commit(self):
+        r = self.session.get(self.update_url, params={'commit': 'true', 'wt': 'json'})
+        r.raise_for_status()
+
+    def stats(self):
+        return {
+            'seen': self.seen,
+            'sent': self.sent,
+            'skipped': self.seen - self.sent,
+            'batches': self.batches,
+            'seconds': self.elapsed,
+            'sent_per_second': self.sent / self.elapsed if self.elapsed > 0 else 0.0
+        }
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from lib.testing import FakeHandler, fake_server
+from lib.solr_updates import FingerprintStore, ParallelSolrUpdater, fingerprint
+
+
+class FakeSolrHandler(FakeHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def read_chunked(self):
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunk = self.rfile.read(size)
+            self.rfile.readline()
+            if size == 0:
+                return body
+            body += chunk
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        # Updates are streamed, so are sent in chunks:
+        assert self.headers['Transfer-Encoding'] == 'chunked'
+        assert 'commitWithin' in parse_qs(urlparse(self.path).query)
+        docs = json.loads(self.read_chunked().decode('utf-8'))
+        time.sleep(0.05)
+        with self.server.lock:
+            self.server.updates += 1
+            for doc in docs:
+                stored = self.server.docs.setdefault(doc['id'], {'id': doc['id']})
+                for name, value in doc.items():
+                    if name != 'id':
+                        stored[name] = value['set']
+            self.server.in_flight -= 1
+        self.respond({'responseHeader': {'status': 0}})
+
+    def do_GET(self):
+        self.respond({'responseHeader': {'status': 0}})
+
+
+def _docs(n, refresh, size=100):
+    return [{'id': 'hdfs://%i' % i, 'file_size_l': str(size if i % 10 else size + 1), 'refresh_date_dt': refresh}
+            for i in range(n)]
+
+
+def test_only_changed_records_are_sent():
+    with fake_server(FakeSolrHandler, docs={}, updates=0, in_flight=0, max_in_flight=0,
+                     lock=threading.Lock()) as server:
+        solr_url = server.base_url + "/solr/tracking"
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FingerprintStore(os.path.join(tmp, 'fingerprints.sqlite'))
+            updater = ParallelSolrUpdater(solr_url, store=store, exclude=['refresh_date_dt'], max_workers=3,
+                                          batch_size=10)
+            updater.update(_docs(200, 'day1'))
+            assert updater.stats()['sent'] == 200
+            assert len(server.docs) == 200
+            assert len(store) == 200
+            assert server.updates == 20
+            assert 1 < server.max_in_flight <= 3
+            store.close()
+
+            # Next time, only the records with other changes than the refresh date are sent:
+            store = FingerprintStore(os.path.join(tmp, 'fingerprints.sqlite'))
+            updater = ParallelSolrUpdater(solr_url, store=store, exclude=['refresh_date_dt'], max_workers=3,
+                                          batch_size=10)
+            docs = _docs(200, 'day2')
+            for doc in docs[:15]:
+                doc['file_size_l'] = '5'
+            updater.update(docs)
+            updater.commit()
+            stats = updater.stats()
+            assert (stats['seen'], stats['sent'], stats['skipped'], stats['batches']) == (200, 15, 185, 2)
+            assert server.docs['hdfs://3'] == {'id': 'hdfs://3', 'file_size_l': '5', 'refresh_date_dt': 'day2'}
+            assert server.docs['hdfs://30']['refresh_date_dt'] == 'day1'
+            store.close()
+
+            # Everything can be sent anyway, while still keeping track of what was sent:
+            store = FingerprintStore(os.path.join(tmp, 'fingerprints.sqlite'))
+            updater = ParallelSolrUpdater(solr_url, store=store, exclude=['refresh_date_dt'], batch_size=10,
+                                          skip_unchanged=False)
+            docs = _docs(200, 'day3')
+            docs[3]['file_size_l'] = '6'
+            updater.update(docs)
+            assert updater.stats()['sent'] == 200
+            assert server.docs['hdfs://30']['refresh_date_dt'] == 'day3'
+            assert not store.changed('hdfs://3', fingerprint(docs[3], ['refresh_date_dt']))
+            store.close()
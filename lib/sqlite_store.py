@@ -0,0 +1,65 @@
+"""
+A small base for the keyed stores that tasks use to remember things between runs, kept on disk in SQLite so they do
+not have to fit in memory.
+"""
+import sqlite3
+
+
+class SqliteStore(object):
+    """
+    A table of rows with a primary key, in a SQLite file.
+
+    Sub-classes set the table name and columns, and turn their own keys and values into rows. Rows can be stored in
+    bulk, or one at a time, in which case they are committed every commit_every rows and on close().
+    """
+
+    # The name of the table, and (name, type) for the key columns and then for the value columns:
+    table = None
+    key_columns = []
+    value_columns = []
+
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self.db = sqlite3.connect(path)
+        columns = ", ".join("%s %s" % column for column in self.key_columns + self.value_columns)
+        self.db.execute("CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (%s)) WITHOUT ROWID" % (
+            self.table, columns, ", ".join(name for name, kind in self.key_columns)))
+        self._where = " AND ".join("%s = ?" % name for name, kind in self.key_columns)
+        self._insert = "INTO %s (%s) VALUES (%s)" % (
+            self.table, ", ".join(name for name, kind in self.key_columns + self.value_columns),
+            ", ".join("?" for column in self.key_columns + self.value_columns))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def clear(self):
+        self.db.execute("DELETE FROM %s" % self.table)
+        self.db.commit()
+
+    def _contains(self, key):
+        return self.db.execute("SELECT 1 FROM %s WHERE %s" % (self.table, self._where), key).fetchone() is not None
+
+    def _lookup(self, key):
+        """
+        The values stored for the key, as a tuple, or None if there are none.
+        """
+        return self.db.execute("SELECT %s FROM %s WHERE %s" % (
+            ", ".join(name for name, kind in self.value_columns), self.table, self._where), key).fetchone()
+
+    def _store(self, row, replace=True):
+        self.db.execute("INSERT OR %s %s" % ('REPLACE' if replace else 'IGNORE', self._insert), row)
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.db.commit()
+            self._uncommitted = 0
+
+    def _store_many(self, rows, replace=True):
+        self.db.executemany("INSERT OR %s %s" % ('REPLACE' if replace else 'IGNORE', self._insert), rows)
+        self.db.commit()
+        self._uncommitted = 0
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM %s" % self.table).fetchone()[0]
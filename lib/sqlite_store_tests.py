@@ -0,0 +1,39 @@
+import os
+import tempfile
+from lib.sqlite_store import SqliteStore
+
+
+class Scores(SqliteStore):
+    table = 'scores'
+    key_columns = [('name', 'TEXT'), ('round', 'INTEGER')]
+    value_columns = [('score', 'INTEGER')]
+
+
+def test_rows_stored_one_at_a_time_are_committed_in_batches():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scores.sqlite')
+        store = Scores(path, commit_every=3)
+        for i in range(5):
+            store._store(('a', i, i * 10))
+        # Only the first batch has been committed so far:
+        other = Scores(path)
+        assert len(other) == 3
+        assert other._lookup(('a', 2)) == (20,)
+        assert not other._contains(('a', 4))
+        store.close()
+        assert len(other) == 5
+        other.close()
+
+
+def test_bulk_rows_can_be_replaced_or_kept():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = Scores(os.path.join(tmp, 'scores.sqlite'))
+        store._store_many([('a', 1, 10), ('b', 1, 20)])
+        store._store_many([('a', 1, 11)], replace=False)
+        assert store._lookup(('a', 1)) == (10,)
+        store._store_many([('a', 1, 12)])
+        assert store._lookup(('a', 1)) == (12,)
+        assert store._lookup(('c', 1)) is None
+        store.clear()
+        assert len(store) == 0
+        store.close()
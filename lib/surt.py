@@ -13,3 +13,71 @@ def url_to_surt(in_url, host_only=False):
     if parsed.path and not host_only:
         surt = "%s%s" %( surt , os.path.dirname(parsed.path) )
     return surt
+
+
+# Key used to hold the entry for the prefix ending at a trie node (never clashes with a single character):
+_END = None
+
+
+class SurtPrefixIndex(object):
+    '''
+    A character-level prefix trie over SURT prefixes.
+
+    Finds the longest indexed prefix of a SURT in time proportional to the length of the SURT, rather than to the
+    number of prefixes. Matching follows str.startswith(), so prefixes need not end on a segment boundary.
+    '''
+
+    def __init__(self, items=()):
+        '''
+        :param items: iterable of (surt_prefix, value) pairs
+        '''
+        self._root = {}
+        self._size = 0
+        for prefix, value in items:
+            self.add(prefix, value)
+
+    def add(self, prefix, value=None):
+        node = self._root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        if _END not in node:
+            self._size += 1
+        node[_END] = (prefix, value)
+
+    def longest_match(self, surt):
+        '''
+        Returns the (prefix, value) pair for the longest indexed prefix of the given SURT, or None.
+        '''
+        node = self._root
+        match = node.get(_END)
+        for c in surt:
+            node = node.get(c)
+            if node is None:
+                break
+            match = node.get(_END, match)
+        return match
+
+    def matches(self, surt):
+        '''
+        Yields the (prefix, value) pair for every indexed prefix of the given SURT, shortest first.
+        '''
+        node = self._root
+        if _END in node:
+            yield node[_END]
+        for c in surt:
+            node = node.get(c)
+            if node is None:
+                return
+            if _END in node:
+                yield node[_END]
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, prefix):
+        node = self._root
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return False
+        return _END in node
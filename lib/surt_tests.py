@@ -0,0 +1,26 @@
+from lib.surt import url_to_surt, SurtPrefixIndex
+
+
+def test_surt_prefix_index_longest_match():
+    index = SurtPrefixIndex([
+        (url_to_surt("http://www.gov.uk/"), 1),
+        (url_to_surt("http://www.gov.uk/government/publications/"), 2),
+        (url_to_surt("http://example.org/reports/"), 3),
+    ])
+    assert len(index) == 3
+
+    assert index.longest_match(url_to_surt("http://www.gov.uk/government/publications/a/b.pdf"))[1] == 2
+    assert index.longest_match(url_to_surt("http://www.gov.uk/other/b.pdf"))[1] == 1
+    assert index.longest_match(url_to_surt("http://example.org/reports/x.pdf"))[1] == 3
+    assert index.longest_match(url_to_surt("http://example.org/x.pdf")) is None
+    assert index.longest_match(url_to_surt("http://example.com/reports/x.pdf")) is None
+    assert [v for p, v in index.matches(url_to_surt("http://www.gov.uk/government/publications/a/b.pdf"))] == [1, 2]
+
+    # Should agree with a plain startswith() scan:
+    prefixes = [url_to_surt("http://www.gov.uk/"), url_to_surt("http://www.gov.uk/government/publications/")]
+    for url in ["http://www.gov.uk/government/publicationsX/y.pdf", "http://www.gov.uk.evil.com/x"]:
+        surt = url_to_surt(url)
+        matches = [p for p in prefixes if surt.startswith(p)]
+        expected = max(matches, key=len) if matches else None
+        match = index.longest_match(surt)
+        assert (match[0] if match else None) == expected
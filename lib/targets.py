@@ -1,5 +1,8 @@
 import os
+import time
+import atexit
 import pysolr
+import threading
 import logging
 import posixpath
 import luigi
@@ -222,6 +225,126 @@ class DatedStateFileTask(luigi.Task):
         return True
 
 
+class TrackingDBStatusBatch(object):
+    """
+    Shares one Solr connection between all the TrackingDBStatusField targets for a tracking database, and batches up
+    their queries and updates.
+
+    The status field values for many documents can be prefetched with a single {!terms} query, so exists() can be
+    answered from the cache. Calls to touch() are queued up and sent as bulk atomic updates, every flush_size updates
+    or flush_interval seconds, and when the process exits. Solr then commits them within commit_within milliseconds.
+    """
+    _batches = {}
+    _batches_lock = threading.Lock()
+
+    # How many ids to ask for in each {!terms} query:
+    prefetch_size = 1000
+
+    def __init__(self, trackdb, flush_size=1000, flush_interval=30, commit_within=10000):
+        self.trackdb = trackdb
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.commit_within = commit_within
+        self.solr = pysolr.Solr(self.trackdb, always_commit=False)
+        self._lock = threading.RLock()
+        # Known field values, keyed on (doc_id, field):
+        self._values = {}
+        # Queued updates, keyed on field then doc_id:
+        self._pending = {}
+        self._pending_count = 0
+        self._last_flush = time.time()
+
+    @classmethod
+    def for_trackdb(cls, trackdb):
+        with cls._batches_lock:
+            if trackdb not in cls._batches:
+                batch = cls(trackdb)
+                cls._batches[trackdb] = batch
+                atexit.register(batch.flush)
+            return cls._batches[trackdb]
+
+    def prefetch(self, field, doc_ids):
+        """
+        Looks up the field values for all the given documents, using as few queries as possible.
+        """
+        with self._lock:
+            to_fetch = sorted(set(doc_id for doc_id in doc_ids if (doc_id, field) not in self._values))
+        for i in range(0, len(to_fetch), self.prefetch_size):
+            chunk = to_fetch[i:i + self.prefetch_size]
+            # Pick a separator that does not appear in any of the ids:
+            separator = next(sep for sep in [',', '|', '\t', '\n'] if not any(sep in doc_id for doc_id in chunk))
+            q = '{!terms f=id separator="%s"}%s' % (separator.encode('unicode_escape').decode('ascii'),
+                                                     separator.join(chunk))
+            result = self.solr.search(q=q, fl='id,%s' % field, rows=len(chunk))
+            found = {}
+            for doc in result.docs:
+                values = doc.get(field, [])
+                if not isinstance(values, list):
+                    values = [values]
+                found[doc['id']] = set(str(v) for v in values)
+            with self._lock:
+                for doc_id in chunk:
+                    # Don't overwrite anything touched in the meantime:
+                    self._values.setdefault((doc_id, field), found.get(doc_id, set()))
+        logger.debug("Prefetched %s for %i documents" % (field, len(to_fetch)))
+
+    def has_status(self, doc_id, field, value):
+        with self._lock:
+            cached = (doc_id, field) in self._values
+        if not cached:
+            self.prefetch(field, [doc_id])
+        with self._lock:
+            return str(value) in self._values[(doc_id, field)]
+
+    def set_status(self, doc_id, field, value):
+        with self._lock:
+            # N.B. this 'set's the field, replacing any other values:
+            self._values[(doc_id, field)] = set([str(value)])
+            self._pending.setdefault(field, {})[doc_id] = value
+            self._pending_count += 1
+            due = self._pending_count >= self.flush_size or time.time() - self._last_flush > self.flush_interval
+        if due:
+            self.flush()
+
+    @classmethod
+    def flush_all(cls):
+        with cls._batches_lock:
+            batches = list(cls._batches.values())
+        for batch in batches:
+            batch.flush()
+
+    def flush(self):
+        """
+        Sends any queued updates to Solr, one bulk update per field.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_count = 0
+            self._last_flush = time.time()
+            for field, updates in pending.items():
+                docs = [{'id': doc_id, field: value} for doc_id, value in updates.items()]
+                logger.info("Updating %s for %i documents in %s" % (field, len(docs), self.trackdb))
+                try:
+                    self.solr.add(docs, fieldUpdates={field: 'set'}, commitWithin=self.commit_within)
+                except Exception:
+                    # Put them back, so they can be retried:
+                    for doc_id, value in updates.items():
+                        self._pending.setdefault(field, {}).setdefault(doc_id, value)
+                        self._pending_count += 1
+                    raise
+
+
+# Remember which process we started in, so we can spot tasks being run in forked worker processes:
+_MAIN_PID = os.getpid()
+
+
+@luigi.Task.event_handler(luigi.Event.SUCCESS)
+def flush_tracking_db_updates(task):
+    # Forked worker processes do not run atexit handlers, so make sure their updates are sent before they finish:
+    if os.getpid() != _MAIN_PID:
+        TrackingDBStatusBatch.flush_all()
+
+
 class TrackingDBStatusField(luigi.Target):
 
     DEFAULT_TRACKDB = os.environ.get('TRACKING_DB_SOLR_URL', 'http://localhost:8983/solr/tracking')
@@ -241,20 +364,28 @@ class TrackingDBStatusField(luigi.Target):
         self.value = value
         self.trackdb = trackdb or self.DEFAULT_TRACKDB
 
-        # Setup connection:
-        self.solr = pysolr.Solr(self.trackdb, always_commit=True)
+        # Share the connection, cache and update queue with the other targets for this tracking database:
+        self.batch = TrackingDBStatusBatch.for_trackdb(self.trackdb)
+
+    @staticmethod
+    def prefetch(targets):
+        """
+        Looks up the status of many targets at once, so their exists() calls do not each need a query.
+
+        e.g. call this from a WrapperTask.requires() on the outputs of the tasks it is about to yield.
+        """
+        groups = {}
+        for t in targets:
+            if isinstance(t, TrackingDBStatusField):
+                groups.setdefault((t.trackdb, t.field), []).append(t.doc_id)
+        for (trackdb, field), doc_ids in groups.items():
+            TrackingDBStatusBatch.for_trackdb(trackdb).prefetch(field, doc_ids)
 
     def exists(self):
-        result = self.solr.search(q='id:"%s" AND %s:"%s"' % (self.doc_id, self.field, self.value))
-        if result.hits == 0:
-            return False
-        else:
-            return True
+        return self.batch.has_status(self.doc_id, self.field, self.value)
 
     def touch(self):
-        doc = {'id': self.doc_id, self.field: self.value}
-        result = self.solr.add([doc], fieldUpdates={self.field: 'set'}, softCommit=True)
-        print(result)
+        self.batch.set_status(self.doc_id, self.field, self.value)
 
     def open(self, mode):
         raise NotImplementedError("Cannot open() TrackingDBStatusField")
@@ -0,0 +1,77 @@
+import re
+import json
+import xml.etree.ElementTree as etree
+from urllib.parse import urlparse, parse_qs
+from lib.testing import FakeHandler, fake_server
+from lib.targets import TrackingDBStatusField, TrackingDBStatusBatch
+
+
+class FakeSolrHandler(FakeHandler):
+
+    def do_GET(self):
+        self.handle_request(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        params = parse_qs(urlparse(self.path).query)
+        if self.headers['Content-Type'].startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qs(body))
+        self.handle_request(params, body)
+
+    def handle_request(self, params, body=None):
+        path = urlparse(self.path).path.rstrip('/')
+        if path.endswith('/select'):
+            self.server.selects += 1
+            m = re.match(r'\{!terms f=id separator="(.*?)"\}(.*)', params['q'][0], re.DOTALL)
+            separator = m.group(1).encode('ascii').decode('unicode_escape')
+            ids = m.group(2).split(separator)
+            fields = params['fl'][0].split(',')
+            docs = [dict((k, v) for k, v in self.server.docs[i].items() if k in fields)
+                    for i in ids if i in self.server.docs]
+            self.respond({'responseHeader': {'status': 0}, 'response': {'numFound': len(docs), 'docs': docs}})
+        elif path.endswith('/update'):
+            self.server.updates += 1
+            # Depending on the pysolr version, atomic updates are sent as JSON or XML:
+            if self.headers['Content-Type'].startswith('application/json'):
+                docs = [dict((k, v['set'] if isinstance(v, dict) else v) for k, v in d.items())
+                        for d in json.loads(body)]
+            else:
+                docs = [dict((f.get('name'), f.text) for f in doc.findall('field'))
+                        for doc in etree.fromstring(body).findall('doc')]
+            for fields in docs:
+                self.server.docs.setdefault(fields['id'], {'id': fields['id']})
+                for name, value in fields.items():
+                    if name != 'id':
+                        self.server.docs[fields['id']][name] = [value]
+            self.respond({'responseHeader': {'status': 0}})
+        else:
+            self.send_error(404)
+
+
+def test_tracking_db_status_batching():
+    with fake_server(FakeSolrHandler, docs={}, selects=0, updates=0) as server:
+        trackdb = server.base_url + "/solr/tracking"
+        server.docs['hdfs://a,1'] = {'id': 'hdfs://a,1', 'cdx_index_ss': ['data-heritrix']}
+        server.docs['hdfs://b'] = {'id': 'hdfs://b', 'cdx_index_ss': ['other']}
+        targets = [TrackingDBStatusField(doc_id="hdfs://%s" % i, field='cdx_index_ss', value='data-heritrix',
+                                         trackdb=trackdb) for i in ['a,1', 'b', 'c']]
+
+        # One query for all of them:
+        TrackingDBStatusField.prefetch(targets)
+        assert server.selects == 1
+        assert [t.exists() for t in targets] == [True, False, False]
+        assert server.selects == 1
+
+        # Updates are queued up, then sent together:
+        batch = TrackingDBStatusBatch.for_trackdb(trackdb)
+        targets[1].touch()
+        targets[2].touch()
+        assert server.updates == 0
+        assert targets[1].exists()
+        batch.flush()
+        assert server.updates == 1
+        assert server.docs['hdfs://c']['cdx_index_ss'] == ['data-heritrix']
+
+        # Anything not prefetched is looked up on demand:
+        assert not TrackingDBStatusField(doc_id='hdfs://d', field='cdx_index_ss', value='x', trackdb=trackdb).exists()
+        assert server.selects == 2
@@ -0,0 +1,60 @@
+"""
+Helpers for the tests, which run the code against small fake HTTP services on the loopback interface.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server, so the code under test can make concurrent requests. Tests keep whatever state they need
+    as attributes of the server, where their handlers can get at it via self.server.
+    """
+    daemon_threads = True
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%i" % self.server_port
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    Sub-classes add the do_GET/do_POST methods for the service they stand in for.
+    """
+
+    def send_body(self, body, content_type=None, status=200, headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond(self, data, status=200):
+        self.send_body(json.dumps(data), 'application/json', status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def fake_server(handler, server_class=FakeServer, **state):
+    """
+    Runs a fake server in the background for the duration of the with block, with the given state set on it.
+    """
+    server = server_class(('127.0.0.1', 0), handler)
+    for name, value in state.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
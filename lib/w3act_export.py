@@ -0,0 +1,152 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+def write_export(data, export_dir):
+    """
+    Writes out W3ACT data (as loaded from the CSV dump, i.e. a dict of kind -> {id: entity}) as one JSON Lines file
+    per kind of entity, each with an index of the byte offset of each entity's line, so that readers can pick out
+    just the kinds or entities they need.
+
+    Each line holds [id, entity]. Any top-level values that are not dicts of entities are kept in the manifest.
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    manifest = {'kinds': {}, 'values': {}}
+    for kind, entities in data.items():
+        if not isinstance(entities, dict):
+            manifest['values'][kind] = entities
+            continue
+        index = {}
+        with open(os.path.join(export_dir, '%s.jsonl' % kind), 'wb') as f:
+            for entity_id, entity in entities.items():
+                index[str(entity_id)] = f.tell()
+                f.write(json.dumps([str(entity_id), entity]).encode('utf-8'))
+                f.write(b'\n')
+        with open(os.path.join(export_dir, '%s.idx.json' % kind), 'w') as f:
+            json.dump(index, f)
+        manifest['kinds'][kind] = len(index)
+        logger.info("Wrote %i %s to %s" % (len(index), kind, export_dir))
+    # The manifest goes last, so a partial export is easy to spot:
+    with open(os.path.join(export_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class W3actExport(object):
+    """
+    Reads a split W3ACT export, only loading the parts that are asked for.
+
+    Entities are loaded in full per kind with all(), or one at a time with get(). Whatever is loaded is kept, so the
+    results are shared and should be treated as read-only.
+    """
+
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        with open(os.path.join(export_dir, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._all = {}
+        self._entities = {}
+
+    def kinds(self):
+        return list(self.manifest['kinds'].keys())
+
+    def count(self, kind):
+        return self.manifest['kinds'][kind]
+
+    def value(self, name):
+        return self.manifest['values'][name]
+
+    def _path(self, kind, ext):
+        if kind not in self.manifest['kinds']:
+            raise KeyError("No %s in the W3ACT export at %s" % (kind, self.export_dir))
+        return os.path.join(self.export_dir, '%s.%s' % (kind, ext))
+
+    def index(self, kind):
+        with self._lock:
+            if kind not in self._indexes:
+                with open(self._path(kind, 'idx.json')) as f:
+                    self._indexes[kind] = json.load(f)
+            return self._indexes[kind]
+
+    def ids(self, kind):
+        return list(self.index(kind).keys())
+
+    def iter(self, kind):
+        """
+        Yields (id, entity) for every entity of the given kind, in the original order, without keeping them.
+        """
+        with open(self._path(kind, 'jsonl'), 'rb') as f:
+            for line in f:
+                entity_id, entity = json.loads(line)
+                yield entity_id, entity
+
+    def all(self, kind):
+        """
+        Returns a dict of id -> entity for the given kind, as in the original all.json.
+        """
+        with self._lock:
+            if kind not in self._all:
+                self._all[kind] = dict(self.iter(kind))
+            return self._all[kind]
+
+    def get(self, kind, entity_id, default=None):
+        entity_id = str(entity_id)
+        if kind in self._all:
+            return self._all[kind].get(entity_id, default)
+        offset = self.index(kind).get(entity_id)
+        if offset is None:
+            return default
+        with self._lock:
+            key = (kind, entity_id)
+            if key not in self._entities:
+                with open(self._path(kind, 'jsonl'), 'rb') as f:
+                    f.seek(offset)
+                    self._entities[key] = json.loads(f.readline())[1]
+            return self._entities[key]
+
+
+_exports = {}
+_json_files = {}
+_memo_lock = threading.Lock()
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+
+def open_export(export_dir):
+    """
+    Returns the W3actExport for the given folder, shared by everything in this process that reads the same export.
+    """
+    key = _file_key(os.path.join(export_dir, MANIFEST))
+    with _memo_lock:
+        if key not in _exports:
+            for old in [k for k in _exports if k[0] == key[0]]:
+                del _exports[old]
+            _exports[key] = W3actExport(export_dir)
+        return _exports[key]
+
+
+def load_json(path):
+    """
+    Loads a JSON file once per process (until the file changes), e.g. so the crawl feed is not parsed again for every
+    document. The result is shared, so should be treated as read-only.
+    """
+    key = _file_key(path)
+    with _memo_lock:
+        if key not in _json_files:
+            # Only keep the latest version of each file:
+            for old in [k for k in _json_files if k[0] == key[0]]:
+                del _json_files[old]
+            with open(path) as f:
+                _json_files[key] = json.load(f)
+        return _json_files[key]
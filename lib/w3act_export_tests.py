@@ -0,0 +1,39 @@
+import os
+import json
+import tempfile
+from lib.w3act_export import write_export, open_export, load_json
+
+DATA = {
+    'targets': dict((str(i), {'id': i, 'title': 'Target é %i' % i, 'crawl_frequency': 'DAILY'})
+                    for i in range(1, 200)),
+    'collections': {'5': {'id': 5, 'name': 'Collection', 'children': []}},
+    'subjects': {},
+    'exported_at': '2026-10-16T12:00:00'
+}
+
+
+def test_split_export_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        export_dir = os.path.join(tmp, 'all-split')
+        write_export(DATA, export_dir)
+
+        w3a = open_export(export_dir)
+        assert open_export(export_dir) is w3a
+        assert sorted(w3a.kinds()) == ['collections', 'subjects', 'targets']
+        assert w3a.count('targets') == 199
+        assert w3a.value('exported_at') == DATA['exported_at']
+
+        # Single entities are looked up without loading the rest:
+        assert w3a.get('targets', 150) == DATA['targets']['150']
+        assert w3a.get('targets', 1000) is None
+        assert 'targets' not in w3a._all
+
+        # Same as reading the whole thing from all.json:
+        with open(os.path.join(tmp, 'all.json'), 'w') as f:
+            json.dump(DATA, f, indent=2)
+        everything = load_json(os.path.join(tmp, 'all.json'))
+        for kind in w3a.kinds():
+            assert w3a.all(kind) == everything[kind]
+            assert list(w3a.all(kind).keys()) == list(everything[kind].keys())
+        assert w3a.all('targets') is w3a.all('targets')
+        assert load_json(os.path.join(tmp, 'all.json')) is everything
@@ -1,8 +1,15 @@
 import os
 import zlib
 import gzip
+import queue
 import logging
+import datetime
 import tempfile
+import posixpath
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import luigi
 import luigi.format
 import luigi.contrib.hdfs
@@ -217,3 +224,145 @@ class WebHdfsAtomicWritePipe(object):
     def seekable(self):
         return False
 
+
+
+# How WebHDFS file types map to the first character of the 'ls' style permissions:
+FILE_TYPES = {'DIRECTORY': 'd', 'SYMLINK': 'l', 'FILE': '-'}
+
+
+def permission_string(status):
+    """
+    Turns the type and octal permission of a WebHDFS FileStatus into the usual 'ls' form, e.g. 'drwxr-xr-x'.
+    """
+    perm = int(status['permission'], 8)
+    chars = []
+    for shift in (6, 3, 0):
+        bits = (perm >> shift) & 7
+        chars += ['r' if bits & 4 else '-', 'w' if bits & 2 else '-', 'x' if bits & 1 else '-']
+    # Sticky bit:
+    if perm & 0o1000:
+        chars[8] = 't' if chars[8] == 'x' else 'T'
+    ls = FILE_TYPES.get(status['type'], '-') + ''.join(chars)
+    if status.get('aclBit', False):
+        ls += '+'
+    return ls
+
+
+def status_to_ls(parent_path, status):
+    """
+    Turns a WebHDFS FileStatus into the fields listed by 'hadoop fs -ls'.
+
+    N.B. like 'hadoop fs -ls', the modification time is given in local time.
+    """
+    modified_at = datetime.datetime.fromtimestamp(status['modificationTime'] // 1000)
+    return {
+        'permissions': permission_string(status),
+        'number_of_replicas': str(status['replication']),
+        'userid': status['owner'],
+        'groupid': status['group'],
+        'filesize': str(status['length']),
+        'modified_at': modified_at.isoformat(),
+        'filename': posixpath.join(parent_path, status['pathSuffix'])
+    }
+
+
+class WebHdfsTreeWalker(object):
+    """
+    Lists everything under a HDFS path, using a pool of threads to list different directories at the same time.
+
+    Large directories are paged through using LISTSTATUS_BATCH (falling back on LISTSTATUS if the server does not
+    support it), and entries are yielded as each page arrives, so only a few pages are held in memory at once.
+    """
+
+    def __init__(self, client=None, max_workers=16, max_queued_pages=64):
+        self.client = client or webhdfs()
+        self.max_workers = max_workers
+        self.max_queued_pages = max_queued_pages
+        self.batch_supported = True
+        # Allow one kept-alive connection per thread:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.client._session.mount('http://', adapter)
+        self.client._session.mount('https://', adapter)
+
+    def _get(self, path, **params):
+        # N.B. the hdfs client has no LISTSTATUS_BATCH operation, so the request is made directly:
+        url = "%s/webhdfs/v1%s" % (self.client.url.split(';')[0].rstrip('/'),
+                                   quote(self.client.resolve(path), '/= '))
+        return self.client._request('GET', url, params=params)
+
+    def list_pages(self, path):
+        """
+        Yields the FileStatus entries of a directory, a page at a time.
+        """
+        start_after = None
+        while self.batch_supported:
+            params = {'op': 'LISTSTATUS_BATCH'}
+            if start_after is not None:
+                params['startAfter'] = start_after
+            r = self._get(path, **params)
+            if r.status_code == 400 and start_after is None:
+                # Older versions of HDFS do not support paging:
+                logger.warning("LISTSTATUS_BATCH is not supported, falling back on LISTSTATUS: %s" % r.text)
+                self.batch_supported = False
+                break
+            r.raise_for_status()
+            listing = r.json()['DirectoryListing']
+            statuses = listing['partialListing']['FileStatuses']['FileStatus']
+            if statuses:
+                yield statuses
+            if listing['remainingEntries'] == 0 or not statuses:
+                return
+            start_after = statuses[-1]['pathSuffix']
+
+        r = self._get(path, op='LISTSTATUS')
+        r.raise_for_status()
+        yield r.json()['FileStatuses']['FileStatus']
+
+    def walk(self, path='/'):
+        """
+        Yields (parent_path, FileStatus) for every file and directory under the given path, at any depth.
+
+        N.B. the order depends on which listings come back first.
+        """
+        results = queue.Queue(maxsize=self.max_queued_pages)
+        stop = threading.Event()
+
+        def _put(item):
+            # Wait for space in the queue, unless the walk has been abandoned:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def _list(dir_path):
+            if stop.is_set():
+                return
+            try:
+                for statuses in self.list_pages(dir_path):
+                    _put((dir_path, statuses, None))
+                # Mark this directory as done:
+                _put((dir_path, None, None))
+            except Exception as e:
+                _put((dir_path, None, e))
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            pending = 1
+            pool.submit(_list, path)
+            while pending > 0:
+                dir_path, statuses, error = results.get()
+                if error is not None:
+                    raise error
+                if statuses is None:
+                    pending -= 1
+                    continue
+                for status in statuses:
+                    if status['type'] == 'DIRECTORY':
+                        pending += 1
+                        pool.submit(_list, posixpath.join(dir_path, status['pathSuffix']))
+                    yield dir_path, status
+        finally:
+            stop.set()
+            pool.shutdown(wait=True)
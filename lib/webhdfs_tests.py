@@ -0,0 +1,100 @@
+from urllib.parse import urlparse, parse_qs, unquote
+from hdfs import InsecureClient
+from lib.testing import FakeServer, FakeHandler, fake_server
+from lib.webhdfs import WebHdfsTreeWalker, permission_string, status_to_ls
+
+# A small tree of files, as {path: size}:
+FILES = {
+    '/data/1/2/WARCS/a.warc.gz': 1000,
+    '/data/1/2/Logs/crawl.log': 20,
+    '/heritrix/output/frequent-npld/20190101000000/warcs/b.warc.gz': 3000,
+    '/1_data/npld/x/empty/warcs/c.warc.gz': 0,
+}
+
+
+def _build_tree():
+    tree = {'/': {}}
+    paths = dict(FILES)
+    # Plus one big directory, that needs several pages:
+    for i in range(25):
+        paths['/big/%03i.txt' % i] = i
+    for path, size in paths.items():
+        parts = path.strip('/').split('/')
+        for depth in range(len(parts)):
+            parent = '/' + '/'.join(parts[:depth])
+            tree.setdefault(parent, {})
+            is_dir = depth < len(parts) - 1
+            tree[parent][parts[depth]] = {
+                'pathSuffix': parts[depth], 'type': 'DIRECTORY' if is_dir else 'FILE',
+                'length': 0 if is_dir else size, 'owner': 'hdfs', 'group': 'supergroup',
+                'permission': '755' if is_dir else '644', 'replication': 0 if is_dir else 3,
+                'modificationTime': 1546300800000, 'accessTime': 0, 'blockSize': 134217728,
+            }
+    return tree, paths
+
+
+class FakeWebHdfs(FakeServer):
+
+    def __init__(self, *args, **kwargs):
+        super(FakeWebHdfs, self).__init__(*args, **kwargs)
+        self.tree, self.files = _build_tree()
+        self.page_size = 10
+        self.supports_batch = True
+        self.ops = []
+
+
+class FakeWebHdfsHandler(FakeHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = unquote(url.path[len('/webhdfs/v1'):]).rstrip('/') or '/'
+        params = parse_qs(url.query)
+        op = params['op'][0]
+        self.server.ops.append(op)
+        entries = [self.server.tree[path][k] for k in sorted(self.server.tree[path])]
+        if op == 'LISTSTATUS':
+            self.respond({'FileStatuses': {'FileStatus': entries}})
+        elif op == 'LISTSTATUS_BATCH' and self.server.supports_batch:
+            if 'startAfter' in params:
+                entries = [e for e in entries if e['pathSuffix'] > params['startAfter'][0]]
+            page = entries[:self.server.page_size]
+            self.respond({'DirectoryListing': {
+                'partialListing': {'FileStatuses': {'FileStatus': page}},
+                'remainingEntries': len(entries) - len(page)}})
+        else:
+            self.respond({'RemoteException': {'exception': 'IllegalArgumentException',
+                                              'message': 'Invalid value for webhdfs parameter "op"'}}, status=400)
+
+
+def test_tree_walker():
+    with fake_server(FakeWebHdfsHandler, FakeWebHdfs) as server:
+        for supports_batch in [True, False]:
+            server.supports_batch = supports_batch
+            server.ops = []
+            client = InsecureClient(server.base_url, user='test')
+            walker = WebHdfsTreeWalker(client, max_workers=4)
+            rows = [status_to_ls(parent, status) for parent, status in walker.walk('/')]
+            files = dict((r['filename'], int(r['filesize'])) for r in rows if r['permissions'][0] != 'd')
+            assert files == server.files
+            dirs = [r for r in rows if r['permissions'][0] == 'd']
+            assert len(dirs) == len(server.tree) - 1
+            if supports_batch:
+                # The big directory takes three pages:
+                assert server.ops.count('LISTSTATUS_BATCH') == len(server.tree) + 2
+                assert 'LISTSTATUS' not in server.ops
+            else:
+                assert not walker.batch_supported
+                assert server.ops.count('LISTSTATUS') == len(server.tree)
+
+
+def test_status_to_ls():
+    status = {'pathSuffix': 'a.warc.gz', 'type': 'FILE', 'length': 10, 'owner': 'tomcat', 'group': 'supergroup',
+              'permission': '644', 'replication': 2, 'modificationTime': 1546300800999}
+    row = status_to_ls('/data', status)
+    assert row['permissions'] == '-rw-r--r--'
+    assert row['filename'] == '/data/a.warc.gz'
+    assert row['number_of_replicas'] == '2'
+    assert row['modified_at'].endswith(':00')
+    assert permission_string({'type': 'DIRECTORY', 'permission': '1777', 'aclBit': True}) == 'drwxrwxrwt+'
+    assert permission_string({'type': 'DIRECTORY', 'permission': '1770'}) == 'drwxrwx--T'
@@ -0,0 +1,80 @@
+import sys
+import time
+import argparse
+import datetime
+from lib.crawl_files import CrawlFilesDB
+
+"""
+Benchmarks loading the crawl_files table in bulk (COPY into a staging table, then one upsert) against sending one
+upsert per file, as the Solr Tracking DB updates do. The per-file approach is timed on a sample and extrapolated.
+
+Run against a throwaway database, as the crawl_files table is cleared first, e.g.
+
+    python -m scripts.benchmark_crawl_files "dbname=crawl_files_test" --files 2000000
+"""
+
+PER_FILE_UPSERT = (
+    "INSERT INTO crawl_files (filename, job_name, job_launch, full_path, extension, type, size, created_at,"
+    " storage_uri, stream, terms, last_seen_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, ARRAY[%s], %s, %s, %s)"
+    " ON CONFLICT (filename, job_name, job_launch) DO UPDATE SET size = EXCLUDED.size,"
+    " last_seen_at = EXCLUDED.last_seen_at")
+
+
+def synthetic_files(n):
+    launch = datetime.datetime(2019, 8, 1)
+    for i in range(n):
+        path = '/heritrix/output/frequent/%s/warcs/BL-%i.warc.gz' % (launch.strftime('%Y%m%d%H%M%S'), i)
+        yield {
+            'filename': 'BL-%i.warc.gz' % i, 'job_name': 'frequent', 'job_launch': launch.strftime('%Y%m%d%H%M%S'),
+            'full_path': path, 'extension': '.warc.gz', 'type': 'warcs', 'size': 1000000000 + i,
+            'created_at': (launch + datetime.timedelta(seconds=i)).isoformat(),
+            'storage_uri': 'hdfs://hdfs:54310%s' % path, 'stream': 'frequent', 'terms': 'npld'
+        }
+
+
+def per_file(db, files, batch_size=1000):
+    # One statement per file, committing every batch_size files:
+    seen_at = datetime.datetime.utcnow()
+    with db.connection.cursor() as cur:
+        for i, f in enumerate(files):
+            cur.execute(PER_FILE_UPSERT, (f['filename'], f['job_name'], f['job_launch'], f['full_path'],
+                                          f['extension'], f['type'], f['size'], f['created_at'],
+                                          f['storage_uri'], f['stream'], f['terms'], seen_at))
+            if i % batch_size == 0:
+                db.connection.commit()
+    db.connection.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser('Benchmark bulk loading of the crawl_files table.')
+    parser.add_argument('dsn', help="Connection string for a throwaway database with the crawl_files table.")
+    parser.add_argument('--files', type=int, default=1000000, help="Number of synthetic files to load.")
+    parser.add_argument('--sample', type=int, default=50000, help="Number of files to load one at a time.")
+    args = parser.parse_args(argv)
+
+    db = CrawlFilesDB(args.dsn)
+    with db.connection, db.connection.cursor() as cur:
+        cur.execute("TRUNCATE crawl_files")
+
+    start = time.time()
+    counts = db.load(synthetic_files(args.files))
+    bulk_insert = time.time() - start
+    print("Bulk insert of %i files: %.2fs (%s)" % (args.files, bulk_insert, counts))
+
+    start = time.time()
+    counts = db.load(synthetic_files(args.files))
+    bulk_update = time.time() - start
+    print("Bulk update of %i files: %.2fs (%s)" % (args.files, bulk_update, counts))
+
+    start = time.time()
+    per_file(db, synthetic_files(args.sample))
+    sample = time.time() - start
+    estimate = sample * args.files / args.sample
+    print("Per-file update of %i files: %.2fs, so about %.2fs for %i files (%.1fx slower)" % (
+        args.sample, sample, estimate, args.files, estimate / bulk_update))
+
+    db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
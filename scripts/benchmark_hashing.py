@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import tracemalloc
+from lib.hashing import hash_file, hash_files
+
+"""
+Benchmarks whole-file SHA-512 hashing (as the move-to-HDFS tasks used to do) against the chunked, read-ahead hashing
+in lib.hashing, on large synthetic files. Reports time and peak Python memory for each.
+"""
+
+
+def read_all(path):
+    with open(path, 'rb') as reader:
+        return hashlib.sha512(reader.read()).hexdigest()
+
+
+def measure(label, func, *args):
+    tracemalloc.start()
+    start = time.time()
+    result = func(*args)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-28s %8.2fs %10.1f MB peak" % (label, elapsed, peak / (1024.0 * 1024.0)))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser('Benchmark chunked hashing on large synthetic files.')
+    parser.add_argument('--size-mb', type=int, default=512, help="Size of each synthetic file, in MB.")
+    parser.add_argument('--files', type=int, default=4, help="Number of synthetic files.")
+    parser.add_argument('--dir', default=None, help="Where to write the synthetic files (defaults to a temp dir).")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        paths = []
+        block = os.urandom(1024 * 1024)
+        for i in range(args.files):
+            path = os.path.join(tmp, "synthetic-%i.warc.gz" % i)
+            with open(path, 'wb') as f:
+                for j in range(args.size_mb):
+                    f.write(block)
+            paths.append(path)
+
+        print("%i files of %i MB" % (args.files, args.size_mb))
+        whole = measure("read() then hash, serial", lambda: {p: read_all(p) for p in paths})
+        chunked = measure("chunked, serial", lambda: {p: hash_file(p) for p in paths})
+        pooled = measure("chunked, thread pool", hash_files, paths)
+
+        assert whole == chunked == pooled
+
+
+if __name__ == "__main__":
+    sys.exit(main())
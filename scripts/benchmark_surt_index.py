@@ -0,0 +1,54 @@
+import sys
+import time
+import random
+import argparse
+from lib.surt import url_to_surt, SurtPrefixIndex
+
+"""
+Micro-benchmark comparing the linear scan over watched SURTs (as CrawlLogExtractors used to do) with the SURT prefix
+index, using synthetic watched targets and document URLs.
+"""
+
+
+def linear_scan(watched_surts, url):
+    for prefix in watched_surts:
+        if url_to_surt(url).startswith(prefix):
+            return prefix
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser('Benchmark watched-target lookups.')
+    parser.add_argument('--targets', type=int, default=5000, help="Number of synthetic watched targets.")
+    parser.add_argument('--urls', type=int, default=2000, help="Number of synthetic document URLs to look up.")
+    args = parser.parse_args(argv)
+
+    random.seed(42)
+    seeds = ["http://www.site%i.gov.uk/publications/%i/" % (i, i % 7) for i in range(args.targets)]
+    watched_surts = [url_to_surt(seed) for seed in seeds]
+    index = SurtPrefixIndex((surt, seed) for surt, seed in zip(watched_surts, seeds))
+
+    urls = []
+    for i in range(args.urls):
+        n = random.randrange(args.targets * 2)
+        urls.append("http://www.site%i.gov.uk/publications/%i/doc-%i.pdf" % (n, n % 7, i))
+
+    start = time.time()
+    linear = [linear_scan(watched_surts, url) for url in urls]
+    linear_time = time.time() - start
+
+    start = time.time()
+    indexed = []
+    for url in urls:
+        match = index.longest_match(url_to_surt(url))
+        indexed.append(match[0] if match else None)
+    index_time = time.time() - start
+
+    assert linear == indexed
+    print("%i URLs against %i watched targets (%i matched)" % (len(urls), len(seeds), len([m for m in indexed if m])))
+    print("linear scan: %.3fs" % linear_time)
+    print("prefix index: %.3fs" % index_time)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
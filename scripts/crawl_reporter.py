@@ -1,7 +1,7 @@
 import argparse
 import sys
 import datetime
-from tasks.ingest.log_analysis_hadoop import CrawlLogLine
+from tasks.analyse.crawl_logs.log_analysis_hadoop import parse_many
 
 
 def print_launch_stats(key, launch_stats):
@@ -26,8 +26,7 @@ def main(argv=None):
     launch_stats['-'] = { 'stats': {'count': 0 } }
     #
     with open(args.filename) as f:
-        for line in f.readlines():
-            c = CrawlLogLine(line)
+        for c in parse_many(f):
             key = c.host()
             is_new = False
             if c.hop_path == '-' or c.hop_path[-1:] == 'P':
@@ -6,16 +6,17 @@ import json
 import gzip
 import glob
 import shutil
-import pysolr
 import logging
 import datetime
 import luigi
 import luigi.contrib.hdfs
 import luigi.contrib.webhdfs
-from tasks.analyse.hdfs_analysis import UpdateWarcsDatabase
+from tasks.analyse.hdfs_analysis import UpdateWarcsDatabase, LoadCrawlFilesDatabase
 from tasks.common import state_file
 from lib.webhdfs import webhdfs
 from lib.targets import AccessTaskDBTarget, TaskTarget, TrackingDBStatusField
+from lib.crawl_files import CrawlFilesDB
+from lib.solr_cursor import SolrCursorQuery, write_query_results
 
 logger = logging.getLogger('luigi-interface')
 
@@ -38,20 +39,42 @@ class ListWarcsForDateRange(luigi.Task):
     kind = luigi.Parameter(default='warcs')
     # Max number of items to return.
     limit = luigi.IntParameter(default=1000)
+    # How many items to fetch from the Tracking DB at a time:
+    page_size = luigi.IntParameter(default=1000, significant=False)
     # Specify the Tracking DB to use to manage state:
     tracking_db_url = luigi.Parameter(default=TrackingDBStatusField.DEFAULT_TRACKDB)
     # Specify a fine-grained run date so we can get fresh results
     run_date = luigi.DateMinuteParameter(default=datetime.datetime.now())
+    # Optionally, look the WARCs up in the crawl_files table instead of the Tracking DB:
+    crawl_files_db = luigi.Parameter(default=None)
 
     task_namespace = 'access.list'
 
+    # Which crawl_files columns correspond to the Tracking DB status fields:
+    STATUS_COLUMNS = {
+        'cdx_index_ss': 'cdx_index_status',
+        'solr_index_ss': 'solr_index_status'
+    }
+
     def requires(self):
+        if self.crawl_files_db:
+            return LoadCrawlFilesDatabase(crawl_files_db=self.crawl_files_db, incremental=True)
         return UpdateWarcsDatabase(trackdb=self.tracking_db_url)
 
     def run(self):
+        if self.crawl_files_db:
+            db = CrawlFilesDB(self.crawl_files_db)
+            paths = db.files_needing_status(self.STATUS_COLUMNS[self.status_field], self.status_value,
+                                            self.start_date, self.end_date, stream=self.stream, kind=self.kind,
+                                            limit=self.limit)
+            db.close()
+            with self.output().open('w') as f:
+                for path in paths:
+                    f.write(path)
+                    f.write('\n')
+            return
 
         # Query
-        s = pysolr.Solr(url=self.tracking_db_url)
         q='kind_s:"%s" AND stream_s:"%s" AND timestamp_dt:[%sT00:00:00Z TO %sT23:59:59Z] AND -%s:"%s"' % (
             self.kind,
             self.stream,
@@ -61,17 +84,13 @@ class ListWarcsForDateRange(luigi.Task):
             self.status_value
         )
         logger.info("Query = %s" % q)
-        # Limit to no more than e.g. 1000 at once:
-        params = {
-            'rows': self.limit
-        }
-        result = s.search(q=q, **params)
-
-        # Write out:
-        with self.output().open('w') as f:
-            for doc in result.docs:
-                f.write(doc['file_path_s'])
-                f.write('\n')
+        # Page through the results in order, writing them out as we go, up to e.g. 1000 in total.
+        # N.B. if this fails part-way through, re-running with the same --run-date will resume from the last page:
+        query = SolrCursorQuery(self.tracking_db_url, q, sort='timestamp_dt asc', fl='id,file_path_s',
+                                rows=min(self.limit, self.page_size))
+        os.makedirs(os.path.dirname(self.output().path), exist_ok=True)
+        total = write_query_results(query, self.output().path, lambda doc: doc['file_path_s'], limit=self.limit)
+        logger.info("Listed %i WARCs." % total)
 
     def output(self):
         # Use the run_date as part of the output to make sure it's fresh.
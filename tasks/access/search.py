@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 import json
 import luigi
 import pysolr
@@ -7,9 +8,10 @@ import base64
 import hashlib
 import datetime
 import tldextract
-import xml.etree.ElementTree as etree
 #import ssdeep
-from lib.cdx import CdxIndex
+from lib.cdx import CdxIndex, FirstCaptureStore, get_first_capture_dates
+from lib.oai_pmh import write_title_export, stream_title_export
+from lib.solr_reindex import BlueGreenReindexer
 from tasks.crawl.w3act import TargetList, SubjectList, CollectionList
 from tasks.common import state_file
 from jinja2 import Environment, PackageLoader
@@ -118,6 +120,8 @@ class GenerateIndexAnnotations(luigi.Task):
 class GenerateW3ACTTitleExport(luigi.Task):
     task_namespace = 'discovery'
     date = luigi.DateParameter(default=datetime.date.today())
+    max_workers = luigi.IntParameter(default=10, significant=False)
+    in_memory = luigi.BoolParameter(default=False, significant=False)
 
     record_count = 0
     blocked_record_count = 0
@@ -137,6 +141,13 @@ class GenerateW3ACTTitleExport(luigi.Task):
         logger.warning('in output')
         return state_file(self.date,'access-data', 'title-level-metadata-w3act.xml')
 
+    @staticmethod
+    def first_capture_store():
+        # Shared between runs, as first capture dates do not change:
+        path = state_file(None, 'access-data', 'first-captures.sqlite').path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
     def run(self):
         # Get the data:
         targets = json.load(self.input()[0].open())
@@ -160,8 +171,26 @@ class GenerateW3ACTTitleExport(luigi.Task):
             if sub['publish']:
                 self.subject_published_count += 1
 
-        # Convert to records:
-        records = []
+        # Look up the first capture dates of any URLs not seen before:
+        urls = [t['urls'][0] for t in targets if t['crawl_frequency'] != 'NEVERCRAWL' and len(t.get('urls',[])) > 0]
+        store = FirstCaptureStore(self.first_capture_store())
+        first_captures = get_first_capture_dates(CdxIndex(max_connections=self.max_workers), urls, store,
+                                                 max_workers=self.max_workers)
+        store.close()
+
+        # Convert to records, and write them out as OAI-PMH XML:
+        records = self.records(targets, subjects_by_id, first_captures)
+        with self.output().temporary_path() as temp_output_path:
+            with open(temp_output_path, 'wb') as f:
+                if self.in_memory:
+                    write_title_export(list(records), f)
+                else:
+                    stream_title_export(records, f)
+
+    def records(self, targets, subjects_by_id, first_captures):
+        """
+        Yields the title-level record for each target that should be included, counting what is left out.
+        """
         for target in targets:
             # Skip blocked items:
             if target['crawl_frequency'] == 'NEVERCRAWL':
@@ -179,8 +208,8 @@ class GenerateW3ACTTitleExport(luigi.Task):
             # Extract the domain:
             parsed_url = tldextract.extract(url)
             publisher = parsed_url.registered_domain
-            # Lookup in CDX:
-            wayback_date_str = CdxIndex().get_first_capture_date(url) # Get date in '20130401120000' form.
+            # Get the first capture date, as looked up above:
+            wayback_date_str = first_captures[url] # Get date in '20130401120000' form.
             if wayback_date_str is None:
                 logger.warning("The URL '%s' is not yet available, inScopeForLegalDeposit = %s" % (url, target['isNPLD']))
                 self.missing_record_count += 1
@@ -218,55 +247,9 @@ class GenerateW3ACTTitleExport(luigi.Task):
                 sub0 = subjects_by_id.get(int(target['subject_ids'][0]), {})
                 rec['subject'] = sub0.get('name', None)
 
-            # And append record to the set:
-            records.append(rec)
+            # And pass the record on:
             self.record_count += 1
-
-        # declare output XML namespaces
-        OAINS = 'http://www.openarchives.org/OAI/2.0/'
-        OAIDCNS = 'http://www.openarchives.org/OAI/2.0/oai_dc/'
-        DCNS = 'http://purl.org/dc/elements/1.1/'
-        XLINKNS = 'http://www.w3.org/1999/xlink'
-        OAIDC_B = "{%s}" % OAIDCNS
-        DC_B = "{%s}" % DCNS
-        XLINK_B = "{%s}" % XLINKNS
-
-        # create OAI-PMH XML via lxml
-        oaiPmh = etree.Element('OAI-PMH', nsmap={None:OAINS, 'oai_dc':OAIDCNS, 'dc':DCNS, 'xlink':XLINKNS})
-        listRecords = etree.SubElement(oaiPmh, 'ListRecords')
-
-        for rec in records:
-            record = etree.SubElement(listRecords, 'record')
-
-            # header
-            header = etree.SubElement(record, 'header')
-            identifier = etree.SubElement(header, 'identifier')
-            identifier.text = rec['id']
-
-            # metadata
-            metadata = etree.SubElement(record, 'metadata')
-            dc = etree.SubElement(metadata, OAIDC_B+'dc')
-            source = etree.SubElement(dc, DC_B+'source' )
-            source.text = rec['url']
-            publisher = etree.SubElement(dc, DC_B+'publisher' )
-            publisher.text = rec['publisher']
-            title = etree.SubElement(dc, DC_B+'title' )
-            title.text = rec['title']
-            date = etree.SubElement(dc, DC_B+'date' )
-            date.text = rec['date']
-            rights = etree.SubElement(dc, DC_B+'rights' )
-            rights.text = rec['rights']
-            href = etree.SubElement(dc, XLINK_B+'href' )
-            href.text = rec['wayback_url']
-
-            if 'subject' in rec:
-                subject = etree.SubElement(dc, DC_B+'subject')
-                subject.text = rec['subject']
-
-        # output OAI-PMH XML
-        with self.output().open('w') as f:
-            f.write(etree.tostring(oaiPmh, xml_declaration=True, encoding='UTF-8', pretty_print=True))
-
+            yield rec
 
     def get_metrics(self, registry):
         # type: (CollectorRegistry) -> None
@@ -290,6 +273,8 @@ class UpdateCollectionsSolr(luigi.Task):
     task_namespace = 'discovery'
     date = luigi.DateMinuteParameter(default=datetime.datetime.now())
     solr_endpoint = luigi.Parameter(default='http://localhost:8983/solr/collections')
+    blue_green = luigi.BoolParameter(default=False)
+    batch_size = luigi.IntParameter(default=10000, significant=False)
 
     def requires(self):
         return [TargetList(self.date), CollectionList(self.date), SubjectList(self.date)]
@@ -298,20 +283,21 @@ class UpdateCollectionsSolr(luigi.Task):
         return state_file(self.date,'access-data', 'updated-collections-solr.json')
 
     @staticmethod
-    def add_collection(s, targets_by_id, col, parent_id):
+    def collection_docs(targets_by_id, col, parent_id):
+        """
+        Yields the Solr documents for a collection, its Targets, and its child collections.
+        """
         if col['publish']:
             print("Publishing...", col['name'])
 
             # add a document to the Solr index
-            s.add([
-                {
-                    "id": col["id"],
-                    "type": "collection",
-                    "name": col["name"],
-                    "description": col["description"],
-                    "parentId": parent_id
-                }
-            ], commit=False)
+            yield {
+                "id": col["id"],
+                "type": "collection",
+                "name": col["name"],
+                "description": col["description"],
+                "parentId": parent_id
+            }
 
             # Look up all Targets within this Collection and add them.
             for tid in col.get('target_ids',[]):
@@ -333,7 +319,7 @@ class UpdateCollectionsSolr(luigi.Task):
                         licenses = ['1000']
 
                 # add a document to the Solr index
-                s.add([{
+                yield {
                     "id": "cid:%i-tid:%i" % (col['id'], target['id']),
                     "type": "target",
                     "parentId": col['id'],
@@ -345,16 +331,15 @@ class UpdateCollectionsSolr(luigi.Task):
                     "startDate": target["crawl_start_date"],
                     "endDate": target["crawl_end_date"],
                     "licenses": licenses
-                }], commit=False)
+                }
 
             # Add child collections
             for cc in col["children"]:
-                UpdateCollectionsSolr.add_collection(s, targets_by_id, cc, col['id'])
+                for doc in UpdateCollectionsSolr.collection_docs(targets_by_id, cc, col['id']):
+                    yield doc
         else:
             print("Skipping...", col['name'])
 
-        return
-
     def run(self):
         targets = json.load(self.input()[0].open())
         collections = json.load(self.input()[1].open())
@@ -369,17 +354,29 @@ class UpdateCollectionsSolr(luigi.Task):
             target_count += 1
         logger.info("Found %i targets..." % target_count)
 
-        s = pysolr.Solr(self.solr_endpoint, timeout=30)
+        # Build the full set of documents (by ID, so any repeats replace earlier ones, as they would in Solr):
+        docs = {}
+        for col in collections:
+            for doc in UpdateCollectionsSolr.collection_docs(targets_by_id, col, None):
+                docs[doc['id']] = doc
+        logger.info("Built %i documents..." % len(docs))
+
+        if self.blue_green:
+            # Fill the collection that is not in use, and switch the alias over to it:
+            BlueGreenReindexer(self.solr_endpoint, batch_size=self.batch_size).reindex(docs.values())
+        else:
+            s = pysolr.Solr(self.solr_endpoint, timeout=30)
 
-        # First, we delete everything (!)
-        s.delete(q="*:*", commit=False)
+            # First, we delete everything (!)
+            s.delete(q="*:*", commit=False)
 
-        # Update the collections:
-        for col in collections:
-            UpdateCollectionsSolr.add_collection(s, targets_by_id, col, None)
+            # Update the collections, a batch at a time:
+            docs = list(docs.values())
+            for i in range(0, len(docs), self.batch_size):
+                s.add(docs[i:i + self.batch_size], commit=False)
 
-        # Now commit all changes:
-        s.commit()
+            # Now commit all changes:
+            s.commit()
 
         # Record that we have completed this task successfully:
         with self.output().open('w') as f:
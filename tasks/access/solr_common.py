@@ -7,6 +7,7 @@ import json
 import luigi.contrib.hdfs
 import luigi.contrib.hadoop_jar
 import luigi.contrib.ssh
+from lib.solr_cursor import SolrCursorQuery, write_query_results
 
 logger = logging.getLogger('luigi-interface')
 
@@ -46,6 +47,41 @@ def solrColName(stream, year):
 
 	return solr_col_name
 
+# ----------------------------------------------------------
+def sourceFileCounts(solr_api, warc_names):
+	# Counts the documents from each of the given WARCs in a Solr collection, using a single
+	# faceted query rather than one query per WARC. WARCs with no documents are left out.
+	# solr_api is the collection URL, ending with '/'
+	query_string = {
+		'q': '{!terms f=source_file}' + ','.join(warc_names),
+		'rows': 0,
+		'facet': 'true',
+		'facet.field': 'source_file',
+		'facet.limit': -1,
+		'facet.mincount': 1,
+		'wt': 'json'
+	}
+	# POST, as the list of WARCs can be long
+	r = requests.post(url=solr_api + 'select', data=query_string)
+	if r.status_code != 200:
+		raise Exception("Issue with data from solr collection {}: {}".format(solr_api, r.status_code))
+	# facet counts come back as a flat list of [value, count, value, count...]
+	facets = r.json()['facet_counts']['facet_fields']['source_file']
+	return dict(zip(facets[0::2], facets[1::2]))
+
+# ----------------------------------------------------------
+def bulkStatusUpdate(tracking_db_url, status_field, status_value, doc_ids, commit_within=60000):
+	# Adds the status value to all the given trackdb records in one atomic update, and lets
+	# Solr commit it within commit_within milliseconds, rather than committing straight away.
+	post_data = [{'id': doc_id, status_field: {'add': status_value}} for doc_id in doc_ids]
+	if not post_data:
+		return None
+	r = requests.post(url=tracking_db_url + '/update', params={'commitWithin': commit_within},
+		headers={'Content-Type': 'application/json'}, json=post_data)
+	if r.status_code != 200:
+		raise Exception("Issue with posting data to trackdb: {}".format(r.status_code))
+	return r.json()
+
 # ----------------------------------------------------------
 class TrackDBSolrQuery(luigi.Task):
 	tracking_db_url = luigi.Parameter()
@@ -55,6 +91,8 @@ class TrackDBSolrQuery(luigi.Task):
 	status_value = luigi.Parameter()
 	sort = luigi.Parameter(default='timestamp_dt desc')
 	limit = luigi.IntParameter(default=100)
+	# number of results to fetch from the tracking_db at a time
+	page_size = luigi.IntParameter(default=1000, significant=False)
 	output_file = luigi.Parameter()
 
 	task_namespace = "access.index"
@@ -64,30 +102,19 @@ class TrackDBSolrQuery(luigi.Task):
 
 	def run(self):
 		# set solr search terms
-		solr_query_url = self.tracking_db_url + '/query'
-		query_string = {
-			'q':"kind_s:{} AND stream_s:{} AND year_i:{} AND {}:{}".format(
-				self.kind, self.stream, self.year, self.status_field, self.status_value),
-			'rows':self.limit,
-			'sort':self.sort
-		}
-		# gain tracking_db search response
-		response = ''
+		q = "kind_s:{} AND stream_s:{} AND year_i:{} AND {}:{}".format(
+			self.kind, self.stream, self.year, self.status_field, self.status_value)
+		# page through the tracking_db search results, writing them out as they arrive.
+		# if this fails part-way through, re-running it resumes from the last page written.
+		query = SolrCursorQuery(self.tracking_db_url, q, sort=self.sort, fl='id,file_path_s',
+			rows=min(self.limit, self.page_size), handler='query')
 		try:
-			r = requests.post(url=solr_query_url, data=query_string)
-			response = r.json()['response']
+			total = write_query_results(query, self.output_file, lambda doc: doc['file_path_s'], limit=self.limit)
 		except Exception as e:
-			raise Exception("Issue with data returned from trackdb solr query")
-
-		# if warcs returned from search, write output
-		if response['numFound'] > 0:
-			with self.output().open('w') as res:
-				try:
-					for doc in response['docs']:
-						res.write(doc['file_path_s'] + '\n')
-				except Exception as e:
-					raise Exception("Issue with response['docs'] from trackdb solr query")
-		else:
+			raise Exception("Issue with data returned from trackdb solr query: {}".format(e))
+
+		if total == 0:
+			os.remove(self.output_file)
 			raise Exception("No warcs returned from tracking_db query")
 
 	def output(self):
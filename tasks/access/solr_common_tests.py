@@ -0,0 +1,45 @@
+import json
+from urllib.parse import urlparse, parse_qs
+from lib.testing import FakeHandler, fake_server
+import tasks.access.solr_common as solr_common
+
+# Documents per WARC in the fake collection:
+INDEXED = {'a.warc.gz': 10, 'b.warc.gz': 3}
+
+
+class FakeSolrHandler(FakeHandler):
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        self.server.requests.append((url.path, parse_qs(url.query), body))
+        if url.path.endswith('/select'):
+            params = parse_qs(body)
+            names = params['q'][0].split('}', 1)[1].split(',')
+            facets = []
+            for name in names:
+                if name in INDEXED:
+                    facets += [name, INDEXED[name]]
+            self.respond({'response': {'numFound': sum(INDEXED.get(n, 0) for n in names), 'docs': []},
+                          'facet_counts': {'facet_fields': {'source_file': facets}}})
+        else:
+            self.respond({'responseHeader': {'status': 0}})
+
+
+def test_batch_verification_calls():
+    with fake_server(FakeSolrHandler, requests=[]) as server:
+        base = server.base_url + "/solr"
+        counts = solr_common.sourceFileCounts(base + '/NPLD-FC2019/', ['a.warc.gz', 'b.warc.gz', 'c.warc.gz'])
+        assert counts == {'a.warc.gz': 10, 'b.warc.gz': 3}
+
+        ids = ['hdfs://hdfs:54310/heritrix/%s' % name for name in counts]
+        solr_common.bulkStatusUpdate(base + '/tracking', 'solr_index_ss', 'NPLD-FC2019', ids)
+        path, params, body = server.requests[-1]
+        assert path == '/solr/tracking/update'
+        assert params == {'commitWithin': ['60000']}
+        assert json.loads(body) == [{'id': i, 'solr_index_ss': {'add': 'NPLD-FC2019'}} for i in ids]
+        assert len(server.requests) == 2
+
+        # Nothing to update, so nothing sent:
+        assert solr_common.bulkStatusUpdate(base + '/tracking', 'solr_index_ss', 'NPLD-FC2019', []) is None
+        assert len(server.requests) == 2
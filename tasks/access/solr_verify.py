@@ -28,6 +28,9 @@ class SolrVerifyWarcs(luigi.Task):
 	hdfs_processing_dir = luigi.Parameter()
 	solr_api = luigi.Parameter()
 	limit = luigi.IntParameter()
+	# verify WARCs in chunks, with one facet query per chunk and one trackdb update at the end
+	batch = luigi.BoolParameter(default=False)
+	chunk_size = luigi.IntParameter(default=500)
 
 	# task_namespace defines scope of class. Without defining this, other classes
 	# could call this class inside their scope, which would be wrong.
@@ -62,6 +65,10 @@ class SolrVerifyWarcs(luigi.Task):
 	# Ensure WARCs now in Solr.
 	# Flag WARCs as in Solr.
 	def run(self):
+		if self.batch:
+			self.run_batch()
+			return
+
 		# Set var for all results, to be included in final output if successful
 		sv_results = list()
 		warcs_count = warcs_found_count = warcs_missing_count = 0
@@ -118,6 +125,43 @@ class SolrVerifyWarcs(luigi.Task):
 				warcs_count, warcs_found_count, warcs_missing_count))
 			success.write("Fin\n")
 
+	# Verify chunks of WARCs at once, using facet counts of source_file.
+	# Flag all the WARCs found in Solr in a single trackdb update.
+	def run_batch(self):
+		sv_results = list()
+		found = list()
+		warcs_count = warcs_found_count = warcs_missing_count = 0
+
+		with self.input().open('r') as sv_input:
+			warcs = [warc.rstrip('\n') for warc in sv_input if warc.strip()]
+
+		for i in range(0, len(warcs), self.chunk_size):
+			chunk = warcs[i:i + self.chunk_size]
+			counts = solr_common.sourceFileCounts(self.solr_api, [os.path.basename(warc) for warc in chunk])
+			for warc in chunk:
+				warcs_count += 1
+				base_warc = os.path.basename(warc)
+				sv_results.append("Verifying warc {}: ".format(base_warc))
+				if counts.get(base_warc, 0) > 0:
+					warcs_found_count += 1
+					sv_results.append("\n{} records found\n".format(counts[base_warc]))
+					found.append('hdfs://hdfs:54310' + warc)
+				else:
+					warcs_missing_count += 1
+					sv_results.append("NOT found in solr\n")
+
+		# Update trackdb records for all the warcs found
+		response = solr_common.bulkStatusUpdate(self.tracking_db_url, self.status_field, self.solr_col_name, found)
+		sv_results.append("trackdb post response {}\n".format(response))
+
+		# write final luigi task output file indicating success
+		with open(self.output().path, 'w') as success:
+			for line in sv_results:
+				success.write("{}".format(line))
+			success.write("{} warcs checked, {} in solr, {} not in solr.\n".format(
+				warcs_count, warcs_found_count, warcs_missing_count))
+			success.write("Fin\n")
+
 	def output(self):
 		return luigi.LocalTarget("{}solr_verify-{}-success".format(self.tmpdir, self.solr_col_name))
 
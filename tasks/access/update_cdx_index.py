@@ -4,12 +4,9 @@ import json
 import shutil
 import logging
 import datetime
-import xml.dom.minidom
-from xml.parsers.expat import ExpatError
 import random
 import warcio
-from urllib.request import urlopen
-from urllib.parse import quote_plus, urlparse
+from urllib.parse import urlparse
 import luigi
 import luigi.contrib.hdfs
 import luigi.contrib.hadoop_jar
@@ -17,6 +14,8 @@ from tasks.access.hdfs_list_warcs import ListWarcsForDateRange
 from tasks.common import state_file, CopyToTableInDB
 from lib.webhdfs import WebHdfsPlainFormat, webhdfs
 from lib.targets import AccessTaskDBTarget, TrackingDBStatusField
+from lib.cdx import CdxIndex, CaptureVerifier
+from lib.crawl_files import CrawlFilesDB
 from prometheus_client import CollectorRegistry, Gauge
 
 logger = logging.getLogger('luigi-interface')
@@ -120,6 +119,7 @@ class CheckCdxIndexForWARC(luigi.Task):
     cdx_service = luigi.Parameter()
     sampling_rate = luigi.IntParameter(default=500)
     max_records_to_check = luigi.IntParameter(default=10)
+    max_parallel_lookups = luigi.IntParameter(default=10)
     task_namespace = "access.index"
 
     count = 0
@@ -132,43 +132,17 @@ class CheckCdxIndexForWARC(luigi.Task):
         logger.info("Opening " + hdfs_file.path)
         #fin = hdfs_file.open('r')
         client = webhdfs()
+        verifier = CaptureVerifier(CdxIndex(self.cdx_service, max_connections=self.max_parallel_lookups),
+                                   max_workers=self.max_parallel_lookups)
         with client.read(hdfs_file.path) as fin:
-            reader = warcio.ArchiveIterator(TellingReader(fin))
-            for record in reader:
-                #logger.warning("Got record format and headers: %s %s %s" % (
-                #record.format, record.rec_headers, record.http_headers))
-                # content = record.content_stream().read()
-                # logger.warning("Record content: %s" % content[:128])
-                # logger.warning("Record content as hex: %s" % binascii.hexlify(content[:128]))
-                #logger.warning("Got record offset + length: %i %i" % (reader.get_record_offset(), reader.get_record_length() ))
-                self.records += 1
-
-                # Only look at valid response records:
-                if record.rec_type == 'response' and 'application/http' in record.content_type:
-                    record_url = record.rec_headers.get_header('WARC-Target-URI')
-                    # Skip ridiculously long URIs
-                    if len(record_url) > 2000:
-                        logger.warning("Skipping very long URL: %s" % record_url)
-                        continue
-                    # Timestamp, stripped down to Wayback form:
-                    timestamp = record.rec_headers.get_header('WARC-Date')
-                    timestamp = re.sub('[^0-9]', '', timestamp)
-                    #logger.info("Found a record: %s @ %s" % (record_url, timestamp))
-                    # Check a random subset of the records, always emitting the first record:
-                    if self.count == 0 or random.randint(1, self.sampling_rate) == 1:
-                        logger.info("Checking a record: %s @ %s" % (record_url, timestamp))
-                        capture_dates = self.get_capture_dates(record_url)
-                        if timestamp in capture_dates:
-                            self.hits += 1
-                        else:
-                            logger.warning("Record not found in index: %s @ %s" % (record_url, timestamp))
-                        # Keep track of checked records:
-                        self.tries += 1
-                        # If we've tried enough records, exit:
-                        if self.tries >= self.max_records_to_check:
-                            break
-                    # Keep track of total records:
-                    self.count += 1
+            # Look up the sampled records in parallel, as the WARC is read, stopping once enough have been checked:
+            for record_url, timestamp, found in verifier.verify(self.sampled_records(fin), self.max_records_to_check):
+                if found:
+                    self.hits += 1
+                else:
+                    logger.warning("Record not found in index: %s @ %s" % (record_url, timestamp))
+                # Keep track of checked records:
+                self.tries += 1
 
             # Ensure the input stream is closed (despite not reading all the data):
             #reader.read_to_end()
@@ -184,39 +158,37 @@ class CheckCdxIndexForWARC(luigi.Task):
         else:
             raise Exception("For %s, only %i of %i records checked are in the CDX index!"%(self.input_file, self.hits, self.tries))
 
-    def get_capture_dates(self, url):
-        # Get the hits for this URL:
-        capture_dates = []
-        # Paging, as we have a LOT of copies of some URLs:
-        batch = 25000
-        offset = 0
-        next_batch = True
-        while next_batch:
-            try:
-                # Get a batch:
-                q = "type:urlquery url:" + quote_plus(url) + (" limit:%i offset:%i" % (batch, offset))
-                cdx_query_url = "%s?q=%s" % (self.cdx_service, quote_plus(q))
-                logger.info("Getting %s" % cdx_query_url)
-                f = urlopen(cdx_query_url)
-                content = f.read()
-                f.close()
-                # Grab the capture dates:
-                dom = xml.dom.minidom.parseString(content)
-                new_records = 0
-                for de in dom.getElementsByTagName('capturedate'):
-                    capture_dates.append(de.firstChild.nodeValue)
-                    new_records += 1
-                # Done?
-                if new_records == 0:
-                    next_batch = False
-                else:
-                    # Next batch:
-                    offset += batch
-            except ExpatError as e:
-                logger.warning("Exception on lookup: "  + str(e))
-                next_batch = False
-
-        return capture_dates
+    def sampled_records(self, fin):
+        """
+        Reads through the WARC, yielding a random sample of the (url, timestamp) pairs to check.
+        """
+        reader = warcio.ArchiveIterator(TellingReader(fin))
+        for record in reader:
+            #logger.warning("Got record format and headers: %s %s %s" % (
+            #record.format, record.rec_headers, record.http_headers))
+            # content = record.content_stream().read()
+            # logger.warning("Record content: %s" % content[:128])
+            # logger.warning("Record content as hex: %s" % binascii.hexlify(content[:128]))
+            #logger.warning("Got record offset + length: %i %i" % (reader.get_record_offset(), reader.get_record_length() ))
+            self.records += 1
+
+            # Only look at valid response records:
+            if record.rec_type == 'response' and 'application/http' in record.content_type:
+                record_url = record.rec_headers.get_header('WARC-Target-URI')
+                # Skip ridiculously long URIs
+                if len(record_url) > 2000:
+                    logger.warning("Skipping very long URL: %s" % record_url)
+                    continue
+                # Timestamp, stripped down to Wayback form:
+                timestamp = record.rec_headers.get_header('WARC-Date')
+                timestamp = re.sub('[^0-9]', '', timestamp)
+                #logger.info("Found a record: %s @ %s" % (record_url, timestamp))
+                # Check a random subset of the records, always emitting the first record:
+                if self.count == 0 or random.randint(1, self.sampling_rate) == 1:
+                    logger.info("Checking a record: %s @ %s" % (record_url, timestamp))
+                    yield record_url, timestamp
+                # Keep track of total records:
+                self.count += 1
 
     def get_metrics(self, registry):
         # type: (CollectorRegistry) -> None
@@ -245,11 +217,16 @@ class CheckCdxIndex(luigi.WrapperTask):
 
     def requires(self):
         # For each input file, open it up and get some URLs and timestamps.
+        tasks = []
         with open(str(self.input_file)) as f_in:
             for item in f_in.readlines():
                 #logger.info("Found %s" % item)
-                yield CheckCdxIndexForWARC(input_file=item.strip(), cdx_service=self.cdx_service)
-                self.checked_total += 1
+                tasks.append(CheckCdxIndexForWARC(input_file=item.strip(), cdx_service=self.cdx_service))
+        # Look up whether they are done in bulk, rather than one at a time:
+        TrackingDBStatusField.prefetch([task.output() for task in tasks])
+        for task in tasks:
+            yield task
+            self.checked_total += 1
 
     def run(self):
         # If all the requirements are there, the whole set must be fine.
@@ -279,6 +256,8 @@ class CdxIndexAndVerify(luigi.Task):
                                       os.environ.get('TRACKING_DB_SOLR_URL', 'http://localhost:8983/solr/tracking'))
     # Specify a fine-grained run date so we can get fresh results
     run_date = luigi.DateMinuteParameter(default=datetime.datetime.now())
+    # Optionally, use the crawl_files table rather than the Tracking DB to find WARCs to index:
+    crawl_files_db = luigi.Parameter(default=None)
 
     task_namespace = "access.index"
 
@@ -293,7 +272,8 @@ class CdxIndexAndVerify(luigi.Task):
             status_field='cdx_index_ss', # Field used to indicate indexing status
             status_value=cdx_index_name,
             limit=1000,
-            tracking_db_url=self.tracking_db_url
+            tracking_db_url=self.tracking_db_url,
+            crawl_files_db=self.crawl_files_db
         )
 
     def run(self):
@@ -316,6 +296,13 @@ class CdxIndexAndVerify(luigi.Task):
 
             # If it worked, record it here:
             if verify_task.complete():
+                # Mark them all as indexed at once:
+                if self.crawl_files_db:
+                    with open(self.input().path) as f_in:
+                        paths = [line.strip() for line in f_in if line.strip()]
+                    db = CrawlFilesDB(self.crawl_files_db)
+                    db.set_status('cdx_index_status', paths, urlparse(self.cdx_service).path[1:])
+                    db.close()
                 # Sometimes tasks get re-run...
                 if not self.output().exists():
                     self.output().touch()
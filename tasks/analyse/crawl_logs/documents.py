@@ -10,9 +10,11 @@ import luigi.contrib.hdfs
 import luigi.contrib.hadoop
 
 from w3act.w3act import w3act
-from lib.docharvester.document_mdex import DocumentMDEx
+from lib.docharvester.document_mdex import DocumentMDEx, watched_target_index
 from tasks.crawl.w3act import CrawlFeed, ENV_ACT_PASSWORD, ENV_ACT_URL, ENV_ACT_USER
 from lib.targets import TaskTarget
+from lib.w3act_export import load_json
+from lib.cdx import find_captures
 
 logger = logging.getLogger(__name__)
 
@@ -127,6 +129,20 @@ class AvailableInWayback(luigi.ExternalTask):
             return False
 
 
+def available_in_wayback(docs, cdx, store=None):
+    """
+    Checks a batch of documents the same way as AvailableInWayback (without check_available), but using a few prefix
+    queries rather than one query per document.
+
+    :param cdx: a CdxIndex for the CDX server
+    :param store: optional KnownCaptureStore, so captures only need to be found once
+    :return: set of the URLs of the documents that are in the index, with the expected timestamp
+    """
+    captures = [(doc['document_url'], doc['wayback_timestamp']) for doc in docs]
+    found = find_captures(cdx, captures, store)
+    return set(url for url, ts in captures if (url, ts) in found)
+
+
 class ExtractDocumentAndPost(luigi.Task):
     """
     Hook into w3act, extract MD and resolve the associated target.
@@ -166,8 +182,10 @@ class ExtractDocumentAndPost(luigi.Task):
         w = w3act(self.w3act, act_user, act_password)
 
         # Lookup Target and extract any additional metadata:
-        targets = json.load(self.input()['targets'].open('r'))
-        doc = DocumentMDEx(targets, self.doc.get_wrapped().copy(), self.source).mdex()
+        # (only parsed once per process, as every document needs it)
+        targets = load_json(self.input()['targets'].path)
+        doc = DocumentMDEx(targets, self.doc.get_wrapped().copy(), self.source,
+                           target_index=watched_target_index(targets)).mdex()
 
         # Documents may be rejected at this point:
         if 'match_failed' in doc:
@@ -1,17 +1,22 @@
 import os
 import time
 import json
-import hashlib
 import luigi.contrib.hdfs
 import luigi.contrib.hadoop
 from luigi.contrib.hdfs.format import Plain, PlainDir
 
 from tasks.analyse.crawl_logs.log_analysis_hadoop import AnalyseLogFile, SummariseLogFiles
-from tasks.analyse.crawl_logs.documents import ExtractDocumentAndPost
+from w3act.w3act import w3act
+from tasks.analyse.crawl_logs.documents import ExtractDocumentAndPost, available_in_wayback, ENV_CDXSERVER_ENDPOINT
+from tasks.crawl.w3act import ENV_ACT_PASSWORD, ENV_ACT_URL, ENV_ACT_USER
 from tasks.crawl.w3act import CrawlFeed
 from tasks.common import state_file, logger
 from lib.webhdfs import webhdfs
 from lib.targets import TaskTarget
+from lib.hashing import hash_all
+from lib.cdx import CdxIndex, KnownCaptureStore
+from lib.docharvester.harvester import DocumentHarvester, PostedDocuments, read_documents, STAGES, OUTCOMES
+from prometheus_client import CollectorRegistry, Gauge
 
 
 class LogFilesForJobLaunch(luigi.ExternalTask):
@@ -58,18 +63,16 @@ class SyncToHdfs(luigi.Task):
     overwrite = luigi.BoolParameter(default=False)
 
     def complete(self):
-        # Read local:
-        local = luigi.LocalTarget(path=self.source_path)
-        with local.open('r') as reader:
-            local_hash = hashlib.sha512(reader.read().encode('utf-8')).hexdigest()
-            logger.info("LOCAL HASH: %s" % local_hash)
-        # Read from HDFS
         client = luigi.contrib.hdfs.WebHdfsClient()
         if not client.exists(self.target_path):
             return False
-        with client.client.read(self.target_path) as reader:
-            hdfs_hash = hashlib.sha512(reader.read()).hexdigest()
-            logger.info("HDFS HASH: %s" % hdfs_hash)
+        # Hash the local and HDFS copies at the same time, a chunk at a time:
+        local_hash, hdfs_hash = hash_all([
+            lambda: open(self.source_path, 'rb'),
+            lambda: client.client.read(self.target_path)
+        ])
+        logger.info("LOCAL HASH: %s" % local_hash)
+        logger.info("HDFS HASH: %s" % hdfs_hash)
 
         # If they match, we are good:
         return hdfs_hash == local_hash
@@ -106,18 +109,30 @@ class AnalyseAndProcessDocuments(luigi.Task):
     log_paths = luigi.ListParameter()
     targets_path = luigi.Parameter()
     from_hdfs = luigi.BoolParameter(default=False)
+    batch = luigi.BoolParameter(default=False)
+    max_workers = luigi.IntParameter(default=8, significant=False)
+    max_per_host = luigi.IntParameter(default=2, significant=False)
+    max_tries = luigi.IntParameter(default=4, significant=False)
 
     # Size of bunches of jobs to yield
     bunch_size = 10000
 
+    # Results of the batch mode:
+    harvest_stats = None
+
     def requires(self):
-        # Analyse the log file on HDFS, using only one reducer:
-        return AnalyseLogFile(self.job, self.launch_id, self.log_paths, self.targets_path, self.from_hdfs, 1)
+        # Analyse the log file on HDFS, sharing the same job (and number of reducers) as the crawl log reports, so the
+        # logs are only read once. The documents do not need to be in crawl order, so one reducer is not needed:
+        return AnalyseLogFile(self.job, self.launch_id, self.log_paths, self.targets_path, self.from_hdfs)
 
     def output(self):
         return TaskTarget('documents', 'posted-{}-{}-{}.jsonl'.format(self.job, self.launch_id, len(self.log_paths)))
 
     def run(self):
+        if self.batch:
+            self.run_batch()
+            return
+
         # Loop over documents discovered, and attempt to post to W3ACT:
         with self.output().open('w') as out_file:
             with self.input().open() as in_file:
@@ -142,6 +157,78 @@ class AnalyseAndProcessDocuments(luigi.Task):
                 if len(tasks) > 0:
                     yield tasks
 
+    def run_batch(self):
+        """
+        Processes all the documents here, on a pool of threads, rather than as a task per document.
+
+        Documents that are already posted are skipped. If any are unavailable or fail, the task fails without writing
+        its output, so it is run again later, as it would be if an ExtractDocumentAndPost task had failed.
+        """
+        if self.from_hdfs:
+            targets_file = luigi.contrib.hdfs.HdfsTarget(path=self.targets_path, format=Plain)
+        else:
+            targets_file = luigi.LocalTarget(path=self.targets_path)
+        with targets_file.open() as f:
+            targets = json.load(f)
+
+        # Log into W3ACT once, for all the documents:
+        w = w3act(os.environ[ENV_ACT_URL], os.environ[ENV_ACT_USER], os.environ[ENV_ACT_PASSWORD])
+
+        posted_path = state_file(None, 'documents', 'posted-documents.sqlite').path
+        os.makedirs(os.path.dirname(posted_path), exist_ok=True)
+        posted = PostedDocuments(posted_path)
+
+        # Check the documents are in Wayback in batches, remembering the ones that are. OutbackCDX's own API is used, as
+        # unlike the XML API it can limit each prefix query to the time range of the documents:
+        cdx = CdxIndex(os.environ[ENV_CDXSERVER_ENDPOINT], output='json')
+        known = KnownCaptureStore(state_file(None, 'documents', 'known-captures.sqlite').path)
+
+        harvester = DocumentHarvester(
+            targets, w.post_document, posted,
+            check_available=lambda docs: available_in_wayback(docs, cdx, known),
+            max_workers=self.max_workers, max_per_host=self.max_per_host, max_tries=self.max_tries)
+
+        with self.output().open('w') as out_file:
+            try:
+                with self.input().open() as in_file:
+                    def _docs():
+                        for doc in read_documents(in_file):
+                            out_file.write("%s\n" % json.dumps(doc))
+                            yield doc
+
+                    for doc, status in harvester.process(_docs()):
+                        logger.debug("%s %s" % (status, doc['document_url']))
+            finally:
+                posted.close()
+                known.close()
+                cdx.close()
+
+            self.harvest_stats = harvester.stats()
+            logger.info("Document harvesting stats: %s" % self.harvest_stats)
+
+            # Fail before the output is written, so this task is run again and the rest get tried next time:
+            unfinished = self.harvest_stats.get('UNAVAILABLE', 0) + self.harvest_stats.get('FAILED', 0)
+            if unfinished > 0:
+                raise Exception("%i documents are unavailable or could not be processed, and need trying again." %
+                                unfinished)
+
+    def get_metrics(self, registry):
+        # type: (CollectorRegistry) -> None
+        if self.harvest_stats is None:
+            return
+
+        g = Gauge('ukwa_documents_harvested',
+                  'Number of documents processed, by outcome.',
+                  labelnames=['outcome'], registry=registry)
+        for outcome in ['seen', 'skipped', 'retried'] + OUTCOMES:
+            g.labels(outcome=outcome).set(self.harvest_stats.get(outcome, 0))
+
+        g = Gauge('ukwa_documents_harvest_stage_seconds',
+                  'Total time spent in each stage of processing documents.',
+                  labelnames=['stage'], registry=registry)
+        for stage in STAGES:
+            g.labels(stage=stage).set(self.harvest_stats['%s_seconds' % stage])
+
 
 class GenerateCrawlLogReports(luigi.Task):
     """
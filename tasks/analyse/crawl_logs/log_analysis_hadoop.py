@@ -1,6 +1,7 @@
 import re
 import os
 import json
+import hashlib
 import logging
 import datetime
 from urllib.parse import urlparse
@@ -8,7 +9,7 @@ import luigi
 import luigi.contrib.hdfs
 import luigi.contrib.hadoop
 from luigi.contrib.hdfs.format import Plain, PlainDir
-from lib.surt import url_to_surt
+from lib.surt import url_to_surt, SurtPrefixIndex
 
 import lib, dateutil, six # Imported so extra_modules MR-bundle can access them
 #import surt, tldextract, idna, requests, urllib3, certifi, chardet, requests_file, six # Unfortunately the surt module has a LOT of dependencies.
@@ -17,31 +18,148 @@ import lib, dateutil, six # Imported so extra_modules MR-bundle can access them
 logger = logging.getLogger(__name__)
 
 
+# Compiled once and shared, rather than per line:
+RE_FIELDS = re.compile(r' +')
+RE_IP = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+RE_TRIES = re.compile(r'^\d+t$')
+RE_DOL = re.compile(r'^dol:\d+') # Discarded out-links - make a total?
+
+CRAWL_LOG_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class CrawlLogParser(object):
+    """
+    Holds the state shared between parsed log lines, i.e. caches of decoded hosts and dates.
+
+    Hosts are cached by URL authority (network location), and dates by the timestamp to the second, as both repeat
+    heavily within a crawl log. The caches are simply dropped when they get too big.
+    """
+
+    def __init__(self, cache_size=10000):
+        self.cache_size = cache_size
+        self._hosts = {}
+        self._dates = {}
+
+    def parse(self, line):
+        return CrawlLogLine(line, self)
+
+    def parse_many(self, lines):
+        """
+        Parse an iterable of log lines, sharing the caches between them.
+
+        :param lines: iterable of log lines
+        :return: generator of CrawlLogLine
+        """
+        for line in lines:
+            yield CrawlLogLine(line, self)
+
+    def host_for(self, url):
+        if url.startswith("dns:"):
+            return url[4:]
+        # Only take the fast path for the usual schemes, leave anything else to urlparse:
+        if url.startswith("http://"):
+            start = 7
+        elif url.startswith("https://"):
+            start = 8
+        else:
+            return urlparse(url).hostname
+        end = len(url)
+        for sep in '/?#':
+            pos = url.find(sep, start, end)
+            if pos != -1:
+                end = pos
+        netloc = url[start:end]
+        host = self._hosts.get(netloc, False)
+        if host is False:
+            if len(self._hosts) >= self.cache_size:
+                self._hosts.clear()
+            host = urlparse(url).hostname
+            self._hosts[netloc] = host
+        return host
+
+    def date_for(self, timestamp):
+        # Split off the fractional seconds, and only decode the rest when it changes:
+        seconds, dot, fraction = timestamp.partition('.')
+        if not dot or not fraction.endswith('Z') or not fraction[:-1].isdigit() or len(fraction) > 7:
+            return datetime.datetime.strptime(timestamp, CRAWL_LOG_DATE_FORMAT)
+        date = self._dates.get(seconds, None)
+        if date is None:
+            if len(self._dates) >= self.cache_size:
+                self._dates.clear()
+            date = datetime.datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S")
+            self._dates[seconds] = date
+        # Same as strptime's %f, i.e. right-padded to microseconds:
+        return date.replace(microsecond=int(fraction[:-1].ljust(6, '0')))
+
+
+# Used when lines are parsed one at a time, e.g. by the Hadoop mappers:
+DEFAULT_PARSER = CrawlLogParser()
+
+
+def parse_many(lines):
+    """
+    Parse an iterable of log lines, sharing the host and date caches between them.
+    """
+    return CrawlLogParser().parse_many(lines)
+
+
 class CrawlLogLine(object):
     """
     Parsers Heritrix3 format log files, including annotations and any additional extra JSON at the end of the line.
+
+    Only the fields are split out up front. The annotations, extra JSON, host and date are decoded when first used.
     """
-    def __init__(self, line):
+    __slots__ = ('timestamp', 'status_code', 'content_length', 'url', 'hop_path', 'via', 'mime', 'thread',
+                 'start_time_plus_duration', 'hash', 'source', '_tail', '_annotation_string', '_extra_json',
+                 '_annotations', '_host', '_parser')
+
+    # Kept for compatibility, but now shared by all instances:
+    re_ip = RE_IP
+    re_tries = RE_TRIES
+    re_dol = RE_DOL
+
+    def __init__(self, line, parser=None):
         """
         Parse from a standard log-line.
         :param line:
+        :param parser: CrawlLogParser to share caches with (defaults to a module-wide one)
         """
         (self.timestamp, self.status_code, self.content_length, self.url, self.hop_path, self.via,
             self.mime, self.thread, self.start_time_plus_duration, self.hash, self.source,
-            self.annotation_string) = re.split(" +", line.strip(), maxsplit=11)
+            self._tail) = RE_FIELDS.split(line.strip(), maxsplit=11)
+        self._annotation_string = None
+        self._extra_json = None
+        self._annotations = None
+        self._host = False
+        self._parser = parser or DEFAULT_PARSER
+
+    def _split_tail(self):
         # Account for any JSON 'extra info' ending, strip or split:
-        if self.annotation_string.endswith(' {}'):
-            self.annotation_string = self.annotation_string[:-3]
-        elif ' {"' in self.annotation_string and self.annotation_string.endswith('}'):
-            self.annotation_string, self.extra_json = re.split(re.escape(' {"'), self.annotation_string, maxsplit=1)
-            self.extra_json = '{"%s' % self.extra_json
-        # And split out the annotations:
-        self.annotations = self.annotation_string.split(',')
-
-        # Some regexes:
-        self.re_ip = re.compile('^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
-        self.re_tries = re.compile('^\d+t$')
-        self.re_dol = re.compile('^dol:\d+') # Discarded out-links - make a total?
+        annotation_string = self._tail
+        if annotation_string.endswith(' {}'):
+            annotation_string = annotation_string[:-3]
+        elif ' {"' in annotation_string and annotation_string.endswith('}'):
+            annotation_string, extra_json = annotation_string.split(' {"', 1)
+            self._extra_json = '{"%s' % extra_json
+        self._annotation_string = annotation_string
+
+    @property
+    def annotation_string(self):
+        if self._annotation_string is None:
+            self._split_tail()
+        return self._annotation_string
+
+    @property
+    def extra_json(self):
+        if self._annotation_string is None:
+            self._split_tail()
+        return self._extra_json
+
+    @property
+    def annotations(self):
+        if self._annotations is None:
+            self._annotations = self.annotation_string.split(',')
+        return self._annotations
 
     def stats(self):
         """
@@ -59,18 +177,19 @@ class CrawlLogLine(object):
         }
         # Add in annotations:
         for annot in self.annotations:
-            # Set a prefix based on what it is:
-            prefix = ''
-            if self.re_tries.match(annot):
-                prefix = 'tries:'
-            elif self.re_ip.match(annot):
-                prefix = "ip:"
             # Skip high-cardinality annotations:
             if annot.startswith('launchTimestamp:'):
                 continue
             # Only emit lines with annotations:
-            if annot != "-":
-                stats["%s%s" % (prefix, annot)] = ""
+            if annot == "-":
+                continue
+            # Set a prefix based on what it is:
+            prefix = ''
+            if RE_TRIES.match(annot):
+                prefix = 'tries:'
+            elif RE_IP.match(annot):
+                prefix = "ip:"
+            stats["%s%s" % (prefix, annot)] = ""
         return stats
 
     def host(self):
@@ -79,10 +198,9 @@ class CrawlLogLine(object):
 
         :return:
         """
-        if self.url.startswith("dns:"):
-            return self.url[4:]
-        else:
-            return urlparse(self.url).hostname
+        if self._host is False:
+            self._host = self._parser.host_for(self.url)
+        return self._host
 
     def hour(self):
         """
@@ -104,7 +222,7 @@ class CrawlLogLine(object):
         return self.parse_date(self.timestamp)
 
     def parse_date(self, timestamp):
-        return datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
+        return self._parser.date_for(timestamp)
 
 
 class CrawlLogExtractors(object):
@@ -139,15 +257,28 @@ class CrawlLogExtractors(object):
                 if t['watched']:
                     watched.add(seed)
 
-        # Convert to SURT form:
+        # Convert to SURT form, and index them so each URL is only looked up once:
         watched_surts = []
+        watched_index = SurtPrefixIndex()
         for url in watched:
-            watched_surts.append(url_to_surt(url))
+            surt = url_to_surt(url)
+            watched_surts.append(surt)
+            watched_index.add(surt, target_map[url])
         logger.warning("WATCHED SURTS %s" % watched_surts)
 
         self.watched_surts = watched_surts
+        self.watched_index = watched_index
         self.target_map = target_map
 
+    def find_watched_target(self, url):
+        """
+        Finds the longest watched SURT prefix that covers the given URL.
+
+        :param url:
+        :return: (watched SURT prefix, target ID) or None
+        """
+        return self.watched_index.longest_match(url_to_surt(url))
+
     def analyse_log_file(self, log_file):
         """
         To run a series of analyses on a log file and emit results suitable for reduction.
@@ -155,8 +286,7 @@ class CrawlLogExtractors(object):
         :return:
         """
         with log_file.open() as f:
-            for line in f:
-                log = CrawlLogLine(line)
+            for log in parse_many(f):
                 yield self.extract_documents(log)
 
     def target_id(self, log):
@@ -173,27 +303,24 @@ class CrawlLogExtractors(object):
         if log.status_code == '-' or log.status_code == '' or int(int(log.status_code) / 100) != 2:
             return
         # Check the URL and Content-Type:
-        if "application/pdf" in log.mime:
-            for prefix in self.watched_surts:
-                document_surt = url_to_surt(log.url)
-                landing_page_surt = url_to_surt(log.via)
-                #logger.warning("Looking for prefix '%s' in '%s' and '%s'" % (prefix,document_surt, landing_page_surt))
-                # Are both URIs under the same watched SURT:
-                if document_surt.startswith(prefix) or landing_page_surt.startswith(prefix):
-                    # Proceed to extract metadata and pass on to W3ACT:
-                    doc = {
-                        'wayback_timestamp': log.start_time_plus_duration[:14],
-                        'landing_page_url': log.via,
-                        'document_url': log.url,
-                        'filename': os.path.basename(urlparse(log.url).path),
-                        'size': int(log.content_length),
-                        # Add some more metadata to the output so we can work out where this came from later:
-                        'job_name': self.job,
-                        'launch_id': self.launch_id,
-                        'source': log.source
-                    }
-                    #logger.info("Found document: %s" % doc)
-                    return json.dumps(doc)
+        if "application/pdf" in log.mime and len(self.watched_index) > 0:
+            # Is either URI under a watched SURT:
+            match = self.find_watched_target(log.url) or self.find_watched_target(log.via)
+            if match:
+                # Proceed to extract metadata and pass on to W3ACT:
+                doc = {
+                    'wayback_timestamp': log.start_time_plus_duration[:14],
+                    'landing_page_url': log.via,
+                    'document_url': log.url,
+                    'filename': os.path.basename(urlparse(log.url).path),
+                    'size': int(log.content_length),
+                    # Add some more metadata to the output so we can work out where this came from later:
+                    'job_name': self.job,
+                    'launch_id': self.launch_id,
+                    'source': log.source
+                }
+                #logger.info("Found document: %s" % doc)
+                return json.dumps(doc)
 
         return None
 
@@ -225,12 +352,20 @@ class InputFile(luigi.ExternalTask):
         """
         return True
 
-class AnalyseLogFile(luigi.contrib.hadoop.JobTask):
+
+class CombinedLogAnalysis(luigi.contrib.hadoop.JobTask):
     """
-    Map-Reduce job that scans a log file for documents associated with 'Watched' targets.
+    Map-Reduce job that reads the crawl logs once and performs all of the standard analyses in a single pass:
 
-    Should run locally if run with only local inputs.
+    - 'analysis': per-day/host/source statistics, documents for 'Watched' targets and dead seed log lines
+    - 'summary': per-host summaries (see SummariseLogFiles)
+    - 'dead-seeds': the list of seeds that never returned a 2xx/3xx (see ListDeadSeeds)
+    - 'status-codes': counts of each status code (see CountStatusCodes)
+
+    Every output line is prefixed with the tag of the analysis it belongs to, i.e. 'tag<TAB>key<TAB>value', so the
+    individual results can be picked out of the shared output by the CombinedLogAnalysisView tasks below.
 
+    Should run locally if run with only local inputs.
     """
 
     task_namespace = 'analyse'
@@ -238,25 +373,39 @@ class AnalyseLogFile(luigi.contrib.hadoop.JobTask):
     launch_id = luigi.Parameter()
     log_paths = luigi.ListParameter()
     targets_path = luigi.Parameter(default=None)
-    from_hdfs = luigi.BoolParameter(default=False)
+    on_hdfs = luigi.BoolParameter(default=False)
 
     # This can be set to 1 if there is intended to be one output file. The usual Luigi default is 25.
     # Using one output file ensures the whole output is sorted but is not suitable for very large crawls.
     n_reduce_tasks = luigi.Parameter(default=25)
 
-    extractor = None
+    # The tags used to route the different results:
+    ANALYSIS = 'analysis'
+    SUMMARY = 'summary'
+    DEAD_SEEDS = 'dead-seeds'
+    STATUS_CODES = 'status-codes'
 
+    extractor = None
 
     def requires(self):
         reqs = []
         for log_path in self.log_paths:
             logger.info("LOG FILE TO PROCESS: %s" % log_path)
-            reqs.append(InputFile(log_path, self.from_hdfs))
+            reqs.append(InputFile(log_path, self.on_hdfs))
         return reqs
 
     def output(self):
-        out_name = "task-state/%s/%s/crawl-logs-%i.analysis.tsjson" % (self.job, self.launch_id, len(self.log_paths))
-        if self.from_hdfs:
+        # Document extraction depends on the targets, so only share results generated with the same setup:
+        if self.targets_path:
+            kind = 'combined-with-documents'
+        else:
+            kind = 'combined'
+        # The shared output is re-used by several tasks, so make sure it's specific to this set of logs, and to the
+        # number of reducers, as that changes how the output is split up and sorted:
+        logs_hash = hashlib.md5(json.dumps(list(self.log_paths)).encode('utf-8')).hexdigest()[:8]
+        out_name = "task-state/%s/%s/crawl-logs-%i-%s-%s-reducers.%s.tsjson" % (
+            self.job, self.launch_id, len(self.log_paths), logs_hash, self.n_reduce_tasks, kind)
+        if self.on_hdfs:
             return luigi.contrib.hdfs.HdfsTarget(path=out_name, format=PlainDir)
         else:
             return luigi.LocalTarget(path=out_name)
@@ -266,7 +415,7 @@ class AnalyseLogFile(luigi.contrib.hadoop.JobTask):
 
     def init_mapper(self):
         # Set up...
-        self.extractor = CrawlLogExtractors(self.job, self.launch_id, self.from_hdfs, targets_path=self.targets_path )
+        self.extractor = CrawlLogExtractors(self.job, self.launch_id, self.on_hdfs, targets_path=self.targets_path )
 
     def jobconfs(self):
         """
@@ -274,14 +423,53 @@ class AnalyseLogFile(luigi.contrib.hadoop.JobTask):
 
         :return:
         """
-        jcs = super(AnalyseLogFile, self).jobconfs()
+        jcs = super(CombinedLogAnalysis, self).jobconfs()
         jcs.append('mapred.map.tasks=%s' % 100)
         #jcs.append('mapred.min.split.size', ) mapred.max.split.size, in bytes. e.g. 256*1024*1024 = 256M
         return jcs
 
     def mapper(self, line):
-        # Parse:
-        log = CrawlLogLine(line)
+        # Split the line once, and share the fields between the different analyses:
+        line_test = line.strip().split(None, 11)
+
+        # The full parse only works for standard (12 field) lines:
+        if len(line_test) == 12:
+            for key, value in self.map_analysis(CrawlLogLine(line), line):
+                yield "%s:%s" % (self.ANALYSIS, key), value
+
+        for key, value in self.map_summary(line_test, line):
+            yield "%s:%s" % (self.SUMMARY, key), value
+
+        for key, value in self.map_dead_seeds(line_test, line):
+            yield "%s:%s" % (self.DEAD_SEEDS, key), value
+
+        for key, value in self.map_status_codes(line_test, line):
+            yield "%s:%s" % (self.STATUS_CODES, key), value
+
+    def reducer(self, key, values):
+        """
+        Routes each key to the reducer for the analysis it came from, and tags the results accordingly.
+
+        :param key:
+        :param values:
+        :return:
+        """
+        tag, key = key.split(':', 1)
+        if tag == self.ANALYSIS:
+            results = self.reduce_analysis(key, values)
+        elif tag == self.SUMMARY:
+            results = self.reduce_summary(key, values)
+        elif tag == self.DEAD_SEEDS:
+            results = self.reduce_dead_seeds(key, values)
+        elif tag == self.STATUS_CODES:
+            results = self.reduce_status_codes(key, values)
+        else:
+            raise Exception("Unknown analysis tag '%s'!" % tag)
+
+        for out_key, out_value in results:
+            yield tag, out_key, out_value
+
+    def map_analysis(self, log, line):
         # Extract basic data for summaries, keyed for later aggregation:
         yield "BY_DAY_HOST_SOURCE,%s,%s,%s" % (log.day(), log.host(), log.source), json.dumps(log.stats())
         # Scan for documents, yield sorted in crawl order:
@@ -293,14 +481,7 @@ class AnalyseLogFile(luigi.contrib.hadoop.JobTask):
                 and log.hop_path == "-" and log.via == "-"):  # seed
             yield "DEAD_SEED,%s,%s" % (log.url, log.start_time_plus_duration), line
 
-    def reducer(self, key, values):
-        """
-        A pass-through reducer.
-
-        :param key:
-        :param values:
-        :return:
-        """
+    def reduce_analysis(self, key, values):
         # Just pass documents through:
         if key.startswith("DOCUMENT") or key.startswith("DEAD_SEED"):
             for value in values:
@@ -326,6 +507,252 @@ class AnalyseLogFile(luigi.contrib.hadoop.JobTask):
 
             yield key, json.dumps(summaries)
 
+    def map_summary(self, line_test, line):
+        if len(line_test) == 12: # standard line (it is a seed if discovery and referrer = "-")
+            log_time, status, size, url, discovery_path, referrer, mime, thread, \
+                request_time, hash, ignore, annotations  \
+                = line_test
+
+        elif len(line_test) == 10: # seed - missing referrer and path
+            log_time, status, size, url, mime, thread, \
+            request_time, hash, ignore, annotations  \
+            = line_test
+            discovery_path = "-" # heritrix docs and some code indicate "blank" values, but in the log "-" appears to be in use
+            referrer = "-"
+        else:
+            logger.info('Log line has unexpected values.\nExpected: 10 or 12. Actual: %s\nLine: %s' % (len(line_test), line))
+            return
+
+        if not status.isdigit(): return
+
+        url_state = ""
+        HTTPStatus = int(status)
+
+        if (HTTPStatus == 404  # not comprehensive!
+            and discovery_path == "-" and referrer == "-"): # seed
+            url_state = "Has Dead Seeds"
+
+        if 200 <= HTTPStatus < 400:
+            url_state = "Live"
+
+        if url_state == "": return
+
+        if url_state == "Live":
+            data = {
+                "mime": "".join([i if ord(i) < 128 else "" for i in mime]),
+            }
+
+            for anno in annotations.split(","):
+                if ":" not in anno:
+                    continue
+                key, value = anno.split(":", 1)
+                if key == "ip":
+                    data["ip"] = value
+                if key == "1":
+                    data["virus"] = value.split()[-2]
+
+            data["url_state"] = "Live"
+
+        else:
+            data = {
+                "ip": {},
+                "mime": {},
+                "virus": {},
+                "url_state":"Has Dead Seeds"
+            }
+
+
+        parsed_url = urlparse(url)
+        host = re.sub(r"^(www([0-9]+)?)\.", "", parsed_url[1])
+
+        yield host, json.dumps(data)
+
+    def reduce_summary(self, key, values):
+        sec_level_domains = ["ac", "co", "gov", "judiciary", "ltd", "me", "mod", "net", "nhs", "nic", "org",
+                             "parliament", "plc", "sch"]
+
+        current_host_data = {
+            "ip": {},
+            "mime": {},
+            "virus": {},
+            "url_state": {}
+        }
+
+        host = key
+        for value in values:
+            data = json.loads(value)
+            logger.info(">>> host: %s data: %s " % (host, data))
+
+            # Some values can only be accumulated for Live hosts
+            if data["url_state"] == "Live":
+                if "ip" in data.keys():
+                    if data["ip"] in current_host_data["ip"].keys():
+                        current_host_data["ip"][data["ip"]] += 1
+                    else:
+                        current_host_data["ip"][data["ip"]] = 1
+
+                if "mime" in data.keys():
+                    if data["mime"] in current_host_data["mime"].keys():
+                        current_host_data["mime"][data["mime"]] += 1
+                    else:
+                        current_host_data["mime"][data["mime"]] = 1
+
+                if "virus" in data.keys():
+                    if data["virus"] in current_host_data["virus"].keys():
+                        current_host_data["virus"][data["virus"]] += 1
+                    else:
+                        current_host_data["virus"][data["virus"]] = 1
+
+            # We assume that even if a host appeared live at some point in the crawl,
+            # it can be considered to have dead seeds if at any other point we encountered one.
+            if "url_state" in data.keys():
+                if current_host_data["url_state"] != "Has Dead Seeds":
+                    current_host_data["url_state"] = data["url_state"]
+
+
+        current_host_data["host"] = host
+        current_host_data["tld"] = host.split(".")[-1]
+        auth = host.split(".")
+        if len(auth) > 2:
+            sld = host.split(".")[-2]
+            if sld in sec_level_domains:
+                current_host_data["2ld"] = sld
+
+
+        yield host, json.dumps(current_host_data)
+
+    def map_dead_seeds(self, line_test, line):
+        if len(line_test) == 12: # standard line (it is a seed if discovery and referrer = "-")
+            _, status, _, url, discovery_path, referrer, _, _, _, _, _, _ \
+            = line_test
+
+        elif len(line_test) == 10: # seed - missing referrer and path
+            _, status, _, url, _, _, _, _, _, _  \
+            = line_test
+            discovery_path = "-" # heritrix docs and some code indicate "blank" values, but in the log "-" appears to be in use
+            referrer = "-"
+        else:
+            logger.info('Log line has unexpected values.\nExpected: 10 or 12. Actual: %s\nLine: %s' % (len(line_test), line))
+            return
+
+        if not status.isdigit():
+            logger.info('Log line has unexpected status.\nExpected: Numeric. Actual: %s\nLine: %s' % (status, line))
+            return
+
+        url_state = ""
+        HTTPStatus = int(status)
+
+        if (HTTPStatus == 404  # not comprehensive!
+            and discovery_path == "-" and referrer == "-"): # seed
+            url_state = "Dead"
+
+        if 200 <= HTTPStatus < 400:
+            url_state = "Live"
+
+        if url_state == "": return
+
+        yield url, url_state
+
+    def reduce_dead_seeds(self, key, values):
+        host = key
+
+        current_url_state = ""
+        for value in values:
+
+            # We assume that even if a host appeared dead at some point in the crawl,
+            # it can be considered live if at any other point we had a successful request.
+            if value in ("Live", "Dead"):
+                if current_url_state != "Live":
+                    current_url_state = value
+
+        if current_url_state == "Dead":
+            yield host, ""
+
+    def map_status_codes(self, line_test, line):
+        # Blank or truncated lines have no status:
+        if len(line_test) < 2:
+            logger.info('Log line has unexpected values.\nExpected: at least 2. Actual: %s\nLine: %s' % (len(line_test), line))
+            return
+
+        status = line_test[1]
+
+        if not status.lstrip('-').isdigit():
+            logger.info('Log line has unexpected status.\nExpected: Numeric. Actual: %s\nLine: %s' % (status, line))
+            return
+
+        yield status, "1" # we will count the 1s in the reducer. any single character would suffice though.
+
+    def reduce_status_codes(self, key, values):
+        status = key
+
+        i = 0
+        for value in values:
+            i+=1
+
+        yield status, str(i)
+
+
+class CombinedLogAnalysisView(luigi.Task):
+    """
+    Base class for tasks that pick one analysis out of the shared output of a CombinedLogAnalysis job.
+
+    This means the logs are only read and parsed once, however many of these analyses are needed.
+    Sub-classes set the tag, the parameters and the output location.
+    """
+    tag = None
+
+    def combined_task(self):
+        raise NotImplementedError("Sub-classes must set up the CombinedLogAnalysis task to use!")
+
+    def requires(self):
+        return self.combined_task()
+
+    def run(self):
+        prefix = "%s\t" % self.tag
+        with self.input().open('r') as fin, self.output().open('w') as fout:
+            for line in fin:
+                # HDFS readers return bytes:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if line.startswith(prefix):
+                    fout.write(line[len(prefix):])
+
+
+class AnalyseLogFile(CombinedLogAnalysisView):
+    """
+    Scans a log file for documents associated with 'Watched' targets, as well as generating per-day/host/source
+    statistics and picking out the dead seeds.
+
+    Should run locally if run with only local inputs.
+
+    """
+
+    task_namespace = 'analyse'
+    job = luigi.Parameter()
+    launch_id = luigi.Parameter()
+    log_paths = luigi.ListParameter()
+    targets_path = luigi.Parameter(default=None)
+    from_hdfs = luigi.BoolParameter(default=False)
+
+    # This can be set to 1 if there is intended to be one output file. The usual Luigi default is 25.
+    # Using one output file ensures the whole output is sorted but is not suitable for very large crawls.
+    n_reduce_tasks = luigi.Parameter(default=25)
+
+    tag = CombinedLogAnalysis.ANALYSIS
+
+    def combined_task(self):
+        return CombinedLogAnalysis(self.job, self.launch_id, self.log_paths, self.targets_path, self.from_hdfs,
+                                   self.n_reduce_tasks)
+
+    def output(self):
+        # Different numbers of reducers are different tasks, so they need different outputs:
+        out_name = "task-state/%s/%s/crawl-logs-%i-%s-reducers.analysis.tsjson" % (
+            self.job, self.launch_id, len(self.log_paths), self.n_reduce_tasks)
+        if self.from_hdfs:
+            return luigi.contrib.hdfs.HdfsTarget(path=out_name, format=PlainDir)
+        else:
+            return luigi.LocalTarget(path=out_name)
+
 
 class ExtractLogsForHost(luigi.contrib.hadoop.JobTask):
     """
@@ -473,7 +900,8 @@ class ExtractLogsByHost(luigi.contrib.hadoop.JobTask):
         return jc
 
 
-class SummariseLogFiles(luigi.contrib.hadoop.JobTask):
+
+class SummariseLogFiles(CombinedLogAnalysisView):
     """
     Based on old code developed for TRAC issue 2478.
 
@@ -483,15 +911,14 @@ class SummariseLogFiles(luigi.contrib.hadoop.JobTask):
     job = luigi.Parameter()
     launch_id = luigi.Parameter()
     on_hdfs = luigi.BoolParameter(default=False)
+    targets_path = luigi.Parameter(default=None)
 
     task_namespace = 'analyse'
 
-    def requires(self):
-        reqs = []
-        for log_path in self.log_paths:
-            logger.info("LOG FILE TO PROCESS: %s" % log_path)
-            reqs.append(InputFile(log_path, self.on_hdfs))
-        return reqs
+    tag = CombinedLogAnalysis.SUMMARY
+
+    def combined_task(self):
+        return CombinedLogAnalysis(self.job, self.launch_id, self.log_paths, self.targets_path, self.on_hdfs)
 
     def output(self):
         out_name = "task-state/%s/%s/crawl-logs-%i.summary.tsjson" % (self.job, self.launch_id, len(self.log_paths))
@@ -500,154 +927,30 @@ class SummariseLogFiles(luigi.contrib.hadoop.JobTask):
         else:
             return luigi.LocalTarget(path=out_name)
 
-    def extra_modules(self):
-        return [lib]#,surt,tldextract,idna,requests,urllib3,certifi,chardet,requests_file,six]
 
-    def mapper(self, line):
-        line_test = line.strip().split(None, 11)
-        
-        if len(line_test) == 12: # standard line (it is a seed if discovery and referrer = "-")
-            log_time, status, size, url, discovery_path, referrer, mime, thread, \
-                request_time, hash, ignore, annotations  \
-                = line_test
-
-        elif len(line_test) == 10: # seed - missing referrer and path
-            log_time, status, size, url, mime, thread, \
-            request_time, hash, ignore, annotations  \
-            = line_test
-            discovery_path = "-" # heritrix docs and some code indicate "blank" values, but in the log "-" appears to be in use
-            referrer = "-"
-        else: 
-            logger.info('Log line has unexpected values.\nExpected: 10 or 12. Actual: %s\nLine: %s' % (len(line_test), line))
-            return
-          
-        if not status.isdigit(): return
-            
-        url_state = ""    
-        HTTPStatus = int(status)
-            
-        if (HTTPStatus == 404  # not comprehensive!     
-            and discovery_path == "-" and referrer == "-"): # seed
-            url_state = "Has Dead Seeds"    
-                      
-        if 200 <= HTTPStatus < 400:
-            url_state = "Live"
-        
-        if url_state == "": return
-            
-        if url_state == "Live":    
-            data = {
-                "mime": "".join([i if ord(i) < 128 else "" for i in mime]),
-            }
-
-            for anno in annotations.split(","):
-                if ":" not in anno:
-                    continue
-                key, value = anno.split(":", 1)
-                if key == "ip":
-                    data["ip"] = value
-                if key == "1":
-                    data["virus"] = value.split()[-2]
-                    
-            data["url_state"] = "Live"
-            
-        else:
-            data = {
-                "ip": {},
-                "mime": {},
-                "virus": {},
-                "url_state":"Has Dead Seeds"
-            }
-            
-
-        parsed_url = urlparse(url)
-        host = re.sub("^(www([0-9]+)?)\.", "", parsed_url[1])                        
-                                
-        yield host, json.dumps(data)
-
-    def reducer(self, key, values):
-        sec_level_domains = ["ac", "co", "gov", "judiciary", "ltd", "me", "mod", "net", "nhs", "nic", "org",
-                             "parliament", "plc", "sch"]
-
-        current_host_data = {
-            "ip": {},
-            "mime": {},
-            "virus": {},
-            "url_state": {}
-        }
-
-        host = key
-        for value in values:
-            data = json.loads(value)
-            logger.info(">>> host: %s data: %s " % (host, data))                    
-            
-            # Some values can only be accumulated for Live hosts    
-            if data["url_state"] == "Live":            
-                if "ip" in data.keys():
-                    if data["ip"] in current_host_data["ip"].keys():
-                        current_host_data["ip"][data["ip"]] += 1
-                    else:
-                        current_host_data["ip"][data["ip"]] = 1
-                
-                if "mime" in data.keys():                    
-                    if data["mime"] in current_host_data["mime"].keys():
-                        current_host_data["mime"][data["mime"]] += 1
-                    else:
-                        current_host_data["mime"][data["mime"]] = 1
-                    
-                if "virus" in data.keys():
-                    if data["virus"] in current_host_data["virus"].keys():
-                        current_host_data["virus"][data["virus"]] += 1
-                    else:
-                        current_host_data["virus"][data["virus"]] = 1
-            
-            # We assume that even if a host appeared live at some point in the crawl,
-            # it can be considered to have dead seeds if at any other point we encountered one.            
-            if "url_state" in data.keys(): 
-                if current_host_data["url_state"] != "Has Dead Seeds":
-                    current_host_data["url_state"] = data["url_state"]                    
-
-
-        current_host_data["host"] = host
-        current_host_data["tld"] = host.split(".")[-1]
-        auth = host.split(".")
-        if len(auth) > 2:
-            sld = host.split(".")[-2]
-            if sld in sec_level_domains:
-                current_host_data["2ld"] = sld
-
-
-        yield host, json.dumps(current_host_data)
-
-
-class ListDeadSeeds(luigi.contrib.hadoop.JobTask):
+class ListDeadSeeds(CombinedLogAnalysisView):
 
     """
-    Essentially does the same as SummariseLogFiles on the same input, but 
+    Essentially does the same as SummariseLogFiles on the same input, but
     we only output dead seeds here. In that task, we add them to the JSON.
 
-    The reason we don't output a straight list within that process 
-    (i.e. why are we processing the same logs twice?) is that we output 
-    JSON there and MR within Luigi doesn't lend itself obviously to 
-    either operating on JSON input or outputting multiple files 
-    within the same task. TODO.
+    Both are views over the same CombinedLogAnalysis output, so the logs
+    are only processed once.
     """
 
     log_paths = luigi.ListParameter()
     job = luigi.Parameter()
     launch_id = luigi.Parameter()
     on_hdfs = luigi.BoolParameter(default=False)
+    targets_path = luigi.Parameter(default=None)
 
     task_namespace = 'analyse'
 
-    def requires(self):
-        reqs = []
-        for log_path in self.log_paths:
-            logger.info("LOG FILE TO PROCESS: %s" % log_path)
-            reqs.append(InputFile(log_path, self.on_hdfs))
-        return reqs
+    tag = CombinedLogAnalysis.DEAD_SEEDS
+
+    def combined_task(self):
+        return CombinedLogAnalysis(self.job, self.launch_id, self.log_paths, self.targets_path, self.on_hdfs)
 
- 
     def output(self):
         out_name = "task-state/%s/%s/crawl-logs-%i.dead-seeds.txt" % (self.job, self.launch_id, len(self.log_paths))
         if self.on_hdfs:
@@ -655,84 +958,27 @@ class ListDeadSeeds(luigi.contrib.hadoop.JobTask):
         else:
             return luigi.LocalTarget(path=out_name)
 
-    def extra_modules(self):
-        return [lib]
-
-    def mapper(self, line):
-  
-        line_test = line.strip().split(None, 11)
-        
-        if len(line_test) == 12: # standard line (it is a seed if discovery and referrer = "-")
-            _, status, _, url, discovery_path, referrer, _, _, _, _, _, _ \
-            = line_test
-
-        elif len(line_test) == 10: # seed - missing referrer and path
-            _, status, _, url, _, _, _, _, _, _  \
-            = line_test
-            discovery_path = "-" # heritrix docs and some code indicate "blank" values, but in the log "-" appears to be in use
-            referrer = "-"
-        else: 
-            logger.info('Log line has unexpected values.\nExpected: 10 or 12. Actual: %s\nLine: %s' % (len(line_test), line))
-            return
-            
-        if not status.isdigit(): 
-            logger.info('Log line has unexpected status.\nExpected: Numeric. Actual: %s\nLine: %s' % (status, line))
-            return
-        
-        url_state = ""    
-        HTTPStatus = int(status)
-            
-        if (HTTPStatus == 404  # not comprehensive!     
-            and discovery_path == "-" and referrer == "-"): # seed
-            url_state = "Dead"    
-                      
-        if 200 <= HTTPStatus < 400:
-            url_state = "Live"
-            
-        if url_state == "": return
-           
-        yield url, url_state
 
-        
-    def reducer(self, key, values):
-        host = key
-        
-        current_url_state = ""
-        for value in values:
-        
-            # We assume that even if a host appeared dead at some point in the crawl,
-            # it can be considered live if at any other point we had a successful request.
-            if value in ("Live", "Dead"):        
-                if current_url_state != "Live":
-                    current_url_state = value
-        
-        if current_url_state == "Dead":
-            yield host, ""
-            
-            
-            
-class CountStatusCodes(luigi.contrib.hadoop.JobTask):
+class CountStatusCodes(CombinedLogAnalysisView):
 
     """
-    Count of Each Heritrix/HTTP Status returned  
-    https://github.com/internetarchive/heritrix3/wiki/Status-Codes    
+    Count of Each Heritrix/HTTP Status returned
+    https://github.com/internetarchive/heritrix3/wiki/Status-Codes
     """
 
     log_paths = luigi.ListParameter()
     job = luigi.Parameter()
     launch_id = luigi.Parameter()
     on_hdfs = luigi.BoolParameter(default=False)
+    targets_path = luigi.Parameter(default=None)
 
     task_namespace = 'analyse'
 
-    def requires(self):
-        reqs = []
-        for log_path in self.log_paths:
-            logger.info("LOG FILE TO PROCESS: %s" % log_path)
-            reqs.append(InputFile(log_path, self.on_hdfs))
-        return reqs
+    tag = CombinedLogAnalysis.STATUS_CODES
+
+    def combined_task(self):
+        return CombinedLogAnalysis(self.job, self.launch_id, self.log_paths, self.targets_path, self.on_hdfs)
 
- 
     def output(self):
         out_name = "task-state/%s/%s/crawl-logs-%i.status-code-counts.txt" % (self.job, self.launch_id, len(self.log_paths))
         if self.on_hdfs:
@@ -740,32 +986,7 @@ class CountStatusCodes(luigi.contrib.hadoop.JobTask):
         else:
             return luigi.LocalTarget(path=out_name)
 
-    def extra_modules(self):
-        return [lib]
-
-    def mapper(self, line):
-  
-        status = line.strip().split(None, 11)[1]
-    
-        if not status.lstrip('-').isdigit(): 
-            logger.info('Log line has unexpected status.\nExpected: Numeric. Actual: %s\nLine: %s' % (status, line))
-            return 
-                   
-        yield status, "1" # we will count the 1s in the reducer. any single character would suffice though.
-
-        
-    def reducer(self, key, values):
-        status = key
-        
-        i = 0
-        for value in values:
-            i+=1
-           
-        yield status, str(i) 
-            
-            
 
-            
 if __name__ == '__main__':
     #luigi.run(['analyse.SummariseLogFiles', '--job', 'dc', '--launch-id', '20170220090024',
     #           '--log-paths', '[ "test/logs/fragment-of-a-crawl.log" ]',
@@ -1,7 +1,11 @@
+import re
 import json
+import datetime
+from urllib.parse import urlparse
 import luigi
 from tasks.analyse.crawl_logs.log_analysis_hadoop import SummariseLogFiles, ListDeadSeeds, \
-    CountStatusCodes, ReportToSlackStatusCodes, ReportToSlackDeadSeeds
+    CountStatusCodes, CombinedLogAnalysis, CrawlLogLine, parse_many
+from tasks.analyse.slack_reporting import ReportToSlackDeadSeeds
 
 
 def test_run_summariser():
@@ -46,7 +50,86 @@ def test_run_count_status_codes():
 
     assert count is 6
 
-    
+
+def test_run_combined_analysis():
+    task = CombinedLogAnalysis('dc','20170220090024', [ '../../test/fragment-of-a-crawl-with-dead-seeds.log' ])
+    luigi.build([task], local_scheduler=True)
+
+    counts = {}
+    with task.output().open() as f:
+        for line in f.readlines():
+            tag, key, val = line.split('\t', 2)
+            counts[tag] = counts.get(tag, 0) + 1
+
+    assert counts[CombinedLogAnalysis.DEAD_SEEDS] == 2
+    assert counts[CombinedLogAnalysis.STATUS_CODES] == 6
+    assert counts[CombinedLogAnalysis.SUMMARY] == 7
+    assert counts[CombinedLogAnalysis.ANALYSIS] > 0
+
+    # Blank and truncated lines are skipped, rather than failing the whole job:
+    for line in ['', '\n', '2017-02-20T09:00:24.123Z']:
+        assert list(task.mapper(line)) == []
+
+
+def _reference_parse(line):
+    # The original, eager, CrawlLogLine parsing, to check the new one against:
+    fields = re.split(" +", line.strip(), maxsplit=11)
+    annotation_string = fields[11]
+    extra_json = None
+    if annotation_string.endswith(' {}'):
+        annotation_string = annotation_string[:-3]
+    elif ' {"' in annotation_string and annotation_string.endswith('}'):
+        annotation_string, extra_json = re.split(re.escape(' {"'), annotation_string, maxsplit=1)
+        extra_json = '{"%s' % extra_json
+    annotations = annotation_string.split(',')
+    stats = {
+        'lines': '',
+        'status_code': fields[1],
+        'content_type': fields[6],
+        'hop': fields[4][-1:],
+        'sum:content_length': fields[2]
+    }
+    for annot in annotations:
+        prefix = ''
+        if re.match(r'^\d+t$', annot):
+            prefix = 'tries:'
+        elif re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', annot):
+            prefix = "ip:"
+        if annot.startswith('launchTimestamp:'):
+            continue
+        if annot != "-":
+            stats["%s%s" % (prefix, annot)] = ""
+    if fields[3].startswith("dns:"):
+        host = fields[3][4:]
+    else:
+        host = urlparse(fields[3]).hostname
+    date = datetime.datetime.strptime(fields[0], "%Y-%m-%dT%H:%M:%S.%fZ")
+    return fields[:11], annotation_string, extra_json, annotations, stats, host, date
+
+
+def test_crawl_log_line_parity():
+    count = 0
+    for log_file in ['../../test/crawl.log', '../../test/fragment-of-a-crawl.log',
+                     '../../test/fragment-of-a-crawl-with-dead-seeds.log']:
+        with open(log_file) as f:
+            lines = [line for line in f if line.strip()]
+        for line, log in zip(lines, parse_many(lines)):
+            fields, annotation_string, extra_json, annotations, stats, host, date = _reference_parse(line)
+            assert [log.timestamp, log.status_code, log.content_length, log.url, log.hop_path, log.via, log.mime,
+                    log.thread, log.start_time_plus_duration, log.hash, log.source] == fields
+            assert log.annotation_string == annotation_string
+            assert log.extra_json == extra_json
+            assert log.annotations == annotations
+            assert log.stats() == stats
+            assert log.host() == host
+            assert log.date() == date
+            # Parsing one line at a time should give the same:
+            assert CrawlLogLine(line).host() == host
+            count = count + 1
+
+    assert count > 100
+
+
 def test_report_to_slack():
 #    task = ReportToSlackStatusCodes([ '../../test/fragment-of-a-crawl.log' ], 'dc','20170220090024', False )
     task = ReportToSlackDeadSeeds([ '../../test/fragment-of-a-crawl-with-dead-seeds.log' ], 'dc','20170220090024', False )
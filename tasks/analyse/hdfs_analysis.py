@@ -3,16 +3,21 @@ import csv
 import json
 import gzip
 import pysolr
+import hashlib
 import shutil
 import logging
 import datetime
-import papermill as pm
+import collections
 import luigi.contrib.webhdfs
 from prometheus_client import CollectorRegistry, Gauge
 from tasks.common import state_file
+from tasks.analyse.hdfs_path_parser import parse_file_list, HdfsPathParser, classify_directory
+from tasks.analyse.hdfs_delta import CHANGE_KINDS, REPLACED, sort_listing, diff_listings, read_changes
 from lib.targets import CrawlPackageTarget, CrawlReportTarget, ReportTarget
 from tasks.ingest.list_hdfs_content import CopyFileListToHDFS
 from lib.webhdfs import webhdfs
+from lib.crawl_files import CrawlFilesDB
+from lib.solr_updates import FingerprintStore, ParallelSolrUpdater
 from lib.targets import AccessTaskDBTarget, DatedStateFileTask
 
 
@@ -95,53 +100,187 @@ class ListParsedPaths(DatedStateFileTask):
     tag = 'hdfs'
     name = 'parsed-paths'
     output_ext = 'csv'
-    dated_ext = 'ipynb'
+    dated_ext = 'json'
+
+    # Number of processes to parse the file list with (0 means use one per CPU):
+    processes = luigi.IntParameter(default=0, significant=False)
 
     def requires(self):
         return DownloadHDFSFileList(self.date)
 
     def run(self):
-        # Change into this directory:
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        os.chdir(dir_path)
+        # Parse the listing, writing to a temporary path so the output only appears when all is well:
+        with self.output().temporary_path() as temp_output_path:
+            lines = parse_file_list(self.input().path, temp_output_path, processes=self.processes or None)
+
         # Record a dated flag file to show the work is done.
-        with self.dated_state_file().temporary_path() as dated_out_path:
-            # Perform this analysis by running the appropriate notebook:
-            pm.execute_notebook(
-                './hdfs_path_parser.ipynb',
-                dated_out_path,
-                parameters = dict(
-                    file_list_csv = self.input().path,
-                    parsed_files_csv = self.output().path
-                )
-            )
-
-
-class UpdateWarcsDatabase(luigi.Task):
+        with self.dated_state_file().open('w') as fout:
+            fout.write(json.dumps({'lines': lines}))
+
+
+class ListHDFSFileListChanges(luigi.Task):
     """
-    Lists the WARCS and arranges them by date:
+    Compares the parsed listing of HDFS with the one from the last time this ran, and lists the files that have been
+    added, removed or modified since.
+
+    A copy of the listing, sorted by path, is kept to compare against next time. If there is no earlier listing to
+    compare with, 'previous' is recorded as None, and downstream tasks have to process the whole listing instead.
+    """
+    date = luigi.DateParameter(default=datetime.date.today())
+    task_namespace = "analyse.hdfs"
+
+    def requires(self):
+        return ListParsedPaths(self.date)
+
+    def output(self):
+        return state_file(self.date, 'hdfs', 'file-list-changes.json')
+
+    def change_paths(self):
+        return dict((kind, state_file(self.date, 'hdfs', 'file-list-%s.csv' % kind).path)
+                    for kind in CHANGE_KINDS + [REPLACED])
+
+    @staticmethod
+    def snapshot():
+        return state_file('current', 'hdfs', 'parsed-paths-sorted.csv')
+
+    @staticmethod
+    def snapshot_info():
+        return state_file('current', 'hdfs', 'parsed-paths-sorted.json')
+
+    def run(self):
+        snapshot = self.snapshot()
+        snapshot_info = self.snapshot_info()
+        previous = None
+        if snapshot.exists() and snapshot_info.exists():
+            with snapshot_info.open('r') as f:
+                previous = json.load(f)['date']
+
+        # Sort today's listing, alongside the previous one:
+        sorted_path = "%s.new" % snapshot.path
+        os.makedirs(os.path.dirname(sorted_path), exist_ok=True)
+        total = sort_listing(self.input().path, sorted_path)
+        summary = {'date': self.date.isoformat(), 'previous': None, 'total': total}
+        if previous:
+            for path in self.change_paths().values():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                summary.update(diff_listings(snapshot.path, sorted_path, self.change_paths()))
+                summary['previous'] = previous
+            except ValueError as e:
+                logger.warning("Could not compare with the listing from %s: %s" % (previous, e))
+
+        # Keep today's listing to compare against next time:
+        os.replace(sorted_path, snapshot.path)
+        with snapshot_info.open('w') as f:
+            f.write(json.dumps({'date': self.date.isoformat()}))
+
+        with self.output().open('w') as f:
+            f.write(json.dumps(summary))
+
+
+class IncrementalListingTask(luigi.Task):
+    """
+    Base class for tasks that keep some state that is derived from the HDFS listing.
+
+    In incremental mode, only the changes since the last listing are applied to the state, as long as the state was
+    derived from that same listing. Otherwise, the state is rebuilt from the whole listing.
     """
     date = luigi.DateParameter(default=datetime.date.today())
+    incremental = luigi.BoolParameter(default=False)
+
+    # Used to name the file that records which listing the state was derived from:
+    state_name = None
+
+    def requires(self):
+        if self.incremental:
+            return ListHDFSFileListChanges(self.date)
+        return ListParsedPaths(self.date)
+
+    def state_key(self):
+        # Anything else that identifies the state, e.g. which database it is in:
+        return None
+
+    def state_info(self):
+        return state_file('current', 'hdfs', '%s-state.json' % self.state_name)
+
+    def full_listing(self):
+        return ListParsedPaths(self.date).output()
+
+    def changes_to_apply(self):
+        """
+        Returns the change files to apply to the state, or None if the state should be rebuilt from the full listing.
+        """
+        if not self.incremental:
+            return None
+        changes_task = ListHDFSFileListChanges(self.date)
+        with changes_task.output().open('r') as f:
+            changes = json.load(f)
+        if changes['previous'] is None:
+            logger.info("No earlier listing to compare with, so processing the whole listing.")
+            return None
+        state_info = self.state_info()
+        if not state_info.exists():
+            logger.info("No state recorded in %s, so processing the whole listing." % state_info.path)
+            return None
+        with state_info.open('r') as f:
+            state = json.load(f)
+        if state['date'] != changes['previous'] or state.get('key', None) != self.state_key():
+            logger.warning("State %s does not match the listing from %s, so processing the whole listing." % (
+                state, changes['previous']))
+            return None
+        return changes_task.change_paths()
+
+    def record_state(self):
+        with self.state_info().open('w') as f:
+            f.write(json.dumps({'date': self.date.isoformat(), 'key': self.state_key()}))
+
+
+class UpdateWarcsDatabase(IncrementalListingTask):
+    """
+    Lists the WARCS and arranges them by date:
+
+    In incremental mode, only files that have been added or modified since the last update are sent.
+
+    What was sent is remembered in a local store for each tracking database, on every run. With --only-changed,
+    records that are the same as when they were last sent are skipped, which means their refresh_date_dt records when
+    they last changed rather than when they were last seen. If the tracking database is rebuilt or wiped without
+    using --clear-trackdb, use --reset-fingerprints, or run once without --only-changed, so everything is sent again.
+    """
     trackdb = luigi.Parameter(default='http://localhost:8983/solr/tracking')
     clear_trackdb = luigi.BoolParameter(default=False) # Should only be use in testing as this will delete downstream state.
 
     task_namespace = 'analyse.hdfs'
+    state_name = 'warcs-database'
+
+    # Only send records that have changed since they were last sent:
+    only_changed = luigi.BoolParameter(default=False, significant=False)
+    # Forget what has been sent before, so every record is sent again:
+    reset_fingerprints = luigi.BoolParameter(default=False, significant=False)
+    # How many batches of updates to send at once:
+    max_workers = luigi.IntParameter(default=4, significant=False)
 
     total = 0
     batch_size = 5000
+    stats = None
 
-    def requires(self):
-        return ListParsedPaths(self.date)
+    def state_key(self):
+        return self.trackdb
 
     def output(self):
         return AccessTaskDBTarget(self.task_namespace, self.task_id)
 
+    def fingerprint_store(self):
+        # Keep a separate store for each tracking database:
+        key = hashlib.md5(self.trackdb.encode('utf-8')).hexdigest()
+        target = state_file('current', 'hdfs', 'warcs-database-fingerprints-%s.sqlite' % key)
+        os.makedirs(os.path.dirname(target.path), exist_ok=True)
+        return FingerprintStore(target.path)
+
     def entry_generator(self, reader):
         refresh_date = datetime.datetime.utcnow().isoformat()
         if not refresh_date.endswith('Z'):
             refresh_date = "%sZ" % refresh_date
 
-        bunch = []
         for item in reader:
             doc = {
                 'id': 'hdfs://hdfs:54310%s' % item['file_path'],
@@ -164,107 +303,230 @@ class UpdateWarcsDatabase(luigi.Task):
                 'job_s': item['job'],
                 'layout_s': item['layout']
             }
-            bunch.append(doc)
-            if len(bunch) >= self.batch_size:
-                self.total += len(bunch)
-                yield bunch
-                bunch = []
-
-        if len(bunch) > 0:
-            self.total += len(bunch)
-            yield bunch
+            self.total += 1
+            yield doc
 
     def run(self):
-        print("Connect")
         # Set up a connection for this:
         solr = pysolr.Solr(self.trackdb, always_commit=False)
 
-        # Clear first if configured:
+        # Clear first if configured, forgetting what was sent before too:
+        store = self.fingerprint_store()
+        if self.clear_trackdb or self.reset_fingerprints:
+            store.clear()
         if self.clear_trackdb:
             solr.delete(q='*:*', commit=False)
 
+        # Send the records in parallel, commit within 30 seconds please:
+        # N.B. the refresh date changes every time, so is left out when working out what has changed. What is sent is
+        # always recorded, so the store keeps up with the tracking database even when nothing is being skipped.
+        updater = ParallelSolrUpdater(self.trackdb, store=store, exclude=['refresh_date_dt'],
+                                      skip_unchanged=self.only_changed, max_workers=self.max_workers,
+                                      batch_size=self.batch_size, commit_within=30000)
+
         # Go through the data and assemble the resources for each crawl:
         self.total = 0
-        print("open up")
-        fields = {}
-        with self.input().open('r') as fin:
-            reader = csv.DictReader(fin)
-            for bunch in self.entry_generator(reader):
-                # Generate the list of fields up update (avoid replacing whole document)
-                if len(fields) == 0:
-                    for key in bunch[0]:
-                        if key != 'id':
-                            fields[key] = 'set'
-                # Perform the update, commit within 30 seconds please:
-                solr.add(bunch, fieldUpdates=fields, commitWithin="30000")
-                logger.info("Posted %i records..." % self.total)
+        changes = None if self.clear_trackdb else self.changes_to_apply()
+        with self.full_listing().open('r') as fin:
+            if changes is None:
+                reader = csv.DictReader(fin)
+            else:
+                # N.B. removed files are left in place, as they are when processing the whole listing:
+                reader = (row for kind, row in read_changes(changes) if kind != 'removed')
+            updater.update(self.entry_generator(reader))
+        self.stats = updater.stats()
+        logger.info("Update stats: %s" % self.stats)
+        store.close()
 
         # And make it visible:
-        solr.commit()
+        updater.commit()
 
         # FIXME also check last_seen_at date and warn if anything appears to have gone missing?
 
-        # Sanity check:
-        if self.total == 0:
+        # Sanity check (there may be no changes at all though):
+        if self.total == 0 and changes is None:
             raise Exception("No filenames generated! Something went wrong!")
 
         # Record we completed successfully:
+        self.record_state()
         self.output().touch()
 
+    def get_metrics(self, registry):
+        # type: (CollectorRegistry) -> None
+        if not self.stats:
+            return
 
-class ListEmptyFiles(luigi.Task):
+        g = Gauge('ukwa_trackdb_records_total',
+                  'Number of file records processed by the Tracking DB update, by outcome.',
+                  labelnames=['outcome'], registry=registry)
+        g.labels(outcome='sent').set(self.stats['sent'])
+        g.labels(outcome='skipped').set(self.stats['skipped'])
+
+        g = Gauge('ukwa_trackdb_records_sent_per_second',
+                  'Rate at which changed file records were sent to the Tracking DB.',
+                  registry=registry)
+        g.set(self.stats['sent_per_second'])
+
+
+class LoadCrawlFilesDatabase(IncrementalListingTask):
+    """
+    Loads the recognised crawl files into the crawl_files table, in bulk.
+
+    In incremental mode, only files that have been added or modified since the last load are sent. Files that have
+    gone are left in place, but their last_seen_at date will no longer be updated.
+    """
+    crawl_files_db = luigi.Parameter(default=os.environ.get(
+        'CRAWL_FILES_DB', 'host=ingest dbname=ingest_task_state user=ingest password=ingest'))
+
+    task_namespace = 'analyse.hdfs'
+    state_name = 'crawl-files-database'
+
+    # How the collections map to the terms the files were collected under:
+    TERMS = {
+        'npld': 'npld',
+        'selective': 'by-permission'
+    }
+
+    def state_key(self):
+        return self.crawl_files_db
+
+    def output(self):
+        return AccessTaskDBTarget(self.task_namespace, self.task_id)
+
+    @classmethod
+    def crawl_file(cls, item):
+        # The launch is not in the parsed listing, but the directory classification is cached so this is cheap:
+        launch = classify_directory(os.path.dirname(item['file_path'])).launch
+        return {
+            'filename': item['file_name'],
+            'job_name': item['job'] if item['job'] != 'None' else '',
+            'job_launch': launch or '',
+            'full_path': item['file_path'],
+            'extension': item['file_ext'] if item['file_ext'] != 'None' else None,
+            'type': item['kind'],
+            'size': item['file_size'],
+            'created_at': item['timestamp'],
+            'storage_uri': 'hdfs://hdfs:54310%s' % item['file_path'],
+            'stream': item['stream'] if item['stream'] != 'None' else None,
+            'terms': cls.TERMS.get(item['collection'], None),
+        }
+
+    def run(self):
+        db = CrawlFilesDB(self.crawl_files_db)
+        changes = self.changes_to_apply()
+        with self.full_listing().open('r') as fin:
+            if changes is None:
+                reader = csv.DictReader(fin)
+            else:
+                reader = (row for kind, row in read_changes(changes) if kind != 'removed')
+            counts = db.load(self.crawl_file(item) for item in reader if item['recognised'] == 'True')
+        db.close()
+
+        # Sanity check (there may be no changes at all though):
+        if counts['inserted'] + counts['updated'] == 0 and changes is None:
+            raise Exception("No crawl files loaded! Something went wrong!")
+
+        # Record we completed successfully:
+        self.record_state()
+        self.output().touch()
+
+
+class ListEmptyFiles(IncrementalListingTask):
     """
     Takes the full file list and extracts the empty files, as these should be checked.
     """
-    date = luigi.DateParameter(default=datetime.date.today())
     task_namespace = "analyse.hdfs"
-
-    def requires(self):
-        return ListParsedPaths(self.date)
+    state_name = 'empty-files'
 
     def output(self):
         return state_file(self.date, 'hdfs', 'empty-files-list.csv')
 
+    @staticmethod
+    def state():
+        return state_file('current', 'hdfs', 'empty-files-list.csv')
+
+    @staticmethod
+    def is_empty(item):
+        return not item['permissions'].startswith('d') and item['file_size'] == "0"
+
     def run(self):
-        with self.input().open('r') as fin:
-            reader = csv.DictReader(fin)
-            with self.output().open('w') as fout:
+        empty_files = collections.OrderedDict()
+        changes = self.changes_to_apply()
+        if changes is None:
+            with self.full_listing().open('r') as fin:
+                for item in csv.DictReader(fin):
+                    if self.is_empty(item):
+                        empty_files[item['file_path']] = item
+        else:
+            with self.state().open('r') as fin:
+                for item in csv.DictReader(fin):
+                    empty_files[item['file_path']] = item
+            for kind, item in read_changes(changes):
+                empty_files.pop(item['file_path'], None)
+                if kind != 'removed' and self.is_empty(item):
+                    empty_files[item['file_path']] = item
+
+        for target in [self.state(), self.output()]:
+            with target.open('w') as fout:
                 # Set up output file:
-                writer = csv.DictWriter(fout, fieldnames=reader.fieldnames)
+                writer = csv.DictWriter(fout, fieldnames=HdfsPathParser.field_names())
                 writer.writeheader()
-                for item in reader:
-                    # Archive file names:
-                    if not item['permissions'].startswith('d') and item['file_size'] == "0":
-                        writer.writerow(item)
+                for item in empty_files.values():
+                    writer.writerow(item)
+        self.record_state()
 
 
-class ListDuplicateFiles(luigi.Task):
+class ListDuplicateFiles(IncrementalListingTask):
     """
     List all files on HDFS that appear to be duplicates.
+
+    The paths of all the files with each name are kept, so that changes can be applied to them.
     """
-    date = luigi.DateParameter(default=datetime.date.today())
     task_namespace = "analyse.hdfs"
+    state_name = 'file-names'
 
     total_unduplicated = 0
     total_duplicated = 0
 
-    def requires(self):
-        return ListParsedPaths(self.date)
-
     def output(self):
         return state_file(self.date, 'hdfs', 'duplicate-files-list.tsv')
 
+    @staticmethod
+    def state():
+        return state_file('current', 'hdfs', 'file-names-index.tsv')
+
     def run(self):
         filenames = {}
-        with self.input().open('r') as fin:
-            reader = csv.DictReader(fin)
-            for item in reader:
-                # Archive file names:
-                basename = os.path.basename(item['file_name'])
-                if basename not in filenames:
-                    filenames[basename] = [item['file_name']]
-                else:
-                    filenames[basename].append(item['file_name'])
+        changes = self.changes_to_apply()
+        if changes is None:
+            with self.full_listing().open('r') as fin:
+                reader = csv.DictReader(fin)
+                for item in reader:
+                    # Archive file names:
+                    basename = os.path.basename(item['file_name'])
+                    if basename not in filenames:
+                        filenames[basename] = [item['file_path']]
+                    else:
+                        filenames[basename].append(item['file_path'])
+        else:
+            with self.state().open('r') as fin:
+                for line in fin:
+                    basename, paths = line.rstrip('\n').split('\t')
+                    filenames[basename] = json.loads(paths)
+            for kind, item in read_changes(changes):
+                if kind == 'added':
+                    filenames.setdefault(item['file_name'], []).append(item['file_path'])
+                elif kind == 'removed':
+                    paths = filenames.get(item['file_name'], [])
+                    if item['file_path'] in paths:
+                        paths.remove(item['file_path'])
+                    if not paths:
+                        filenames.pop(item['file_name'], None)
+
+        # Keep the index, to apply the next changes to:
+        with self.state().open('w') as f:
+            for basename in filenames:
+                f.write("%s\t%s\n" % (basename, json.dumps(filenames[basename])))
 
         # And emit duplicates:
         self.total_duplicated = 0
@@ -277,6 +539,7 @@ class ListDuplicateFiles(luigi.Task):
                 else:
                     self.total_unduplicated += 1
         logger.info("Of %i WARC filenames, %i are stored in a single HDFS location." % (len(filenames), self.total_unduplicated))
+        self.record_state()
 
 
 class ListByCrawl(luigi.Task):
@@ -444,11 +707,15 @@ class ListByCrawl(luigi.Task):
 class GenerateHDFSSummaries(luigi.WrapperTask):
     """
     A 'Wrapper Task' that invokes the summaries of HDFS we are interested in.
+
+    In incremental mode, the summaries that can be are updated with the day's changes rather than rebuilt.
     """
     task_namespace = "analyse.report"
+    incremental = luigi.BoolParameter(default=False)
 
     def requires(self):
-        return [ ListDuplicateFiles(), ListEmptyFiles(), ListByCrawl(), ListParsedPaths() ]
+        return [ ListDuplicateFiles(incremental=self.incremental), ListEmptyFiles(incremental=self.incremental),
+                 ListByCrawl(), ListParsedPaths() ]
 
 
 if __name__ == '__main__':
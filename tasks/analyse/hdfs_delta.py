@@ -0,0 +1,139 @@
+import os
+import csv
+import heapq
+import shutil
+import logging
+import tempfile
+from operator import itemgetter
+
+logger = logging.getLogger('luigi-interface')
+
+"""
+Works out what has changed between two listings of HDFS, so downstream tasks only need to process the differences.
+
+Both listings are sorted by path, so they can be compared with a single merge pass, without holding either of them in
+memory.
+"""
+
+# The kinds of change, each of which is written to a separate file:
+CHANGE_KINDS = ['added', 'removed', 'modified']
+
+# The old versions of the modified rows, which are only written if asked for, and are not one of the CHANGE_KINDS as
+# they are not changes in themselves. Needed by anything that has to take the old values back out, like totals:
+REPLACED = 'replaced'
+
+
+def _runs(reader, run_size):
+    run = []
+    for row in reader:
+        run.append(row)
+        if len(run) >= run_size:
+            yield run
+            run = []
+    if run:
+        yield run
+
+
+def sort_listing(in_csv, out_csv, key='file_path', run_size=500000):
+    """
+    Sorts a CSV listing by the given column, using sorted runs on disk so large listings do not have to fit in memory.
+
+    :return: the number of rows sorted
+    """
+    total = 0
+    with open(in_csv, 'r', newline='') as fin:
+        reader = csv.reader(fin)
+        header = next(reader)
+        by_key = itemgetter(header.index(key))
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_csv)))
+        run_files = []
+        try:
+            for run in _runs(reader, run_size):
+                run.sort(key=by_key)
+                run_path = os.path.join(temp_dir, 'run-%i.csv' % len(run_files))
+                with open(run_path, 'w', newline='') as fout:
+                    csv.writer(fout).writerows(run)
+                run_files.append(open(run_path, 'r', newline=''))
+                total += len(run)
+            # Merge the sorted runs together:
+            with open(out_csv, 'w', newline='') as fout:
+                writer = csv.writer(fout)
+                writer.writerow(header)
+                writer.writerows(heapq.merge(*[csv.reader(f) for f in run_files], key=by_key))
+        finally:
+            for f in run_files:
+                f.close()
+            shutil.rmtree(temp_dir)
+    logger.info("Sorted %i rows of %s" % (total, in_csv))
+    return total
+
+
+def diff_listings(old_csv, new_csv, change_csvs, key='file_path'):
+    """
+    Compares two listings, both sorted by the key column, and writes out the rows that have been added, removed or
+    modified. Added and modified rows are written as they appear in the new listing, removed rows as they were in the
+    old one.
+
+    :param old_csv: the previous sorted listing
+    :param new_csv: the current sorted listing
+    :param change_csvs: dict mapping each of CHANGE_KINDS to an output path, and optionally REPLACED to a path to write
+    the old versions of the modified rows to
+    :return: dict of the number of rows of each kind of change, plus 'unchanged'
+    """
+    counts = dict((kind, 0) for kind in CHANGE_KINDS + ['unchanged'])
+    with open(old_csv, 'r', newline='') as f_old, open(new_csv, 'r', newline='') as f_new:
+        old_reader = csv.reader(f_old)
+        new_reader = csv.reader(f_new)
+        header = next(new_reader)
+        old_header = next(old_reader)
+        if old_header != header:
+            raise ValueError("Cannot compare listings with different columns: %s != %s" % (old_header, header))
+        k = header.index(key)
+
+        files = {}
+        writers = {}
+        try:
+            for kind in CHANGE_KINDS + [REPLACED]:
+                if kind not in change_csvs:
+                    continue
+                files[kind] = open(change_csvs[kind], 'w', newline='')
+                writers[kind] = csv.writer(files[kind])
+                writers[kind].writerow(header)
+
+            old = next(old_reader, None)
+            new = next(new_reader, None)
+            while old is not None or new is not None:
+                if new is None or (old is not None and old[k] < new[k]):
+                    writers['removed'].writerow(old)
+                    counts['removed'] += 1
+                    old = next(old_reader, None)
+                elif old is None or new[k] < old[k]:
+                    writers['added'].writerow(new)
+                    counts['added'] += 1
+                    new = next(new_reader, None)
+                else:
+                    if old != new:
+                        writers['modified'].writerow(new)
+                        if REPLACED in writers:
+                            writers[REPLACED].writerow(old)
+                        counts['modified'] += 1
+                    else:
+                        counts['unchanged'] += 1
+                    old = next(old_reader, None)
+                    new = next(new_reader, None)
+        finally:
+            for f in files.values():
+                f.close()
+
+    logger.info("Listing changes: %s" % counts)
+    return counts
+
+
+def read_changes(change_csvs, kinds=CHANGE_KINDS):
+    """
+    Yields (kind, row) for every change, with each row as a dict.
+    """
+    for kind in kinds:
+        with open(change_csvs[kind], 'r', newline='') as fin:
+            for row in csv.DictReader(fin):
+                yield kind, row
@@ -0,0 +1,105 @@
+import os
+import csv
+import datetime
+import tempfile
+import tasks.common
+from tasks.analyse.hdfs_delta import sort_listing, diff_listings, read_changes
+from tasks.analyse.hdfs_analysis import ListParsedPaths, ListHDFSFileListChanges, ListEmptyFiles, ListDuplicateFiles
+from tasks.analyse.hdfs_reports import GenerateHDFSReports
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test')
+
+
+def _write_rows(path, header, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _read_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_sort_and_diff():
+    header = ['file_path', 'file_size']
+    with tempfile.TemporaryDirectory() as tmp:
+        old = os.path.join(tmp, 'old.csv')
+        new = os.path.join(tmp, 'new.csv')
+        _write_rows(old, header, [['/e', '5'], ['/a', '1'], ['/c', '3'], ['/b', '2']])
+        _write_rows(new, header, [['/d', '4'], ['/c', '30'], ['/a', '1'], ['/f', '6']])
+        for path in [old, new]:
+            # Small runs, so the sorted runs have to be merged:
+            assert sort_listing(path, path + '.sorted', run_size=2) == 4
+        assert _read_rows(old + '.sorted') == [header, ['/a', '1'], ['/b', '2'], ['/c', '3'], ['/e', '5']]
+
+        changes = dict((kind, os.path.join(tmp, '%s.csv' % kind)) for kind in ['added', 'removed', 'modified'])
+        counts = diff_listings(old + '.sorted', new + '.sorted', changes)
+        assert counts == {'added': 2, 'removed': 2, 'modified': 1, 'unchanged': 1}
+        assert [(kind, row['file_path'], row['file_size']) for kind, row in read_changes(changes)] == [
+            ('added', '/d', '4'), ('added', '/f', '6'),
+            ('removed', '/b', '2'), ('removed', '/e', '5'),
+            ('modified', '/c', '30')]
+
+
+def _parse_for(date, rows, header):
+    # Put a parsed listing in place, as if ListParsedPaths had run on that date:
+    task = ListParsedPaths(date)
+    _write_rows(task.output().path, header, rows)
+    _write_rows(task.dated_state_file().path, ['lines'], [[len(rows)]])
+
+
+def test_incremental_matches_full(monkeypatch):
+    rows = _read_rows(os.path.join(TEST_DIR, 'hdfs-path-parser-parsed.csv'))
+    header, rows = rows[0], rows[1:]
+    size = header.index('file_size')
+    path = header.index('file_path')
+    name = header.index('file_name')
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(tasks.common, 'LOCAL_STATE_FOLDER', tmp)
+        day1 = datetime.date(2019, 8, 1)
+        day2 = datetime.date(2019, 8, 2)
+
+        # Day one has nothing to compare with:
+        _parse_for(day1, rows, header)
+        ListHDFSFileListChanges(day1).run()
+        for task_class in [ListEmptyFiles, ListDuplicateFiles]:
+            task_class(day1, incremental=True).run()
+        GenerateHDFSReports(day1, incremental=True).update_totals()
+
+        # Day two removes some files, empties some, and adds some copies with the same names:
+        changed = [list(r) for r in rows[5:]]
+        for r in changed[:4]:
+            r[size] = '0'
+        for r in rows[:3]:
+            copy = list(r)
+            copy[path] = '/copies/%s' % r[name]
+            changed.append(copy)
+        _parse_for(day2, changed, header)
+        ListHDFSFileListChanges(day2).run()
+        incremental = {}
+        for task_class in [ListEmptyFiles, ListDuplicateFiles]:
+            task = task_class(day2, incremental=True)
+            assert task.changes_to_apply() is not None
+            task.run()
+            with task.output().open('r') as f:
+                incremental[task_class] = sorted(f.readlines())
+        report = GenerateHDFSReports(day2, incremental=True)
+        assert report.changes_to_apply() is not None
+        incremental_totals = report.update_totals()
+        with ListHDFSFileListChanges(day2).output().open('r') as f:
+            assert '"previous": "2019-08-01"' in f.read()
+
+        # Processing the whole listing gives the same results:
+        for task_class in [ListEmptyFiles, ListDuplicateFiles]:
+            task = task_class(day2)
+            task.run()
+            with task.output().open('r') as f:
+                assert sorted(f.readlines()) == incremental[task_class]
+        totals = GenerateHDFSReports(day2).update_totals()
+        assert incremental_totals == totals
+        assert sum(count for size, count in totals.values()) == len(changed)
+        assert len(incremental[ListDuplicateFiles]) > 0
+        assert len(incremental[ListEmptyFiles]) > 4
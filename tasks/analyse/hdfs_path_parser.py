@@ -0,0 +1,361 @@
+import os
+import io
+import re
+import csv
+import enum
+import logging
+import datetime
+import functools
+import multiprocessing
+
+logger = logging.getLogger('luigi-interface')
+
+"""
+Classifies the paths in the HDFS file listing, working out which collection, crawl stream, job etc. each file belongs
+to.
+
+Each known file layout lives under a distinct top-level folder, so the leading path segment is used to pick which
+patterns to try, and the classification of each parent directory is remembered, as every file in a folder is
+classified the same way. Large listings are split into shards and parsed on multiple processes.
+"""
+
+# Expected headers for the raw HDFS file list CSV, see ListAllFilesOnHDFSToLocalFile
+FILE_LIST_HEADERS = ['permissions', 'number_of_replicas', 'userid', 'groupid', 'filesize', 'modified_at', 'filename']
+
+
+class CrawlStream(enum.Enum):
+    """
+    An enumeration of the different crawl streams.
+    """
+
+    selective = 1
+    """'selective' is permissions-based collection. e.g. Pre-NPLD collections."""
+
+    frequent = 2
+    """ 'frequent' covers NPLD crawls of curated sites."""
+
+    domain = 3
+    """ 'domain' refers to NPLD domain crawls."""
+
+    def __str__(self):
+        return self.name
+
+
+# Selective era layout /data/<target-id>/<instance-id>/<kind>
+RE_WCT = re.compile(r'^/data/([0-9]+)/([0-9]+)/(DLX/|Logs/|WARCS/|)([^\/]+)$')
+# First NPLD era file layout /heritrix/output/(warcs|viral|logs)/<job>...
+RE_NPLD_2013 = re.compile(r'^/heritrix/output/(warcs|viral|logs)/.*')
+# Original domain-crawl layout: kind/job (need to look for this first)
+RE_NPLD_2013_DC = re.compile(r'^/heritrix/output/(warcs|viral|logs)/(dc|crawl)[0-3]\-([0-9]{8}|[0-9]{14})/([^\/]+)$')
+# original frequent crawl layout: kind/job/launch-id
+RE_NPLD_2013_FC = re.compile(r'^/heritrix/output/(warcs|viral|logs)/([a-z\-0-9]+)[-/]([0-9]{12,14})/([^\/]+)$')
+# Second NPLD era file layout /heritrix/output/<job>/<launch>(warcs|viral|logs)/...
+RE_NPLD_2018 = re.compile(r'^/heritrix/output/(dc2.+|frequent.*)/.*')
+# 2019 frequent-crawl layout: job/launch-id/kind (same as DC now?
+RE_NPLD_2018_FC = re.compile(r'^/heritrix/output/([a-z\-0-9]+)/([0-9]{12,14})[^/]*/(warcs|viral|logs)/([^\/]+)$')
+# Files that should be considered important data and eventually archived.
+RE_NPLD_PROJECT = re.compile(r'^/1_data/npld/([a-z\-_0-9]+)/([a-z\-_0-9]+)/(warcs|viral|logs)/([^\/]+)$')
+# WARC filenames with a fine-grained timestamp:
+RE_WARC_TIMESTAMP = re.compile(r'^.*-([12][0-9]{16})-.*\.warc\.gz$')
+
+
+class DirectoryClass(object):
+    """
+    The classification shared by all the files in one directory.
+    """
+    __slots__ = ['recognised', 'collection', 'stream', 'layout', 'job', 'launch', 'kind', 'launch_datetime']
+
+    def __init__(self):
+        self.recognised = False
+        # None means 'use the top-level folder':
+        self.collection = None
+        self.stream = None
+        self.layout = None
+        self.job = None
+        self.launch = None
+        self.kind = 'unknown'
+        self.launch_datetime = None
+
+
+def _classify_wct(file_path, c):
+    c.layout = 'wct'
+    c.collection = 'selective'
+    c.stream = CrawlStream.selective
+    mby = RE_WCT.search(file_path)
+    if mby:
+        c.recognised = True
+        # In this case the job is the Target ID and the launch is the Instance ID:
+        (c.job, c.launch, c.kind, _) = mby.groups()
+        c.kind = c.kind.lower().strip('/')
+        if c.kind == '':
+            c.kind = 'unknown'
+        c.launch_datetime = None
+        return True
+    # Fall back on the top-level folder:
+    c.collection = None
+    return False
+
+
+def _classify_heritrix(file_path, c):
+    if RE_NPLD_2013.search(file_path):
+        c.layout = 'npld-2013'
+        c.collection = 'npld'
+        mdc = RE_NPLD_2013_DC.search(file_path)
+        mfc = RE_NPLD_2013_FC.search(file_path)
+        if mdc:
+            c.recognised = True
+            c.stream = CrawlStream.domain
+            (c.kind, c.job, c.launch, _) = mdc.groups()
+            c.job = 'dc%s' % c.launch[0:4] # Overriding old job name.
+            # Cope with variation in folder naming - all DC crawlers run as a single launch on the same day:
+            if len(c.launch) > 8:
+                c.launch = c.launch[0:8]
+            c.launch_datetime = datetime.datetime.strptime(c.launch, "%Y%m%d")
+            return True
+        elif mfc:
+            c.recognised = True
+            c.stream = CrawlStream.frequent
+            (c.kind, c.job, c.launch, _) = mfc.groups()
+            c.launch_datetime = datetime.datetime.strptime(c.launch, "%Y%m%d%H%M%S")
+            return True
+
+    if RE_NPLD_2018.search(file_path):
+        c.layout = 'npld-2018'
+        c.collection = 'npld'
+        mfc2 = RE_NPLD_2018_FC.search(file_path)
+        if mfc2:
+            c.recognised = True
+            (c.job, c.launch, c.kind, _) = mfc2.groups()
+            # Recognise domain crawls:
+            if c.job.startswith('dc2'):
+                c.stream = CrawlStream.domain
+            else:
+                c.stream = CrawlStream.frequent
+            # Parse a launch datetime
+            c.launch_datetime = datetime.datetime.strptime(c.launch, "%Y%m%d%H%M%S")
+            return True
+
+    # Fall back on the top-level folder:
+    c.collection = None
+    return False
+
+
+def _classify_project(file_path, c):
+    mf = RE_NPLD_PROJECT.search(file_path)
+    if mf:
+        c.recognised = True
+        (c.stream, c.job, c.kind, _) = mf.groups()
+        c.layout = 'npld-2018-project'
+        c.collection = 'npld'
+        return True
+    return False
+
+
+def _classify_to_be_deleted(file_path, c):
+    c.recognised = True
+    c.kind = 'to-be-deleted'
+    # N.B. the collection is not set for these:
+    c.collection = False
+    return True
+
+
+# Which classifier to use, based on the leading path segment:
+CLASSIFIERS = {
+    'data': _classify_wct,
+    'heritrix': _classify_heritrix,
+    '1_data': _classify_project,
+    '_to_be_deleted': _classify_to_be_deleted,
+}
+
+
+@functools.lru_cache(maxsize=100000)
+def classify_directory(dir_path):
+    """
+    Classifies all the files in a given directory.
+
+    All the patterns only look at the directory part of the path, so they are run against a placeholder file name.
+    """
+    c = DirectoryClass()
+    top = dir_path.split('/', 2)[1] if dir_path.startswith('/') else None
+    classifier = CLASSIFIERS.get(top, None)
+    if classifier:
+        classifier("%s/x" % dir_path.rstrip('/'), c)
+    return c
+
+
+@functools.lru_cache(maxsize=10000)
+def _parse_modified_at(modified_at):
+    return datetime.datetime.strptime(modified_at, "%Y-%m-%dT%H:%M:%S")
+
+
+class HdfsPathParser(object):
+    """
+    This class takes a HDFS file path and determines what, if any, crawl it belongs to, etc.
+    """
+
+    @staticmethod
+    def field_names():
+        """This returns the extended set of field names that this class derives from the basic listing."""
+        return ['recognised', 'collection', 'stream','job', 'layout', 'kind', 'permissions', 'number_of_replicas', 'user_id', 'group_id', 'file_size', 'modified_at', 'timestamp', 'file_path', 'file_name', 'file_ext']
+
+    def __init__(self, item):
+        """
+        Given a string containing the absolute HDFS file path, parse it to work our what kind of thing it is.
+
+        Determines crawl job, launch, kind of file, etc.
+
+        For WCT-era selective content, the job is the Target ID and the launch is the Instance ID.
+
+        :param item: dict with the FILE_LIST_HEADERS fields
+        """
+        # From the item listing:
+        self.permissions = item['permissions']
+        self.number_of_replicas = item['number_of_replicas']
+        self.user_id = item['userid']
+        self.group_id = item['groupid']
+        self.file_size = item['filesize']
+        self.modified_at = item['modified_at']
+        self.file_path = item['filename']
+        # Derived:
+        self.file_name = os.path.basename(self.file_path)
+        first_dot_at = self.file_name.find('.')
+        if first_dot_at != -1:
+            self.file_ext = self.file_name[first_dot_at:]
+        else:
+            self.file_ext = None
+        self.timestamp_datetime = _parse_modified_at(item['modified_at'])
+        self.timestamp = self.timestamp_datetime.isoformat()
+
+        # Look up the classification of the parent directory:
+        # ------------------------------------------------
+        self.analyse_file_path()
+
+        # Now Add data based on file kind and file name...
+        # ------------------------------------------------
+
+        # Distinguish 'bad' crawl files, e.g. warc.gz.open files that are down as warcs
+        if self.kind == 'warcs':
+            if not self.file_name.endswith(".warc.gz"):
+                # The older selective crawls allowed CDX files alongside the WARCs:
+                if self.collection == 'selective' and self.file_name.endswith(".warc.cdx"):
+                    self.kind = 'cdx'
+                else:
+                    self.kind = 'warcs-invalid'
+            else:
+                # Attempt to parse file timestamp out of filename,
+                # Store ISO formatted date in self.timestamp, datetime object in self.timestamp_datetime
+                mwarc = RE_WARC_TIMESTAMP.search(self.file_name)
+                if mwarc:
+                    self.timestamp_datetime = datetime.datetime.strptime(mwarc.group(1), "%Y%m%d%H%M%S%f")
+                    self.timestamp = self.timestamp_datetime.isoformat()
+                else:
+                    if self.stream and self.launch_datetime:
+                        # fall back on launch datetime:
+                        self.timestamp_datetime = self.launch_datetime
+                        self.timestamp = self.timestamp_datetime.isoformat()
+
+        # Distinguish crawl logs from other logs...
+        if self.kind == 'logs':
+            if self.file_name.startswith("crawl.log"):
+                self.kind = 'crawl-logs'
+
+    def analyse_file_path(self):
+        """
+        This function classifies the item, based on the (memoised) classification of its directory.
+        """
+        dir_path, file_name = os.path.split(self.file_path)
+        if file_name:
+            c = classify_directory(dir_path)
+        else:
+            # Not a usual file path, so classify it directly:
+            c = DirectoryClass()
+            classifier = CLASSIFIERS.get(self.file_path.split('/', 2)[1], None)
+            if classifier:
+                classifier(self.file_path, c)
+        self.recognised = c.recognised
+        self.stream = c.stream
+        self.layout = c.layout
+        self.job = c.job
+        self.launch = c.launch
+        self.kind = c.kind
+        self.launch_datetime = c.launch_datetime
+        if c.collection is None:
+            # If un-matched, default to classifying by top-level folder:
+            self.collection = self.file_path.split(os.path.sep)[1]
+        elif c.collection is False:
+            self.collection = None
+        else:
+            self.collection = c.collection
+
+    def to_dict(self):
+        d = dict()
+        for f in self.field_names():
+            d[f] = str(getattr(self,f,""))
+        return d
+
+    def to_row(self):
+        return [str(getattr(self, f, "")) for f in self.field_names()]
+
+
+def _parse_rows(rows):
+    """
+    Parses a shard of rows from the file list, returning the CSV output for them.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out)
+    count = 0
+    for row in rows:
+        item = dict(zip(FILE_LIST_HEADERS, row))
+        # Skip the header line:
+        if item['filesize'] == 'filesize':
+            continue
+        writer.writerow(HdfsPathParser(item).to_row())
+        count += 1
+    return out.getvalue(), count
+
+
+def _shards(reader, shard_size):
+    shard = []
+    for row in reader:
+        shard.append(row)
+        if len(shard) >= shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def parse_file_list(file_list_csv, parsed_files_csv, processes=None, shard_size=50000):
+    """
+    Parses the whole HDFS file list, writing the classified version out in the same order.
+
+    :param processes: how many processes to use (defaults to the number of CPUs, 1 means parse in this process)
+    :param shard_size: how many rows to send to a process at a time
+    :return: the number of rows parsed
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    lines = 0
+    with open(parsed_files_csv, 'w', newline='') as fout, open(file_list_csv, 'r', newline='') as fin:
+        # Set up output file:
+        writer = csv.writer(fout)
+        writer.writerow(HdfsPathParser.field_names())
+        shards = _shards(csv.reader(fin), shard_size)
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            # N.B. imap returns the results in the original order:
+            results = pool.imap(_parse_rows, shards)
+        else:
+            pool = None
+            results = map(_parse_rows, shards)
+        try:
+            for text, count in results:
+                fout.write(text)
+                lines += count
+                logger.info("Processed %i lines..." % lines)
+        finally:
+            if pool:
+                pool.terminate()
+
+    logger.info("Done. Processed a total of %i lines." % lines)
+    return lines
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from tasks.analyse.hdfs_path_parser import parse_file_list, HdfsPathParser
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test')
+
+
+def test_path_parser_layouts():
+    # Covers each layout (wct, npld-2013, npld-2018, npld-2018-project, to-be-deleted and unrecognised).
+    # The expected output was generated by the original notebook-based parser:
+    with open(os.path.join(TEST_DIR, 'hdfs-path-parser-parsed.csv'), 'rb') as f:
+        expected = f.read()
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'parsed.csv')
+        for processes in [1, 3]:
+            lines = parse_file_list(os.path.join(TEST_DIR, 'hdfs-path-parser-list.csv'), out,
+                                    processes=processes, shard_size=4)
+            assert lines == 35
+            with open(out, 'rb') as f:
+                assert f.read() == expected
+
+
+def test_path_parser_parallel_order():
+    file_list = os.path.join(TEST_DIR, 'task-state/hdfs/current/current-hdfs-all-files-list.csv')
+    with tempfile.TemporaryDirectory() as tmp:
+        serial = os.path.join(tmp, 'serial.csv')
+        parallel = os.path.join(tmp, 'parallel.csv')
+        assert parse_file_list(file_list, serial, processes=1) == 2000
+        assert parse_file_list(file_list, parallel, processes=4, shard_size=100) == 2000
+        with open(serial, 'rb') as s, open(parallel, 'rb') as p:
+            assert s.read() == p.read()
+
+
+def test_path_parser_item():
+    p = HdfsPathParser({
+        'permissions': '-rw-r--r--', 'number_of_replicas': '3', 'userid': 'heritrix', 'groupid': 'supergroup',
+        'filesize': '100', 'modified_at': '2019-08-03T11:19:00',
+        'filename': '/heritrix/output/dc2019/20190524120000/warcs/BL-20190524120000001-00001-1~h3w~8443.warc.gz'})
+    d = p.to_dict()
+    assert d['layout'] == 'npld-2018'
+    assert d['stream'] == 'domain'
+    assert d['job'] == 'dc2019'
+    assert d['timestamp'] == '2019-05-24T12:00:00.001000'
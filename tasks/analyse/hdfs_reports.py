@@ -1,82 +1,141 @@
+import os
+import csv
 import luigi
-import datetime
+import logging
 import pandas as pd
-from tasks.analyse.hdfs_analysis import ListParsedPaths
+from tasks.common import state_file
+from tasks.analyse.hdfs_analysis import IncrementalListingTask
+from tasks.analyse.hdfs_delta import CHANGE_KINDS, REPLACED, read_changes
 from tasks.analyse.data_formatters import humanbytes
 from tasks.preserve.hdfs_scan_status import GatherBlockScanReports
 from lib.targets import ReportTarget, AccessTaskDBTarget
 
+logger = logging.getLogger('luigi-interface')
 
-class GenerateHDFSReports(luigi.Task):
+# The columns the reports are built from, i.e. the size and number of files of each kind, per stream and month:
+TOTALS_KEY = ['collection', 'stream', 'kind', 'month']
+TOTALS_FIELDS = TOTALS_KEY + ['file_size', 'file_count']
+
+
+def totals_key(item):
+    return tuple(item[field] for field in TOTALS_KEY[:3]) + (item['timestamp'][0:7],)
+
+
+def add_to_totals(totals, item, sign=1):
+    size, count = totals.get(totals_key(item), (0, 0))
+    totals[totals_key(item)] = (size + sign * int(item['file_size']), count + sign)
+
+
+class GenerateHDFSReports(IncrementalListingTask):
     """
     Generate a set of reports based on HDFS content
-    """
-    date = luigi.DateParameter(default=datetime.date.today())
 
+    The reports are built from the total size and number of files of each kind in each month, which is kept. In
+    incremental mode, the day's changes are applied to those totals rather than adding up the whole listing again.
+    """
     task_namespace = "analyse.report"
+    state_name = 'hdfs-report-totals'
 
     def requires(self):
         return {
-            'paths' : ListParsedPaths(self.date),
+            'paths': super(GenerateHDFSReports, self).requires(),
             'scans': GatherBlockScanReports(self.date)
         }
 
     def output(self):
         return AccessTaskDBTarget(self.task_namespace, self.task_id)
 
+    @staticmethod
+    def state():
+        return state_file('current', 'hdfs', 'hdfs-report-totals.csv')
+
+    def changes_to_apply(self):
+        changes = super(GenerateHDFSReports, self).changes_to_apply()
+        # The old versions of modified files are needed too, to take them out of the totals:
+        if changes is not None and not os.path.exists(changes[REPLACED]):
+            logger.warning("No record of the modified files in %s, so processing the whole listing." % (
+                changes[REPLACED]))
+            return None
+        return changes
+
+    def update_totals(self):
+        totals = {}
+        changes = self.changes_to_apply()
+        if changes is None:
+            with self.full_listing().open('r') as fin:
+                for item in csv.DictReader(fin):
+                    add_to_totals(totals, item)
+        else:
+            with self.state().open('r') as fin:
+                for item in csv.DictReader(fin):
+                    totals[tuple(item[field] for field in TOTALS_KEY)] = (int(item['file_size']),
+                                                                           int(item['file_count']))
+            for kind, item in read_changes(changes, kinds=CHANGE_KINDS + [REPLACED]):
+                add_to_totals(totals, item, sign=-1 if kind in ['removed', REPLACED] else 1)
+            # Drop anything that has gone altogether:
+            totals = dict((key, value) for key, value in totals.items() if value[1] != 0)
+
+        # Keep the totals, to apply the next changes to:
+        with self.state().open('w') as fout:
+            writer = csv.writer(fout)
+            writer.writerow(TOTALS_FIELDS)
+            for key in sorted(totals):
+                writer.writerow(key + totals[key])
+        self.record_state()
+        return totals
+
     def run(self):
-        # Set up the input file:
-        with self.input()['paths'].open('r') as fin:
-            df = pd.read_csv(fin)
-            # Interpret timestamp as a date:
-            df.timestamp = pd.to_datetime(df.timestamp)
-            # Ignore the to-be-deleted data:
-            df = df.loc[df['kind'] != 'to-be-deleted']
-
-            # Write out the per-collection report:
-            out = ReportTarget('content/reports/hdfs', 'total-file-size-by-stream.csv')
-            with out.open('w') as f_out:
-                # Pandas query:
-                df2 = df.groupby([df.collection, df.stream, df.timestamp.dt.year, df.kind]).file_size.sum().unstack()
-                # Output the result as CSV:
-                df2.to_csv(f_out,float_format="%.0f")
-            # Now the same but as file counts:
-            out = ReportTarget('content/reports/hdfs', 'total-file-count-by-stream.csv')
-            with out.open('w') as f_out:
-                # Pandas query:
-                df2 = df.groupby([df.collection, df.stream, df.timestamp.dt.year, df.kind]).file_size.count().unstack()
-                # Output the result as CSV:
-                df2.to_csv(f_out,float_format="%.0f")
-
-            # Focus on NPLD:
-            np = df.loc[df.collection == 'npld'].loc[df.kind.isin(['warcs', 'crawl-logs', 'viral'])].reset_index()
-
-            # NPLD By year, humanbytes:
-            out = ReportTarget('content/reports/hdfs', 'npld-total-file-size-by-stream-per-year.csv')
-            with out.open('w') as f_out:
-                npsy = np.groupby([np.timestamp.dt.year, np.stream]).file_size.sum().apply(humanbytes).unstack()
-                npsy.to_csv(f_out)
-
-            # NPLD By month:
-            out = ReportTarget('content/reports/hdfs', 'npld-total-file-size-by-stream-per-month.csv')
-            with out.open('w') as f_out:
-                npsm = np.groupby([np.timestamp.dt.to_period('M'), np.stream]).file_size.sum().reset_index()
-                npsm.to_csv(f_out,float_format="%.0f", na_rep=0,index=False)
-
-            # NPLD Total:
-            out = ReportTarget('content/reports/hdfs', 'npld-total-file-size-by-stream-totals.csv')
-            with out.open('w') as f_out:
-                totals = np.groupby(np.stream).file_size.sum().reset_index()
-                totals = totals.append({'stream': 'total', 'file_size': totals.file_size.sum()}, ignore_index=True)
-                totals.file_size = totals.file_size.apply(humanbytes)
-                totals = totals.set_index('stream')
-                # Same for counts rather than size totals:
-                counts = np.groupby(np.stream).file_size.count().reset_index().rename(columns={'file_size': 'file_count'})
-                counts = counts.append({'stream': 'total', 'file_count': counts.file_count.sum()}, ignore_index=True)
-                counts = counts.set_index('stream')
-                # Join the two together into a single table and output:
-                totals = totals.join(counts)
-                totals.to_csv(f_out)
+        totals = self.update_totals()
+        df = pd.DataFrame([key + totals[key] for key in totals], columns=TOTALS_FIELDS)
+        # Interpret the month as a date (named 'timestamp', as that is what the reports call it):
+        df['timestamp'] = pd.to_datetime(df.month)
+        # Ignore the to-be-deleted data:
+        df = df.loc[df['kind'] != 'to-be-deleted']
+
+        # Write out the per-collection report:
+        out = ReportTarget('content/reports/hdfs', 'total-file-size-by-stream.csv')
+        with out.open('w') as f_out:
+            # Pandas query:
+            df2 = df.groupby([df.collection, df.stream, df.timestamp.dt.year, df.kind]).file_size.sum().unstack()
+            # Output the result as CSV:
+            df2.to_csv(f_out,float_format="%.0f")
+        # Now the same but as file counts:
+        out = ReportTarget('content/reports/hdfs', 'total-file-count-by-stream.csv')
+        with out.open('w') as f_out:
+            # Pandas query:
+            df2 = df.groupby([df.collection, df.stream, df.timestamp.dt.year, df.kind]).file_count.sum().unstack()
+            # Output the result as CSV:
+            df2.to_csv(f_out,float_format="%.0f")
+
+        # Focus on NPLD:
+        np = df.loc[df.collection == 'npld'].loc[df.kind.isin(['warcs', 'crawl-logs', 'viral'])].reset_index()
+
+        # NPLD By year, humanbytes:
+        out = ReportTarget('content/reports/hdfs', 'npld-total-file-size-by-stream-per-year.csv')
+        with out.open('w') as f_out:
+            npsy = np.groupby([np.timestamp.dt.year, np.stream]).file_size.sum().apply(humanbytes).unstack()
+            npsy.to_csv(f_out)
+
+        # NPLD By month:
+        out = ReportTarget('content/reports/hdfs', 'npld-total-file-size-by-stream-per-month.csv')
+        with out.open('w') as f_out:
+            npsm = np.groupby([np.timestamp.dt.to_period('M'), np.stream]).file_size.sum().reset_index()
+            npsm.to_csv(f_out,float_format="%.0f", na_rep=0,index=False)
+
+        # NPLD Total:
+        out = ReportTarget('content/reports/hdfs', 'npld-total-file-size-by-stream-totals.csv')
+        with out.open('w') as f_out:
+            totals = np.groupby(np.stream).file_size.sum().reset_index()
+            totals = totals.append({'stream': 'total', 'file_size': totals.file_size.sum()}, ignore_index=True)
+            totals.file_size = totals.file_size.apply(humanbytes)
+            totals = totals.set_index('stream')
+            # Same for counts rather than size totals:
+            counts = np.groupby(np.stream).file_count.sum().reset_index()
+            counts = counts.append({'stream': 'total', 'file_count': counts.file_count.sum()}, ignore_index=True)
+            counts = counts.set_index('stream')
+            # Join the two together into a single table and output:
+            totals = totals.join(counts)
+            totals.to_csv(f_out)
 
         # Tag all as done:
         self.output().touch()
@@ -19,7 +19,9 @@ import json
 import luigi
 import logging
 from tasks.crawl.w3act import CrawlFeed
+from tasks.common import state_file
 from lib.targets import IngestTaskDBTarget
+from lib.launch_schedule import LaunchSchedule
 from prometheus_client import CollectorRegistry, Gauge
 from crawlstreams import enqueue
 
@@ -72,9 +74,38 @@ class UpdateScopeFiles(luigi.Task):
                         f.write("%s\n" % seed)
 
 
+class CompileLaunchSchedule(luigi.Task):
+    """
+    Compiles the schedules in a crawl feed into slots by hour, so the hourly launcher only has to look up what is due.
+
+    W3ACT is only exported once a day, so this is keyed on the date rather than the hour, and is compiled once from
+    each day's export.
+    """
+    task_namespace = 'crawl'
+    frequency = luigi.Parameter(default='all')
+    date = luigi.DateParameter(default=datetime.date.today())
+
+    def requires(self):
+        return CrawlFeed(frequency=self.frequency, date=datetime.datetime.combine(self.date, datetime.time()))
+
+    def output(self):
+        # Kept next to the day's feed:
+        return state_file(self.date, 'w3act-csv', 'crawl-feed-npld.%s.schedule.json' % self.frequency)
+
+    def run(self):
+        # Load the targets:
+        with self.input().open() as f:
+            all_targets = json.load(f)
+
+        logger.info("Compiling the launch schedule for %i targets..." % len(all_targets))
+        schedule = LaunchSchedule.compile(all_targets)
+        with self.output().temporary_path() as temp_output_path:
+            schedule.save(temp_output_path)
+
+
 class LaunchCrawls(luigi.Task):
     """
-    Get the lists of all targets from the crawl feed and launch those that need launching.
+    Get the compiled launch schedule for the crawl feed and launch the targets that are due this hour.
     """
     task_namespace = 'crawl'
     frequency = luigi.Parameter(default='all')
@@ -88,19 +119,22 @@ class LaunchCrawls(luigi.Task):
     target_errors = 0
 
     def requires(self):
-        # Get the crawl feed of interest:
-        return CrawlFeed(frequency=self.frequency, date=self.date)
+        # The schedule only changes when the daily export does:
+        return CompileLaunchSchedule(frequency=self.frequency, date=self.date.date())
 
     def output(self):
         return IngestTaskDBTarget('crawl', self.task_id)
 
     def run(self):
-        # Load the targets:
-        with self.input().open() as f:
-            all_targets = json.load(f)
+        # Load the schedule:
+        schedule = LaunchSchedule.load(self.input().path)
 
-        # Grab detailed target data:
-        logger.info("Filtering detailed information for %i targets..." % len(all_targets))
+        # Report any problems spotted when compiling it:
+        for tid in schedule.errors:
+            logger.error("This target has no seeds! tid: %d" % tid)
+        self.target_errors = len(schedule.errors)
+        for tid, frequency in schedule.unknown:
+            logger.error("Don't understand crawl frequency %s (tid: %d)" % (frequency, tid))
 
         # Set up launcher:
         self.launcher = enqueue.KafkaLauncher(kafka_server=self.kafka_server, topic=self.queue)
@@ -109,90 +143,10 @@ class LaunchCrawls(luigi.Task):
         now = self.date
         logger.debug("Now timestamp: %s" % str(now))
 
-        # Process looking for due:
+        # Launch whatever is due:
         self.i_launches = 0
-        for t in all_targets:
-            logger.debug("----------")
-            logger.debug("Looking at %s (tid:%d)" % (t['title'], t['id']))
-
-            # Look out for problems:
-            if len(t['seeds']) == 0:
-                logger.error("This target has no seeds! tid: %d" % t['id'])
-                self.target_errors += 1
-                continue
-
-            # Add a source tag if this is a watched target:
-            source = "tid:%d:%s" % (t['id'], t['seeds'][0])
-
-            # Check the scheduling:
-            for schedule in t['schedules']:
-                # Skip if target schedule outside of start/end range
-                if schedule['startDate']:
-                    startDate = datetime.datetime.strptime(schedule['startDate'], "%Y-%m-%d %H:%M:%S")
-                    logger.debug("Target schedule start date: %s" % str(startDate))
-                    if (now < startDate):
-                        logger.debug("Start date %s not yet reached" % startDate)
-                        continue
-                else:
-                    logger.debug("Skipping target schedule start date: %s" % schedule['startDate'])
-                    continue
-                endDate = 'N/S'
-                if schedule['endDate']:
-                    endDate = datetime.datetime.strptime(schedule['endDate'], "%Y-%m-%d %H:%M:%S")
-                    if now > endDate:
-                        logger.debug("End date %s passed" % endDate)
-                        continue
-                logger.debug("Target schedule end date:  %s" % str(endDate))
-                logger.debug("Target frequency: %s" % schedule['frequency'])
-
-                # Check if the frequency and date match up:
-                if schedule['frequency'] == "DAILY":
-                    self.launch_by_hour(now, startDate, endDate, t, source, 'DAILY')
-
-                elif schedule['frequency'] == "WEEKLY":
-                    if now.isoweekday() == startDate.isoweekday():
-                        self.launch_by_hour(now, startDate, endDate, t, source, 'WEEKLY')
-                    else:
-                        logger.debug("WEEKLY: isoweekday %s differs from schedule %s" % (
-                            now.isoweekday(), startDate.isoweekday()))
-
-                elif schedule['frequency'] == "MONTHLY":
-                    if now.day == startDate.day:
-                        self.launch_by_hour(now, startDate, endDate, t, source, 'MONTHLY')
-                    else:
-                        logger.debug("MONTHLY: date %s does not match schedule %s" % (
-                            now, startDate))
-                        logger.debug("MONTHLY: day %s differs from schedule %s" % (now.day, startDate.day))
-
-                elif schedule['frequency'] == "QUARTERLY":
-                    if now.day == startDate.day and now.month % 3 == startDate.month % 3:
-                        self.launch_by_hour(now, startDate, endDate, t, source, 'QUARTERLY')
-                    else:
-                        logger.debug("QUARTERLY: date %s does not match schedule %s" % (
-                            now, startDate))
-                        logger.debug(
-                            "QUARTERLY: month3 %s versus schedule %s" % (now.month % 3, startDate.month % 3))
-
-                elif schedule['frequency'] == "SIXMONTHLY":
-                    if now.day == startDate.day and now.month % 6 == startDate.month % 6:
-                        self.launch_by_hour(now, startDate, endDate, t, source, 'SIXMONTHLY')
-                    else:
-                        logger.debug("SIXMONTHLY: date %s does not match schedule %s" % (
-                            now, startDate))
-                        logger.debug(
-                            "SIXMONTHLY: month6 %s versus schedule %s" % (now.month % 6, startDate.month % 6))
-
-                elif schedule['frequency'] == "ANNUAL":
-                    if now.day == startDate.day and now.month == startDate.month:
-                        self.launch_by_hour(now, startDate, endDate, t, source, 'ANNUAL')
-                    else:
-                        logger.debug("ANNUAL: date %s does not match schedule %s" % (
-                            now, startDate))
-                        logger.debug("ANNUAL: month %s versus schedule %s" % (now.month, startDate.month))
-                elif schedule['frequency'] == "DOMAINCRAWL":
-                    logger.debug("Skipping crawl frequency " + schedule['frequency'])
-                else:
-                    logger.error("Don't understand crawl frequency " + schedule['frequency'])
+        for t, frequency, startDate, endDate in schedule.due(now):
+            self.launch(now, startDate, endDate or 'N/S', t, frequency)
 
         logger.info("Closing the launcher to ensure everything is pushed to Kafka...")
         self.launcher.flush()
@@ -215,45 +169,25 @@ class LaunchCrawls(luigi.Task):
                   labelnames=['stream'], registry=registry)
         g.labels(stream=self.frequency).set(self.target_errors)
 
-    def launch_by_hour(self, now, startDate, endDate, t, source, freq):
-        # Is it the current hour?
-        if now.hour is startDate.hour:
-            logger.info(
-                "%s target %s (tid: %s) scheduled to crawl (now: %s, start: %s, end: %s), sending to FC-3-uris-to-crawl" % (
-                freq, t['title'], t['id'], now, startDate, endDate))
-            counter = 0
-            for seed in t['seeds']:
-                # Assume all are true seeds, which will over-crawl where sites have aliases that are being treated as seeds.
-                # TODO Add handling of aliases
-                isSeed = True
-
-                # Set-up sheets
-                sheets = []
-
-                # Robots.txt
-                if t['ignoreRobotsTxt']:
-                    sheets.append('ignoreRobots')
-                # Scope
-                if t['scope'] == 'subdomains':
-                    sheets.append('subdomainsScope')
-                elif t['scope'] == 'plus1Scope':
-                    sheets.append('plus1Scope')
-                # Limits
-                if t['depth'] == 'CAPPED_LARGE':
-                    sheets.append('higherLimit')
-                elif t['depth'] == 'DEEP':
-                    sheets.append('noLimit')
-
-                # Set up the launch_ts: (Should be startDate but if that happens to be in the future this will all break)
-                launch_timestamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(time.mktime(now.timetuple())))
-
-                # And send launch message, always resetting any crawl quotas:
-                self.launcher.launch(seed, source, isSeed, forceFetch=True, sheets=sheets, reset_quotas=True, launch_ts=launch_timestamp, inherit_launch_ts=False)
-                counter = counter + 1
-                self.i_launches = self.i_launches + 1
-
-        else:
-            logger.debug("The hour (%s) is not current." % startDate.hour)
+    def launch(self, now, startDate, endDate, t, freq):
+        logger.info(
+            "%s target %s (tid: %s) scheduled to crawl (now: %s, start: %s, end: %s), sending to FC-3-uris-to-crawl" % (
+            freq, t['title'], t['id'], now, startDate, endDate))
+
+        # Add a source tag if this is a watched target:
+        source = "tid:%d:%s" % (t['id'], t['seeds'][0])
+
+        # Set up the launch_ts: (Should be startDate but if that happens to be in the future this will all break)
+        launch_timestamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(time.mktime(now.timetuple())))
+
+        for seed in t['seeds']:
+            # Assume all are true seeds, which will over-crawl where sites have aliases that are being treated as seeds.
+            # TODO Add handling of aliases
+            isSeed = True
+
+            # And send launch message, always resetting any crawl quotas:
+            self.launcher.launch(seed, source, isSeed, forceFetch=True, sheets=t['sheets'], reset_quotas=True, launch_ts=launch_timestamp, inherit_launch_ts=False)
+            self.i_launches = self.i_launches + 1
 
 
 if __name__ == '__main__':
@@ -7,6 +7,7 @@ import datetime
 from w3act.w3act import w3act
 from w3act.cli_csv import get_csv, csv_to_zip, load_csv, filtered_targets, to_crawl_feed_format
 from tasks.common import logger, state_file
+from lib.w3act_export import write_export, open_export, load_json
 
 # Define environment variable names here:
 ENV_ACT_URL = 'ACT_URL'
@@ -104,6 +105,37 @@ class GenerateW3actJsonFromCsv(luigi.Task):
             json.dump(all, f_out, indent=2)
 
 
+class GenerateW3actJsonLinesFromCsv(luigi.Task):
+    """
+    This emits the same data as GenerateW3actJsonFromCsv, but split into a JSON Lines file per kind of entity, with
+    an index of where each entity is, so the feeds can load just what they need.
+    """
+    date = luigi.DateParameter(default=datetime.date.today())
+    task_namespace = 'w3act'
+
+    def requires(self):
+        return GetW3actAsCsvZip(self.date)
+
+    def output(self):
+        return state_file(self.date,'w3act-csv','all-split')
+
+    def run(self):
+        # Unpack the CSV:
+        tmp_dir = tempfile.mkdtemp()
+        shutil.unpack_archive(self.input().path, tmp_dir)
+        csv_dir = os.path.join(tmp_dir, 'w3act-db-csv')
+
+        # Write out the split export alongside, then move it into place:
+        out_dir = self.output().path
+        tmp_out_dir = "%s.tmp" % out_dir
+        if os.path.exists(tmp_out_dir):
+            shutil.rmtree(tmp_out_dir)
+        write_export(load_csv(csv_dir), tmp_out_dir)
+        os.rename(tmp_out_dir, out_dir)
+
+        shutil.rmtree(tmp_dir)
+
+
 class CrawlFeed(luigi.Task):
     """
     Get the feed of targets to crawl at a given frequency. Only core metadata per target, and
@@ -115,18 +147,17 @@ class CrawlFeed(luigi.Task):
     date = luigi.DateHourParameter(default=datetime.datetime.today())
 
     def requires(self):
-        return GenerateW3actJsonFromCsv(self.date)
+        return GenerateW3actJsonLinesFromCsv(self.date)
 
     def output(self):
         return state_file(self.date,'w3act-csv', 'crawl-feed-%s.%s.json' % (self.feed, self.frequency))
 
     def run(self):
-        # Load all the data including targets:
-        with self.input().open() as f_in:
-            w3a = json.load(f_in)
+        # Load the targets:
+        w3a = open_export(self.input().path)
 
         # Filter by npld/bypm, crawl dates, and by frequency (all means not NEVERCRAWL?)
-        targets = filtered_targets(w3a['targets'], frequency=self.frequency, terms=self.feed, include_expired=False)
+        targets = filtered_targets(w3a.all('targets'), frequency=self.frequency, terms=self.feed, include_expired=False)
 
         feed = []
         for target in targets:
@@ -149,18 +180,17 @@ class CrawlFeedAllOpenAccess(luigi.Task):
     date = luigi.DateHourParameter(default=datetime.datetime.today())
 
     def requires(self):
-        return GenerateW3actJsonFromCsv(self.date)
+        return GenerateW3actJsonLinesFromCsv(self.date)
 
     def output(self):
         return state_file(self.date, 'w3act-csv', 'crawl-feed-but-all-oa.json')
 
     def run(self):
-        # Load all the data including targets:
-        with self.input().open() as f_in:
-            w3a = json.load(f_in)
+        # Load the targets:
+        w3a = open_export(self.input().path)
 
         # Filter out to all valid OA stuff:
-        targets = filtered_targets(w3a['targets'], frequency='all', terms='oa', include_expired=True, include_hidden=False)
+        targets = filtered_targets(w3a.all('targets'), frequency='all', terms='oa', include_expired=True, include_hidden=False)
 
         feed = []
         for target in targets:
@@ -184,18 +214,17 @@ class CollectionList(luigi.Task):
     date = luigi.DateMinuteParameter(default=datetime.datetime.now())
 
     def requires(self):
-        return GenerateW3actJsonFromCsv(self.date)
+        return GenerateW3actJsonLinesFromCsv(self.date)
 
     def output(self):
         return state_file(self.date,'w3act-collections', 'collections.json')
 
     def run(self):
-        # Load all the data:
-        with self.input().open() as f_in:
-            w3a = json.load(f_in)
+        # Load the collections:
+        w3a = open_export(self.input().path)
 
         # Persist to disk:
-        collections = list(w3a['collections'].values())
+        collections = list(w3a.all('collections').values())
         with self.output().open('w') as f:
             f.write('{}'.format(json.dumps(collections , indent=4)))
 
@@ -210,18 +239,17 @@ class SubjectList(luigi.Task):
     date = luigi.DateMinuteParameter(default=datetime.datetime.now())
 
     def requires(self):
-        return GenerateW3actJsonFromCsv(self.date)
+        return GenerateW3actJsonLinesFromCsv(self.date)
 
     def output(self):
         return state_file(self.date,'w3act-subjects', 'subject-list.json')
 
     def run(self):
-        # Load all the data:
-        with self.input().open() as f_in:
-            w3a = json.load(f_in)
+        # Load the subjects:
+        w3a = open_export(self.input().path)
 
         # Persist to disk:
-        subjects = list(w3a['subjects'].values())
+        subjects = list(w3a.all('subjects').values())
         with self.output().open('w') as f:
             f.write('{}'.format(json.dumps(subjects, indent=4)))
 
@@ -236,18 +264,17 @@ class TargetList(luigi.Task):
     date = luigi.DateParameter(default=datetime.date.today())
 
     def requires(self):
-        return GenerateW3actJsonFromCsv(self.date)
+        return GenerateW3actJsonLinesFromCsv(self.date)
 
     def output(self):
         return state_file(self.date,'w3act-target-list', 'target-list.json')
 
     def run(self):
-        # Load all the data:
-        with self.input().open() as f_in:
-            w3a = json.load(f_in)
+        # Load the targets:
+        w3a = open_export(self.input().path)
 
         # Persist to disk:
-        targets = list(w3a['targets'].values())
+        targets = list(w3a.all('targets').values())
         with self.output().open('w') as f:
             f.write('{}'.format(json.dumps(targets, indent=4)))
 
@@ -270,8 +297,7 @@ class TargetListForFrequency(luigi.Task):
 
     def run(self):
         # Load the targets:
-        with self.input().open() as f:
-            all_targets = json.load(f)
+        all_targets = load_json(self.input().path)
 
         # Grab detailed target data:
         logger.info("Filtering detailed information for %i targets..." % len(all_targets))
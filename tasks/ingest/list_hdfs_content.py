@@ -7,7 +7,6 @@ import gzip
 import shutil
 import logging
 import datetime
-import subprocess
 import papermill as pm
 import luigi
 import luigi.contrib.hdfs
@@ -15,6 +14,7 @@ import luigi.contrib.webhdfs
 from prometheus_client import CollectorRegistry, Gauge
 from tasks.common import state_file
 from lib.targets import CrawlPackageTarget, CrawlReportTarget, ReportTarget, DatedStateFileTask
+from lib.webhdfs import webhdfs, WebHdfsTreeWalker, status_to_ls
 
 logger = logging.getLogger('luigi-interface')
 
@@ -24,7 +24,8 @@ class ListAllFilesOnHDFSToLocalFile(DatedStateFileTask):
     This task lists all files on HDFS (skipping directories).
 
     As this can be a very large list, it avoids reading it all into memory. It
-    parses each line, and creates a CSV line for each.
+    walks the tree over WebHDFS, listing many directories at once, and creates
+    a CSV line for each file.
 
     It set up to run once a day, as input to downstream reporting or analysis processes.
     """
@@ -39,49 +40,35 @@ class ListAllFilesOnHDFSToLocalFile(DatedStateFileTask):
     total_bytes = -1
     total_under_replicated = -1
 
+    # How many directories to list at once:
+    max_workers = luigi.IntParameter(default=16, significant=False)
+
     @staticmethod
     def fieldnames():
         return ['permissions', 'number_of_replicas', 'userid', 'groupid', 'filesize', 'modified_at', 'filename']
 
     def run(self):
-        command = luigi.contrib.hdfs.load_hadoop_cmd()
-        command += ['fs', '-lsr', '/']
         self.total_directories = 0
         self.total_files = 0
         self.total_bytes = 0
         self.total_under_replicated = 0
+        # Set up the listing, which runs over multiple directories at once:
+        walker = WebHdfsTreeWalker(webhdfs(), max_workers=self.max_workers)
         with self.output().open('w') as fout:
             # Set up output file:
             writer = csv.DictWriter(fout, fieldnames=ListAllFilesOnHDFSToLocalFile.fieldnames())
             writer.writeheader()
-            # Set up listing process
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
-            for line in iter(process.stdout.readline, ''):
-                if "lsr: DEPRECATED: Please use 'ls -R' instead." in line:
-                    logger.warning(line)
+            for parent_path, status in walker.walk('/'):
+                # Skip directories:
+                if status['type'] != 'DIRECTORY':
+                    self.total_files += 1
+                    self.total_bytes += status['length']
+                    if status['replication'] < 3:
+                        self.total_under_replicated += 1
+                    # Write out as CSV:
+                    writer.writerow(status_to_ls(parent_path, status))
                 else:
-                    permissions, number_of_replicas, userid, groupid, filesize, modification_date, modification_time, filename = line.split(None, 7)
-                    filename = filename.strip()
-                    timestamp = datetime.datetime.strptime('%s %s' % (modification_date, modification_time), '%Y-%m-%d %H:%M')
-                    info = {
-                        'permissions' : permissions,
-                        'number_of_replicas': number_of_replicas,
-                        'userid': userid,
-                        'groupid': groupid,
-                        'filesize': filesize,
-                        'modified_at': timestamp.isoformat(),
-                        'filename': filename
-                    }
-                    # Skip directories:
-                    if permissions[0] != 'd':
-                        self.total_files += 1
-                        self.total_bytes += int(filesize)
-                        if int(number_of_replicas) < 3:
-                            self.total_under_replicated += 1
-                        # Write out as CSV:
-                        writer.writerow(info)
-                    else:
-                        self.total_directories += 1
+                    self.total_directories += 1
 
             # At this point, a temporary file has been written - now we need to check we are okay to move it into place
             if os.path.exists(self.output().path):
@@ -4,7 +4,6 @@ import glob
 import time
 import luigi
 import string
-import hashlib
 import datetime
 import threading
 import luigi.date_interval
@@ -12,6 +11,7 @@ import luigi.contrib.hdfs
 import luigi.contrib.hadoop_jar
 import shutil
 from tasks.common import logger, taskdb_target
+from lib.hashing import hash_file, hash_stream, HashingReader
 
 
 HDFS_PREFIX = os.environ.get('HDFS_PREFIX','')
@@ -65,13 +65,14 @@ class UploadFileToHDFS(luigi.Task):
         self.uploader(self.path, self.output().path)
 
     @staticmethod
-    def uploader(local_path, hdfs_path):
+    def uploader(local_path, hdfs_path, tee_hash=False):
         """
         Copy up to HDFS, making it suitably atomic by using a temporary filename during upload.
 
         Done as a static method to prevent accidental confusion of self.path/self.output().path etc.
 
-        :return: None
+        :param tee_hash: if set, hash the bytes as they are uploaded, and check the upload against the HDFS metadata
+        :return: the SHA-512 of the uploaded bytes if tee_hash is set, otherwise None
         """
         # Set up the HDFS client:
         client = luigi.contrib.hdfs.get_autoconfig_client(threading.local())
@@ -82,8 +83,17 @@ class UploadFileToHDFS(luigi.Task):
         # Now upload the file, allowing overwrites as this is a temporary file and
         # simultanous updates should not be possible:
         logger.info("Uploading as %s" % tmp_path)
-        with open(local_path, 'r') as f:
-            client.client.write(data=f, hdfs_path=tmp_path, overwrite=True)
+        with open(local_path, 'rb') as f:
+            local_stat = os.fstat(f.fileno())
+            data = HashingReader(f, size=local_stat.st_size) if tee_hash else f
+            client.client.write(data=data, hdfs_path=tmp_path, overwrite=True)
+
+        # Check the upload using the HDFS metadata, rather than downloading it again:
+        if tee_hash:
+            if os.stat(local_path).st_mtime != local_stat.st_mtime or data.bytes_read != local_stat.st_size:
+                raise Exception("Local file %s changed during upload!" % local_path)
+            UploadFileToHDFS.check_size(client, tmp_path, data.bytes_read)
+            tmp_checksum = client.client.checksum(tmp_path)
 
         # Check if the destination file exists and raise an exception if so:
         if client.exists(hdfs_path):
@@ -97,9 +107,26 @@ class UploadFileToHDFS(luigi.Task):
         time.sleep(2)
         status = client.client.status(hdfs_path)
 
+        # Check the file is the one we uploaded:
+        if tee_hash:
+            UploadFileToHDFS.check_size(client, hdfs_path, data.bytes_read)
+            checksum = client.client.checksum(hdfs_path)
+            if checksum != tmp_checksum:
+                raise Exception("HDFS checksum for %s changed from %s to %s on rename!" % (hdfs_path, tmp_checksum, checksum))
+            logger.info("HDFS checksum for %s is %s" % (hdfs_path, checksum))
+
         # Log successful upload:
         logger.info("Upload completed for %s" % hdfs_path)
 
+        if tee_hash:
+            return data.hexdigest()
+
+    @staticmethod
+    def check_size(client, hdfs_path, size):
+        status = client.client.status(hdfs_path)
+        if status['length'] != size:
+            raise Exception("HDFS file %s is %s bytes long, but %s bytes were uploaded!" % (hdfs_path, status['length'], size))
+
 
 
 class ForceUploadFileToHDFS(luigi.Task):
@@ -184,9 +211,8 @@ class CalculateLocalHash(luigi.Task):
     def run(self):
         logger.debug("file %s to hash" % (self.path))
 
-        t = luigi.LocalTarget(self.path)
-        with t.open('r') as reader:
-            file_hash = hashlib.sha512(reader.read()).hexdigest()
+        # Hash the raw bytes, a chunk at a time, so even large WARCs are not loaded into memory:
+        file_hash = hash_file(self.path)
 
         # test hash
         CalculateLocalHash.check_hash(self.path, file_hash)
@@ -203,6 +229,44 @@ class CalculateLocalHash(luigi.Task):
             raise Exception("%s hash not all hex [%s]" % (path, file_hash))
 
 
+class UploadAndHashFileToHDFS(luigi.Task):
+    """
+    Uploads the file to HDFS while hashing it, so the local file only has to be read once.
+
+    The upload is checked against the HDFS metadata (file size and checksum) rather than by downloading it again.
+    """
+    task_namespace = 'file'
+    job = luigi.Parameter()
+    launch_id = luigi.Parameter()
+    path = luigi.Parameter()
+    resources = { 'hdfs': 1 }
+
+    def requires(self):
+        return WarcFile(self.job, self.launch_id, self.path)
+
+    def output(self):
+        return hash_target(self.job, self.launch_id, "%s.streamed.sha512" % self.path)
+
+    def run(self):
+        hdfs_path = get_hdfs_path(self.path)
+        client = luigi.contrib.hdfs.get_autoconfig_client(threading.local())
+        if client.exists(hdfs_path):
+            # e.g. if a previous attempt failed after the rename, so fall back to hashing both copies:
+            logger.warning("%s is already on HDFS, so hashing both copies instead" % hdfs_path)
+            file_hash = hash_file(self.path)
+            with client.client.read(hdfs_path) as reader:
+                if hash_stream(reader) != file_hash:
+                    raise Exception("Local & HDFS hashes do not match for %s" % self.path)
+        else:
+            file_hash = UploadFileToHDFS.uploader(self.path, hdfs_path, tee_hash=True)
+
+        # test hash
+        CalculateLocalHash.check_hash(self.path, file_hash)
+
+        with self.output().open('w') as f:
+            f.write(file_hash)
+
+
 class CalculateHdfsHash(luigi.Task):
     task_namespace = 'file'
     job = luigi.Parameter()
@@ -224,7 +288,7 @@ class CalculateHdfsHash(luigi.Task):
         client = luigi.contrib.hdfs.get_autoconfig_client(threading.local())
         # Having to side-step the first client as it seems to be buggy/use an old API - note also confused put()
         with client.client.read(str(t.path)) as reader:
-            file_hash = hashlib.sha512(reader.read()).hexdigest()
+            file_hash = hash_stream(reader)
 
         # test hash
         CalculateLocalHash.check_hash(self.path, file_hash)
@@ -239,8 +303,11 @@ class MoveToHdfs(luigi.Task):
     launch_id = luigi.Parameter()
     path = luigi.Parameter()
     delete_local = luigi.BoolParameter(default=False)
+    hash_while_uploading = luigi.BoolParameter(default=False)
 
     def requires(self):
+        if self.hash_while_uploading:
+            return [ UploadAndHashFileToHDFS(self.job, self.launch_id, self.path) ]
         return [ CalculateLocalHash(self.job, self.launch_id, self.path),
                  CalculateHdfsHash(self.job, self.launch_id, self.path) ]
 
@@ -248,17 +315,23 @@ class MoveToHdfs(luigi.Task):
         return hash_target(self.job, self.launch_id, "%s.transferred" % self.path)
 
     def run(self):
-        # Read in sha512
-        with self.input()[0].open('r') as f:
-            local_hash = f.readline()
-        logger.info("Got local hash %s" % local_hash)
-        # Re-download and get the hash
-        with self.input()[1].open('r') as f:
-            hdfs_hash = f.readline()
-        logger.info("Got HDFS hash %s" % hdfs_hash)
-
-        if local_hash != hdfs_hash:
-            raise Exception("Local & HDFS hashes do not match for %s" % self.path)
+        if self.hash_while_uploading:
+            # The upload was hashed as it went, and checked against the HDFS metadata:
+            with self.input()[0].open('r') as f:
+                hdfs_hash = f.readline()
+            logger.info("Got streamed hash %s" % hdfs_hash)
+        else:
+            # Read in sha512
+            with self.input()[0].open('r') as f:
+                local_hash = f.readline()
+            logger.info("Got local hash %s" % local_hash)
+            # Re-download and get the hash
+            with self.input()[1].open('r') as f:
+                hdfs_hash = f.readline()
+            logger.info("Got HDFS hash %s" % hdfs_hash)
+
+            if local_hash != hdfs_hash:
+                raise Exception("Local & HDFS hashes do not match for %s" % self.path)
 
         # Otherwise, move to hdfs was good, so delete:
         if self.delete_local:
@@ -274,10 +347,11 @@ class MoveToHdfsIfOld(luigi.Task):
     launch_id = luigi.Parameter()
     path = luigi.Parameter()
     delete_local = luigi.BoolParameter(default=False)
+    hash_while_uploading = luigi.BoolParameter(default=False)
 
     # Use the output of the underlying MoveToHdfs call:
     def output(self):
-        return MoveToHdfs(self.job, self.launch_id, self.path, self.delete_local).output()
+        return MoveToHdfs(self.job, self.launch_id, self.path, self.delete_local, self.hash_while_uploading).output()
 
     # Call the MoveToHdfs task as a dynamic dependency:
     def run(self):
@@ -286,7 +360,7 @@ class MoveToHdfsIfOld(luigi.Task):
             logger.info("But this file is too young to assume we're done: %s " % self.path)
             return PendingFile(self.job, self.launch_id, self.path)
         # Okay to move:
-        return MoveToHdfs(self.job, self.launch_id, self.path, self.delete_local)
+        return MoveToHdfs(self.job, self.launch_id, self.path, self.delete_local, self.hash_while_uploading)
 
 
 class MoveToWarcsFolder(luigi.Task):
@@ -322,6 +396,7 @@ class MoveFilesForLaunch(luigi.WrapperTask):
     job = luigi.Parameter()
     launch_id = luigi.Parameter()
     delete_local = luigi.BoolParameter(default=False)
+    hash_while_uploading = luigi.BoolParameter(default=False)
 
     def requires(self):
         logger.info("Looking in %s %s" % ( self.job, self.launch_id))
@@ -340,7 +415,7 @@ class MoveFilesForLaunch(luigi.WrapperTask):
             logger.info("GLOB:%s" % glob_path)
             for item in glob.glob("%s/%s/%s/%s/*.warc.gz" % (CRAWL_OUTPUT_FOLDER, self.job, self.launch_id, out_type)):
                 logger.info("ITEM:%s" % item)
-                tasks.append(MoveToHdfs(self.job, self.launch_id, item, self.delete_local))
+                tasks.append(MoveToHdfs(self.job, self.launch_id, item, self.delete_local, self.hash_while_uploading))
         # Yield these as a group, so they can run in parallel:
         if len(tasks) > 0:
             yield tasks
@@ -353,9 +428,11 @@ class MoveFilesForLaunch(luigi.WrapperTask):
             elif os.path.splitext(log_item)[1] == '.log':
                 # Only move files with the '.log' suffix if this job is no-longer running:
                 logger.info("Using MoveToHdfsIfOld for %s" % log_item)
-                tasks.append(MoveToHdfsIfOld(self.job, self.launch_id, log_item, self.delete_local))
+                tasks.append(MoveToHdfsIfOld(self.job, self.launch_id, log_item, self.delete_local,
+                                             self.hash_while_uploading))
             else:
-                tasks.append(MoveToHdfs(self.job, self.launch_id, log_item, self.delete_local))
+                tasks.append(MoveToHdfs(self.job, self.launch_id, log_item, self.delete_local,
+                                        self.hash_while_uploading))
         # Yield these as a group, so any MoveToHdfsIfStopped jobs don't prevent MoveToHdfs from running
         if len(tasks) > 0:
             yield tasks
@@ -410,13 +487,14 @@ class ScanForFilesToMove(ScanForLaunches):
     This scans for files associated with a particular launch of a given job and starts MoveToHdfs for each,
     """
     delete_local = luigi.BoolParameter(default=False)
+    hash_while_uploading = luigi.BoolParameter(default=False)
 
     task_namespace = 'scan'
     scan_name = 'move-to-hdfs'
 
     def scan_job_launch(self, job, launch):
         logger.info("Looking at moving files for %s %s" %(job, launch))
-        yield MoveFilesForLaunch(job, launch, self.delete_local)
+        yield MoveFilesForLaunch(job, launch, self.delete_local, self.hash_while_uploading)
 
 
 if __name__ == '__main__':
@@ -17,13 +17,15 @@ from tasks.common import state_file
 class DailyIngestTasks(luigi.WrapperTask):
     """
     Daily ingest tasks, should generally be a few hours ahead of the access-side tasks (below):
+
+    The HDFS reports are updated with the day's changes to the listing, rather than rebuilt from all of it.
     """
     def requires(self):
         return [BackupProductionW3ACTPostgres(),
                 BackupProductionShinePostgres(),
                 CopyFileListToHDFS(),
-                #GenerateHDFSSummaries(),
-                GenerateHDFSReports()]
+                #GenerateHDFSSummaries(incremental=True),
+                GenerateHDFSReports(incremental=True)]
 
 
 class DailyAccessTasks(luigi.WrapperTask):